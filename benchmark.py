@@ -0,0 +1,166 @@
+"""
+Client benchmarks
+
+Measures the climate.py hot paths and the Flask routes against the local
+stand-in server in mock_server.py:
+
+- pagination: fields listed per second through iter_fields
+- fetch_contents: MB/s downloading activity contents, sequential and parallel
+- upload: MB/s uploading a file
+- routes: requests per second served by the /home and /field pages
+
+Run with:
+
+    python3 benchmark.py --latency 0.02 --json bench.json
+
+Each result is printed as "name value unit" and, with --json, also written
+as a JSON list so CI can compare runs.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import time
+
+from logger import Logger
+from mock_server import MockClimateServer, MockConfig, use_server
+
+MB = 1024 * 1024
+
+
+def timed(fn):
+    """
+    :return: (result of fn(), seconds taken)
+    """
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def check(condition, message):
+    """
+    Fails the run when a benchmarked call gave a wrong result. Not an assert,
+    which python -O strips.
+    """
+    if not condition:
+        raise RuntimeError(message)
+
+
+def bench_pagination(client, fields):
+    count, elapsed = timed(lambda: sum(1 for _ in client.iter_fields()))
+    check(count == fields,
+          'listed {} fields, expected {}'.format(count, fields))
+    return count / elapsed
+
+
+def bench_fetch_contents(client, length, concurrency):
+    def download():
+        chunks = client.get_activity_contents('asPlanted', 'asPlanted-0',
+                                              length,
+                                              concurrency=concurrency)
+        return sum(len(chunk) for chunk in chunks)
+
+    received, elapsed = timed(download)
+    check(received == length,
+          'received {} bytes, expected {}'.format(received, length))
+    return length / MB / elapsed
+
+
+def bench_upload(client, length):
+    f = io.BytesIO(os.urandom(length))
+    result, elapsed = timed(
+        lambda: client.upload(f, 'application/octet-stream'))
+    check(result.success, 'upload failed: {}'.format(result))
+    return length / MB / elapsed
+
+
+def bench_routes(client, requests):
+    import climate
+    import main
+    from tokens import TokenManager
+
+    # Measure the routes, not the quota main.py configures.
+    climate.configure(rate_limiter=None)
+    app = main.app.test_client()
+    fields = client.get_fields()
+    tokens = TokenManager('benchmark', 'benchmark', user_id='user-1')
+    tokens.update({'access_token': client.token,
+                   'refresh_token': 'refresh',
+                   'user': {'id': 'user-1', 'firstname': 'Mock',
+                            'lastname': 'User'}})
+    with main.app.test_request_context():
+        main.set_state(user=tokens.user, tokens=tokens)
+        sid = main.session_id()
+    main.field_catalog('user-1').update(fields)
+    with app.session_transaction() as session:
+        session['sid'] = sid
+    paths = ['/home'] + ['/field/{}'.format(f['id'])
+                         for f in fields[:requests - 1]]
+
+    def serve():
+        for path in paths:
+            status = app.get(path).status_code
+            check(status == 200, '{} returned {}'.format(path, status))
+
+    _, elapsed = timed(serve)
+    return len(paths) / elapsed
+
+
+def main_benchmark(args):
+    for name in ('CLIMATE_API_ID', 'CLIMATE_API_SECRET', 'CLIMATE_API_KEY',
+                 'CLIMATE_API_SCOPES'):
+        os.environ.setdefault(name, 'benchmark')
+    logger = logging.getLogger('benchmark')
+    Logger(logger)
+    logger.setLevel(logging.WARNING)
+
+    import climate
+
+    config = MockConfig(fields=args.fields,
+                        content_length=args.size * MB,
+                        latency=args.latency,
+                        bandwidth=args.bandwidth)
+    server = MockClimateServer(config).start()
+    use_server(server)
+    client = climate.ClimateClient('token', 'benchmark')
+
+    results = [
+        ('pagination', bench_pagination(client, args.fields), 'records/s'),
+        ('fetch_contents_sequential',
+         bench_fetch_contents(client, config.content_length, 1), 'MB/s'),
+        ('fetch_contents_parallel',
+         bench_fetch_contents(client, config.content_length,
+                              args.concurrency), 'MB/s'),
+        ('upload', bench_upload(client, config.content_length), 'MB/s'),
+        ('routes', bench_routes(client, args.requests), 'requests/s'),
+    ]
+    server.stop()
+
+    for name, value, unit in results:
+        print('{} {:.1f} {}'.format(name, value, unit))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([{'name': name, 'value': value, 'unit': unit}
+                       for name, value, unit in results], f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--fields', type=int, default=5000)
+    parser.add_argument('--size', type=int, default=16,
+                        help='contents and upload size in MiB')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='range requests in flight for fetch_contents')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='Flask route requests to time')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every mock response')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='bytes per second for mock bodies')
+    parser.add_argument('--json', help='also write results to this file')
+    main_benchmark(parser.parse_args())
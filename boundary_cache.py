@@ -0,0 +1,116 @@
+"""
+Boundary cache
+
+Field boundaries are immutable: when a field's boundary changes it is given a
+new boundaryId. A boundary fetched once can therefore be kept forever under
+its id, and entries are only ever dropped to bound the cache size.
+
+The cache has two tiers: a bounded in-memory LRU, and an optional SQLite
+file on local disk that survives restarts (sqlite_lru.SQLiteLRU). Disk reads
+and writes happen outside the lock of the memory tier.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import json
+import threading
+from collections import OrderedDict
+
+from sqlite_lru import SQLiteLRU
+
+
+class BoundaryCache:
+    """
+    Two tier boundary cache keyed by boundary_id. Safe to share between
+    threads. Returned boundaries are shared, so callers must not modify them.
+    """
+
+    def __init__(self, capacity=1024, path=None, disk_capacity=None):
+        """
+        :param capacity: Max number of boundaries kept in memory.
+        :param path: Optional SQLite file for the disk tier, created with
+            mode 0600. Keep it in a directory only the app's user can access.
+        :param disk_capacity: Max number of boundaries kept on disk, or None
+            for no limit.
+        """
+        self.capacity = capacity
+        self.disk_capacity = disk_capacity
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if path:
+            self._disk = SQLiteLRU(path, 'boundaries', 'id',
+                                   [('boundary', 'TEXT')],
+                                   capacity=disk_capacity, private=True)
+
+    def __contains__(self, boundary_id):
+        with self._lock:
+            if boundary_id in self._entries:
+                return True
+        return self._disk is not None and boundary_id in self._disk
+
+    def get(self, boundary_id):
+        """
+        :return: The cached boundary, or None.
+        """
+        with self._lock:
+            boundary = self._entries.get(boundary_id)
+            if boundary is not None:
+                self._entries.move_to_end(boundary_id)
+                self.memory_hits += 1
+                return boundary
+
+        boundary = self._disk_get(boundary_id)
+        with self._lock:
+            if boundary is not None:
+                self._memory_put(boundary_id, boundary)
+                self.disk_hits += 1
+                return boundary
+
+            self.misses += 1
+            return None
+
+    def put(self, boundary_id, boundary):
+        """
+        Stores a boundary in both tiers.
+        """
+        with self._lock:
+            self._memory_put(boundary_id, boundary)
+        self._disk_put(boundary_id, boundary)
+
+    def stats(self):
+        """
+        :return: dict of hit/miss counters and the number of entries in
+            memory.
+        """
+        with self._lock:
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': len(self._entries)
+            }
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+
+    def _memory_put(self, boundary_id, boundary):
+        self._entries[boundary_id] = boundary
+        self._entries.move_to_end(boundary_id)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def _disk_get(self, boundary_id):
+        if self._disk is None:
+            return None
+        row = self._disk.get(boundary_id)
+        return json.loads(row[0]) if row is not None else None
+
+    def _disk_put(self, boundary_id, boundary):
+        if self._disk is not None:
+            self._disk.put(boundary_id, (json.dumps(boundary),))
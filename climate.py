@@ -7,6 +7,14 @@ Climate API demo code. This module shows how to:
 - Fetch field boundaries
 - Upload files
 
+All calls go through a ClimateClient, which keeps a pooled keep-alive
+requests.Session so consecutive calls reuse the same TCP+TLS connection. The
+module level functions are thin wrappers around a client sharing one
+default session.
+
+Failed calls are retried and endpoints that keep failing are short-circuited
+according to the policy in resilience.py.
+
 License:
 Copyright © 2018 The Climate Corporation
 """
@@ -14,11 +22,26 @@ Copyright © 2018 The Climate Corporation
 import requests
 
 import file
+import hashlib
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from base64 import b64encode
 from urllib.parse import urlencode
-from curlify import to_curl
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.response import HTTPResponse
+from requests.structures import CaseInsensitiveDict
 from logger import Logger
+import compression
+import metrics
+from http_cache import cache_key, cacheable, conditional_headers
+from json_stream import iter_results, STREAM_CHUNK_SIZE
+from request_log import body_length, log_response, response_sizes
+from resilience import (CircuitBreakers, CircuitOpenError, RetryPolicy,
+                        retry_after_seconds)
+from uploads import UploadResult, rejected
 
 
 json_content_type = 'application/json'
@@ -28,6 +51,24 @@ base_login_uri = 'https://climate.com/static/app-login/index.html'
 token_uri = 'https://api.climate.com/api/oauth/token'
 api_uri = 'https://platform.climate.com'
 CHUNK_SIZE = 5 * 1024 * 1024
+DEFAULT_POOL_SIZE = 10
+DOWNLOAD_CHUNK_SIZE = 1 * 1024 * 1024
+DOWNLOAD_CONCURRENCY = 4
+BOUNDARY_CONCURRENCY = 8
+ACTIVITY_PAGE_SIZE = 10
+OBSERVATION_PAGE_SIZE = 100
+UPLOAD_CONCURRENCY = 4
+UPLOAD_RETRIES = 3
+UPLOAD_RETRY_DELAY = 1
+# Seconds to wait for a connection, and between bytes of a response, before
+# a call fails with requests.Timeout.
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 60
+
+# Shared by all clients unless configured otherwise, so every call to an
+# endpoint counts towards the same circuit breaker.
+default_retry_policy = RetryPolicy()
+default_breakers = CircuitBreakers()
 
 
 def login_uri(client_id, scopes, redirect_uri):
@@ -58,348 +99,1169 @@ def authorization_header(client_id, client_secret):
     return 'Basic {}'.format(encoded)
 
 
-def authorize(login_code, client_id, client_secret, redirect_uri):
+def bearer_token(token):
     """
-    Exchanges the login code provided on the redirect request for an
-    access_token and refresh_token. Also gets user data.
-    :param login_code: Authorization code returned from Log In with FieldView
-        on redirect uri.
-    :param client_id: Provided by Climate.
-    :param client_secret: Provided by Climate.
-    :param redirect_uri: Uri to your redirect page. Needs to be the same as
-        the redirect uri provided in the initial Log In with FieldView request.
-    :return: Object containing user data, access_token and refresh_token.
+    Returns content of authorization header to be provided on all non-auth
+    API calls.
+    :param token: access_token returned from authorization call.
+    :return: Formatted header.
     """
-    headers = {
-        'authorization': authorization_header(client_id, client_secret),
-        'content-type': 'application/x-www-form-urlencoded',
-        'accept': 'application/json'
-    }
-    data = {
-        'grant_type': 'authorization_code',
-        'redirect_uri': redirect_uri,
-        'code': login_code
-    }
-    res = requests.post(token_uri, headers=headers, data=urlencode(data))
-    Logger().info(to_curl(res.request))
-    if res.status_code == 200:
-        return res.json()
-
-    Logger().error("Auth failed: %s" % res.status_code)
-    Logger().error("Auth failed: %s" % res.json())
-    return None
+    return 'Bearer {}'.format(token)
 
 
-def reauthorize(refresh_token, client_id, client_secret):
+def pooled_session(pool_size=DEFAULT_POOL_SIZE):
     """
-    Access_tokens expire after 4 hours. At any point before the end of that
-    period you may request a new access_token (and refresh_token) by submitting
-    a POST request to the /api/oauth/token end-point. Note that the data
-    submitted is slightly different than on initial authorization. Refresh
-    tokens are good for 30 days from their date of issue. Once this end-point
-    is called, the refresh token that is passed to this call is immediately set
-    to expired one hour from "now" and the newly issues refresh token will
-    expire 30 days from "now". Make sure to store the new refresh token so you
-    can use it in the future to get a new auth tokens as needed. If you lose
-    the refresh token there is no effective way to retrieve a new refresh token
-    without having the user log in again.
-    :param refresh_token: refresh_token supplied by initial
-        (or subsequent refresh) call.
-    :param client_id: Provided by Climate.
-    :param client_secret: Provided by Climate.
-    :return: Object containing user data, access_token and refresh_token.
+    Builds a requests.Session whose connection pool keeps up to pool_size
+    keep-alive connections per host, and which accepts every response coding
+    urllib3 can decode.
+    :param pool_size: Max number of pooled connections per host.
+    :return: requests.Session
     """
-    headers = {
-        'authorization': authorization_header(client_id, client_secret),
-        'content-type': 'application/x-www-form-urlencoded',
-        'accept': 'application/json'
-    }
-    data = {
-        'grant_type': 'refresh_token',
-        'refresh_token': refresh_token
-    }
-    res = requests.post(token_uri, headers=headers, data=urlencode(data))
-    Logger().info(to_curl(res.request))
-    if res.status_code == 200:
-        return res.json()
-    
-    log_http_error(res)
-    return None
+    session = requests.Session()
+    session.headers['Accept-Encoding'] = compression.accept_encoding(
+        HTTPResponse.CONTENT_DECODERS)
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
 
-def bearer_token(token):
+class PageIterator:
     """
-    Returns content of authorization header to be provided on all non-auth
-    API calls.
-    :param token: access_token returned from authorization call.
-    :return: Formatted header.
+    Iterates over the records of a paginated listing without recursion,
+    holding only one page in memory at a time. A 206 response means there is
+    more data and its x-next-token header marks the next page; a 200 response
+    is the last page.
+
+    next_token is the token to pass back to resume the listing. It only
+    advances once every record of a page has been yielded, so stopping
+    mid-page and resuming repeats that page rather than losing the rest of
+    it. done is True once the last page was read, and status_code holds the
+    status of the last response.
+
+    With stream=True each page is requested as a streamed response and its
+    records are decoded one at a time as the body arrives (see
+    json_stream), so memory is bounded by a single record rather than a
+    page.
     """
-    return 'Bearer {}'.format(token)
 
-
-def get_fields(token, api_key, next_token=None):
+    def __init__(self, fetch_page, next_token=None, stream=False):
+        """
+        :param fetch_page: Callable taking a next_token (or None) and a
+            stream flag, and returning the response for that page.
+        :param next_token: Pagination token to start from, or None.
+        :param stream: Decode records incrementally from a streamed body.
+        """
+        self.next_token = next_token
+        self.done = False
+        self.status_code = None
+        self.stream = stream
+        self._fetch_page = fetch_page
+
+    def __iter__(self):
+        for page in self.pages():
+            yield from page
+
+    def pages(self):
+        """
+        Yields each page of results as a list, or as an iterator decoding
+        the page's records when streaming.
+        """
+        while not self.done:
+            res = self._fetch_page(self.next_token, self.stream)
+            self.status_code = res.status_code
+            if res.status_code not in (200, 206):
+                log_http_error(res)
+                return
+
+            if self.stream:
+                with res:
+                    yield iter_results(res.iter_content(STREAM_CHUNK_SIZE))
+            else:
+                yield res.json()['results']
+
+            if res.status_code == 200:
+                self.done = True
+                self.next_token = res.headers.get('x-next-token',
+                                                  self.next_token)
+            else:
+                self.next_token = res.headers['x-next-token']
+
+
+class ClimateClient:
     """
-    Retrieve a user's field list from Climate. Note that fields
-    (like most data) is paginated to support very large
-    data sets. If the status code returned is 206 (partial content), then
-    there is more data to get. The x-next-token header provides a "marker"
-    that can be used on another request to get the next page of data.
-    Continue fetching data until the status is 200. Note that x-next-token
-    is based on date modified, so storing x-next-token can used as a method
-    to fetch updates over longer periods of time (though also note that this
-    will not result in fetching deleted objects since they no longer appear in
-    lists regardless of their modified date).
-    :param token: access_token
-    :param api_key: Provided by Climate.
-    :param next_token: Pagination token from previous request, or None.
-    :return: A (possibly empty) list of fields.
+    Client for the Climate API. Holds a pooled requests.Session together with
+    the access_token and api_key used on every call. A client is cheap to
+    create when an existing session is passed in, so per-user clients can
+    share one pool.
     """
-    uri = '{}/v4/fields'.format(api_uri)
-    headers = {
-        'authorization': bearer_token(token),
-        'accept': json_content_type,
-        'x-api-key': api_key,
-        'x-next-token': next_token
-    }
 
-    res = requests.get(uri, headers=headers)
-    Logger().info(to_curl(res.request))
+    def __init__(self, token=None, api_key=None,
+                 pool_size=DEFAULT_POOL_SIZE, session=None,
+                 boundary_cache=None, retry_policy=None, breakers=None,
+                 rate_limiter=None, validator_cache=None,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        """
+        :param token: access_token, or a tokens.TokenManager that keeps it
+            valid. With a TokenManager, calls rejected with 401 are retried
+            once after a refresh.
+        :param api_key: Provided by Climate.
+        :param pool_size: Max number of pooled connections per host. Ignored
+            when session is given.
+        :param session: Optional requests.Session to share between clients.
+            It is left open by close.
+        :param boundary_cache: Optional boundary_cache.BoundaryCache used by
+            get_boundary.
+        :param retry_policy: resilience.RetryPolicy, default_retry_policy
+            when None.
+        :param breakers: resilience.CircuitBreakers, default_breakers when
+            None.
+        :param rate_limiter: Optional rate_limit.RateLimiter every call
+            waits on before it is sent.
+        :param validator_cache: Optional http_cache.ValidatorCache. GETs of
+            pages cached there are made conditional, and a 304 is answered
+            with the cached response.
+        :param timeout: requests timeout of every call: seconds, or a
+            (connect, read) tuple. A call that times out counts as a failure
+            for its circuit breaker and is retried like a connection error.
+            A timeout passed to request overrides it.
+        """
+        self.token_manager = None
+        if hasattr(token, 'get_access_token'):
+            self.token_manager, token = token, None
+        self.token = token
+        self.api_key = api_key
+        self.session = session or pooled_session(pool_size)
+        self._owns_session = session is None
+        self.boundary_cache = boundary_cache
+        self.retry_policy = retry_policy or default_retry_policy
+        self.breakers = breakers or default_breakers
+        self.rate_limiter = rate_limiter
+        self.validator_cache = validator_cache
+        self.timeout = timeout
+
+    def close(self):
+        if self._owns_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def headers(self, **extra):
+        """
+        Builds the headers sent on all non-auth API calls.
+        :param extra: Additional headers. Underscores in names are replaced
+            with dashes; None values are dropped by requests.
+        :return: dict of headers.
+        """
+        headers = {
+            'authorization': self.bearer(),
+            'x-api-key': self.api_key
+        }
+        for name, value in extra.items():
+            headers[name.replace('_', '-')] = value
+        return headers
+
+    def bearer(self):
+        """
+        :return: authorization header for the current access_token,
+            refreshed first by the token manager if it is about to expire.
+        """
+        if self.token_manager:
+            return bearer_token(self.token_manager.get_access_token())
+        return bearer_token(self.token)
+
+    def request(self, endpoint, method, uri, headers=None, retry=True,
+                **kwargs):
+        """
+        Sends a request over the pooled session, once the rate_limiter (if
+        any) allows it, and records it. Failures are
+        retried according to retry_policy, and the call fails fast with
+        resilience.CircuitOpenError while the endpoint's circuit breaker is
+        open. With a token manager, a 401 on a bearer authenticated call
+        triggers a refresh (shared with any other thread that got the same
+        401) and one retry with the new access_token.
+        :param endpoint: Short endpoint name used for metrics, logging and
+            circuit breaking.
+        :param method: HTTP method.
+        :param uri: Request uri.
+        :param headers: Request headers.
+        :param retry: False to make a single attempt, for callers that retry
+            themselves.
+        :param kwargs: Passed on to requests.
+        :return: requests.Response
+        """
+        key = entry = None
+        if self.validator_cache is not None and method == 'GET' and \
+                'range' not in CaseInsensitiveDict(headers or {}):
+            key = cache_key(self._cache_user(), uri, kwargs.get('params'),
+                            headers)
+            entry = self.validator_cache.get(key)
+            if entry is not None:
+                headers = dict(headers or {}, **conditional_headers(entry))
+
+        res = self._call(endpoint, method, uri, headers, retry, **kwargs)
+        authorization = (headers or {}).get('authorization') or ''
+        if res.status_code == 401 and self.token_manager and \
+                authorization.startswith('Bearer '):
+            stale = authorization[len('Bearer '):]
+            if self.token_manager.refresh(stale):
+                headers = dict(headers, authorization=self.bearer())
+                res.close()
+                res = self._call(endpoint, method, uri, headers, retry,
+                                 **kwargs)
+        if key is not None:
+            res = self._revalidated(key, entry, res, kwargs.get('stream'))
+        return res
+
+    def _cache_user(self):
+        """
+        :return: Who validator_cache entries and upload progress belong
+            to: the token manager's user id, or a hash of the access_token.
+        """
+        if self.token_manager:
+            return self.token_manager.user_id
+        token = self.token or ''
+        return hashlib.sha1(token.encode('utf-8')).hexdigest()[:16]
+
+    def _revalidated(self, key, entry, res, stream):
+        """
+        Serves the cached response for a 304, and caches the body of a
+        validated 200/206. Streamed bodies are not read to be cached.
+        """
+        if entry is not None:
+            self.validator_cache.record(res.status_code == 304)
+            if res.status_code == 304:
+                return cached_response(entry, res)
+        if not stream and cacheable(res.status_code, res.headers):
+            self.validator_cache.put(key, res.status_code, res.headers,
+                                     res.content)
+        return res
+
+    def _call(self, endpoint, method, uri, headers, retry, **kwargs):
+        breaker = self.breakers.get(endpoint)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(
+                    'Circuit open for {}, not calling {}'.format(endpoint,
+                                                                 uri))
+            try:
+                res = self._send(endpoint, method, uri, headers, **kwargs)
+            except requests.RequestException as e:
+                breaker.failure()
+                if not (retry and
+                        self.retry_policy.should_retry(method, attempt)):
+                    raise
+                res, reason = None, e
+            else:
+                if res.status_code >= 500:
+                    breaker.failure()
+                else:
+                    breaker.success()
+                if not (retry and self.retry_policy.should_retry(
+                        method, attempt, res.status_code)):
+                    return res
+                reason = res.status_code
+                res.close()
+            delay = self.retry_policy.delay(attempt, res)
+            Logger().warning('Retrying {} {} in {:.1f}s after {}'.format(
+                endpoint, method, delay, reason))
+            time.sleep(delay)
+            attempt += 1
+
+    def _send(self, endpoint, method, uri, headers, **kwargs):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(endpoint)
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.monotonic()
+        try:
+            res = self.session.request(method, uri, headers=headers,
+                                       **kwargs)
+        except requests.RequestException:
+            metrics.record(endpoint, 0, body_length(kwargs.get('data')), None,
+                           time.monotonic() - started)
+            raise
+        observe(res, endpoint)
+        return res
+
+    def authorize(self, login_code, client_id, client_secret, redirect_uri):
+        """
+        Exchanges the login code provided on the redirect request for an
+        access_token and refresh_token. Also gets user data.
+        :param login_code: Authorization code returned from Log In with
+            FieldView on redirect uri.
+        :param client_id: Provided by Climate.
+        :param client_secret: Provided by Climate.
+        :param redirect_uri: Uri to your redirect page. Needs to be the same as
+            the redirect uri provided in the initial Log In with FieldView
+            request.
+        :return: Object containing user data, access_token and refresh_token.
+        """
+        headers = {
+            'authorization': authorization_header(client_id, client_secret),
+            'content-type': 'application/x-www-form-urlencoded',
+            'accept': 'application/json'
+        }
+        data = {
+            'grant_type': 'authorization_code',
+            'redirect_uri': redirect_uri,
+            'code': login_code
+        }
+        res = self.request('token', 'POST', token_uri, headers=headers,
+                           data=urlencode(data))
+        if res.status_code == 200:
+            return res.json()
+
+        Logger().error("Auth failed: %s" % res.status_code)
+        Logger().error("Auth failed: %s" % res.json())
+        return None
+
+    def reauthorize(self, refresh_token, client_id, client_secret):
+        """
+        Access_tokens expire after 4 hours. At any point before the end of that
+        period you may request a new access_token (and refresh_token) by
+        submitting a POST request to the /api/oauth/token end-point. Note that
+        the data submitted is slightly different than on initial
+        authorization. Refresh tokens are good for 30 days from their date of
+        issue. Once this end-point is called, the refresh token that is passed
+        to this call is immediately set to expired one hour from "now" and the
+        newly issues refresh token will expire 30 days from "now". Make sure
+        to store the new refresh token so you can use it in the future to get
+        a new auth tokens as needed. If you lose the refresh token there is no
+        effective way to retrieve a new refresh token without having the user
+        log in again.
+        :param refresh_token: refresh_token supplied by initial
+            (or subsequent refresh) call.
+        :param client_id: Provided by Climate.
+        :param client_secret: Provided by Climate.
+        :return: Object containing user data, access_token and refresh_token.
+        """
+        headers = {
+            'authorization': authorization_header(client_id, client_secret),
+            'content-type': 'application/x-www-form-urlencoded',
+            'accept': 'application/json'
+        }
+        data = {
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh_token
+        }
+        res = self.request('token', 'POST', token_uri, headers=headers,
+                           data=urlencode(data))
+        if res.status_code == 200:
+            return res.json()
+
+        log_http_error(res)
+        return None
+
+    def get_fields(self, next_token=None):
+        """
+        Retrieve a user's field list from Climate. Note that fields
+        (like most data) is paginated to support very large
+        data sets. If the status code returned is 206 (partial content), then
+        there is more data to get. The x-next-token header provides a "marker"
+        that can be used on another request to get the next page of data.
+        Continue fetching data until the status is 200. Note that x-next-token
+        is based on date modified, so storing x-next-token can used as a method
+        to fetch updates over longer periods of time (though also note that
+        this will not result in fetching deleted objects since they no longer
+        appear in lists regardless of their modified date).
+        :param next_token: Pagination token from previous request, or None.
+        :return: A (possibly empty) list of fields.
+        """
+        return list(self.iter_fields(next_token))
+
+    def iter_fields(self, next_token=None, stream=False):
+        """
+        Same as get_fields, but yields fields page by page instead of
+        building the whole list. The returned PageIterator exposes the last
+        x-next-token so the listing can be stopped and resumed later.
+        :param next_token: Pagination token from previous request, or None.
+        :param stream: Decode fields one at a time as each page arrives.
+        :return: PageIterator over fields.
+        """
+        uri = '{}/v4/fields'.format(api_uri)
+
+        def fetch_page(token, stream):
+            headers = self.headers(accept=json_content_type,
+                                   x_next_token=token)
+            res = self.request('fields', 'GET', uri, headers=headers,
+                               stream=stream)
+            return res
+
+        return PageIterator(fetch_page, next_token, stream)
+
+    def get_boundary(self, boundary_id):
+        """
+        Retrieve field boundary from Climate. Note that boundary objects are
+        immutable, so whenever a field's boundary is updated the boundaryId
+        property of the field will change and you will need to fetch the
+        updated boundary. That also means a boundary never goes stale, so
+        when the client has a boundary_cache it is served from there after
+        the first fetch.
+        :param boundary_id: UUID of field boundary to retrieve.
+        :return: geojson object representing the boundary of the field.
+        """
+        if self.boundary_cache is not None:
+            boundary = self.boundary_cache.get(boundary_id)
+            if boundary is not None:
+                return boundary
+        return self._fetch_boundary(boundary_id)
+
+    def _fetch_boundary(self, boundary_id):
+        """
+        Fetches a boundary from Climate, bypassing the boundary_cache for the
+        lookup but storing the result in it.
+        """
+        uri = '{}/v4/boundaries/{}'.format(api_uri, boundary_id)
+        headers = self.headers(accept=json_content_type)
+
+        res = self.request('boundaries', 'GET', uri, headers=headers)
+
+        if res.status_code == 200:
+            boundary = res.json()
+            if self.boundary_cache is not None:
+                self.boundary_cache.put(boundary_id, boundary)
+            return boundary
+
+        log_http_error(res)
+        return None
+
+    def get_boundaries(self, boundary_ids, concurrency=BOUNDARY_CONCURRENCY):
+        """
+        Retrieve many field boundaries. Ids are deduplicated, boundaries
+        already in the boundary_cache are served from it, and the rest are
+        fetched concurrently on up to concurrency threads (and cached).
+        :param boundary_ids: iterable of boundary UUIDs.
+        :param concurrency: Max number of boundary requests in flight.
+        :return: dict of boundary_id to geojson object, or None for a
+            boundary that could not be fetched.
+        """
+        boundaries = {}
+        missing = []
+        for boundary_id in dict.fromkeys(boundary_ids):
+            boundary = None
+            if self.boundary_cache is not None:
+                boundary = self.boundary_cache.get(boundary_id)
+            if boundary is None:
+                missing.append(boundary_id)
+            else:
+                boundaries[boundary_id] = boundary
+
+        if missing:
+            workers = max(1, min(concurrency, len(missing)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                boundaries.update(zip(missing, executor.map(
+                    self._fetch_boundary, missing)))
+        return boundaries
+
+    def prefetch_boundaries(self, fields, concurrency=BOUNDARY_CONCURRENCY):
+        """
+        Fetches the boundaries of fields into the boundary_cache so that
+        later get_boundary calls for them need no API call.
+        :param fields: list of fields as returned by get_fields.
+        :param concurrency: Max number of boundary requests in flight.
+        :return: dict of boundary_id to geojson object, see get_boundaries.
+        """
+        return self.get_boundaries((f['boundaryId'] for f in fields
+                                    if f.get('boundaryId')), concurrency)
+
+    def upload(self, f, content_type, concurrency=UPLOAD_CONCURRENCY,
+               retries=UPLOAD_RETRIES, progress=None, digest=None,
+               compress=False):
+        """Upload a file with the given content type to Climate
+
+        The file is sent in chunks of CHUNK_SIZE (5 MiB), up to concurrency
+        chunks at a time. A chunk that fails is retried on its own, up to
+        retries times with exponential backoff. When a progress store
+        (uploads.UploadProgress) is given, acknowledged chunks are recorded
+        so that uploading the same file again after an interruption reuses
+        the upload id and only sends the missing chunks. When Climate
+        refuses the resumed upload id (e.g. 404 once it expired), the
+        progress is dropped and the file is uploaded again under a new id.
+
+        The md5 and length are computed in one pass over f before sending,
+        so the file is read twice. Pass digest=(md5, length) when it is
+        already known (see upload_file) to read it only once.
+
+        With compress=True, chunks are sent gzipped (Content-Encoding: gzip)
+        unless content_type is compressed already (e.g. application/zip) or
+        a chunk does not shrink.
+
+        Returns an uploads.UploadResult.
+        """
+        if digest:
+            md5, length = digest
+        else:
+            md5, length = file.md5_and_length(f)
+
+        user = self._cache_user()
+        upload_id, acknowledged = None, set()
+        if progress:
+            upload_id, acknowledged = progress.load(user, md5, length,
+                                                    content_type, CHUNK_SIZE)
+        resumed = bool(upload_id)
+        if resumed:
+            Logger().info("Resuming upload Id: %s" % upload_id)
+        else:
+            upload_id = self._create_upload(md5, length, content_type)
+            if not upload_id:
+                return UploadResult(None, False, length, md5, 0,
+                                    [(0, length)])
+            if progress:
+                progress.start(user, md5, length, content_type, CHUNK_SIZE,
+                               upload_id)
+
+        put_uri = '{}/v4/uploads/{}'.format(api_uri, upload_id)
+        positions = [position for position in range(0, length, CHUNK_SIZE)
+                     if position not in acknowledged]
+        # The file object is shared by the workers, so seek and read must
+        # happen together.
+        read_lock = threading.Lock()
+        compress = compress and compression.compressible(content_type)
+
+        def send(position):
+            with read_lock:
+                f.seek(position)
+                buf = f.read(CHUNK_SIZE)
+            status = self._put_chunk(put_uri, buf, position, length,
+                                     retries, compress)
+            if progress and 200 <= status < 300:
+                progress.acknowledge(user, md5, length, content_type,
+                                     position)
+            return status
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            statuses = list(executor.map(send, positions))
+        results = [200 <= status < 300 for status in statuses]
+
+        failed = [(position, min(length, position + CHUNK_SIZE))
+                  for position, ok in zip(positions, results) if not ok]
+        sent = length - sum(end - start for start, end in failed)
+        sent_now = sum(min(length, position + CHUNK_SIZE) - position
+                       for position, ok in zip(positions, results) if ok)
+        metrics.record('upload_stream', 0 if failed else 204, sent_now, None,
+                       time.monotonic() - started)
+        if resumed and any(rejected(status) for status in statuses):
+            Logger().warning("Upload Id {} was refused, starting over".format(
+                upload_id))
+            progress.finish(user, md5, length, content_type)
+            return self.upload(f, content_type, concurrency, retries,
+                               progress, (md5, length), compress)
+        if not failed and progress:
+            progress.finish(user, md5, length, content_type)
+        return UploadResult(upload_id, not failed, length, md5, sent, failed)
+
+    def upload_file(self, path, content_type, **kwargs):
+        """
+        Upload the file at path. The md5 and length are taken from a cached
+        digest sidecar when possible (see file.cached_md5_and_length), so
+        the contents are only read from disk to be sent.
+        :param path: path of the file to upload.
+        :param content_type: content type of the upload.
+        :param kwargs: see upload.
+        :return: uploads.UploadResult
+        """
+        digest = file.cached_md5_and_length(path)
+        with open(path, 'rb') as f:
+            return self.upload(f, content_type, digest=digest, **kwargs)
+
+    def _create_upload(self, md5, length, content_type):
+        """
+        Initiates an upload.
+        :return: The upload id, or None on failure.
+        """
+        uri = '{}/v4/uploads'.format(api_uri)
+        data = {
+            'md5': md5,
+            'length': length,
+            'contentType': content_type
+        }
+        res = self.request('uploads', 'POST', uri, headers=self.headers(),
+                           json=data)
+
+        if res.status_code == 201:
+            upload_id = res.json()
+            Logger().info("Upload Id: %s" % upload_id)
+            return upload_id
+
+        log_http_error(res)
+        return None
+
+    def _put_chunk(self, put_uri, buf, position, length, retries,
+                   compress=False):
+        """
+        Sends one chunk, retrying connection errors, 408, 429 and 5xx
+        responses, after the response's Retry-After if it has one. Other
+        4xx responses are not retried, and nothing is sent while the
+        upload_chunk circuit breaker is open.
+        :param compress: Send the chunk gzipped if that makes it smaller.
+            Content-Range still refers to the uncompressed bytes.
+        :return: Status of the last attempt (2xx when the chunk was
+            acknowledged), or 0 when no response was received.
+        """
+        content_range = 'bytes {}-{}/{}'.format(
+            position, position + len(buf) - 1, length)
+        headers = self.headers(content_type=binary_content_type,
+                               content_range=content_range)
+        if compress:
+            compressed = compression.compress(buf, 'gzip')
+            if len(compressed) < len(buf):
+                buf = compressed
+                headers['content-encoding'] = 'gzip'
+        res = None
+        for attempt in range(retries + 1):
+            if attempt:
+                delay = retry_after_seconds(res)
+                if delay is None:
+                    delay = UPLOAD_RETRY_DELAY * 2 ** (attempt - 1)
+                time.sleep(min(delay, self.retry_policy.max_delay))
+            try:
+                res = self.request('upload_chunk', 'PUT', put_uri,
+                                   headers=headers, retry=False, data=buf)
+            except CircuitOpenError as e:
+                # Fail the chunk at once; the upload can be resumed later.
+                Logger().error("Upload of {} failed: {}".format(
+                    content_range, e))
+                return 0
+            except requests.RequestException as e:
+                Logger().error("Upload of {} failed: {}".format(
+                    content_range, e))
+                res = None
+                continue
+            if 200 <= res.status_code < 300:
+                return res.status_code
+            log_http_error(res)
+            if rejected(res.status_code):
+                return res.status_code
+        return res.status_code if res is not None else 0
+
+    def get_upload_status(self, upload_id):
+        """
+        Retrieve the status of an upload. See
+        https://dev.fieldview.com/technical-documentation/ for possible status
+        values and their meaning.
+        :param upload_id: id of upload
+        :return: status json object containing upload id and status.
+        """
+        uri = '{}/v4/uploads/{}/status'.format(api_uri, upload_id)
+        headers = self.headers(accept=json_content_type)
+
+        res = self.request('upload_status', 'GET', uri, headers=headers)
+
+        if res.status_code == 200:
+            return res.json()
+
+        log_http_error(res)
+        return None
+
+    def get_upload_statuses(self, upload_ids):
+        """
+        Retrieve the statuses of several uploads in one call.
+        :param upload_ids: list of upload ids, at most 100.
+        :return: list of status json objects containing upload id and
+            status, or None on failure.
+        """
+        uri = '{}/v4/uploads/status'.format(api_uri)
+        headers = self.headers(accept=json_content_type)
+
+        res = self.request('upload_statuses', 'POST', uri, headers=headers,
+                           json=list(upload_ids))
+
+        if res.status_code in (200, 206):
+            return res.json()['results']
+
+        log_http_error(res)
+        return None
+
+    def get_scouting_observations(self,
+                                  limit=OBSERVATION_PAGE_SIZE,
+                                  next_token=None,
+                                  occurred_after=None,
+                                  occurred_before=None):
+        """
+        Retrieve a list of scouting observations created or updated by the
+        user identified by the Authorization header.
+        https://dev.fieldview.com/technical-documentation/ for possible status
+        values and their meaning.
+        :param next-token: Opaque string which allows for fetching the next
+            batch of results.
+        :param limit: Max number of results to return per batch. Must be
+            between 1 and 100 inclusive, or a page_size.AdaptivePageSize.
+        :param occurred_after: Optional start time by which to filter layer
+             results.
+        :param occurred_before: Optional end time by which to filter layer
+            results.
+        :return: status json object containing scouting observation list
+            and status.
+        """
+        return list(self.iter_scouting_observations(limit,
+                                                    next_token,
+                                                    occurred_after,
+                                                    occurred_before))
+
+    def iter_scouting_observations(self,
+                                   limit=OBSERVATION_PAGE_SIZE,
+                                   next_token=None,
+                                   occurred_after=None,
+                                   occurred_before=None,
+                                   stream=False):
+        """
+        Same as get_scouting_observations, but yields observations page by
+        page. The returned PageIterator exposes the last x-next-token so the
+        listing can be stopped and resumed later.
+        :param stream: Decode observations one at a time as each page
+            arrives.
+        :return: PageIterator over scouting observations.
+        """
+        uri = '{}/v4/layers/scoutingObservations'.format(api_uri)
+        params = {
+            'occurredAfter': occurred_after,
+            'occurredBefore': occurred_before
+        }
+
+        def fetch_page(token, stream):
+            headers = self.headers(accept=json_content_type,
+                                   x_next_token=token)
+            res = self._request_page('scouting_observations', uri, headers,
+                                     limit, params=params, stream=stream)
+            return res
+
+        return PageIterator(fetch_page, next_token, stream)
+
+    def get_scouting_observation(self, scouting_observation_id):
+        """
+        Retrieve an individual scouting observation by id. Ids are retrieved
+        via the /layers/scoutingObservations route.
+        https://dev.fieldview.com/technical-documentation/ for possible status
+        values and their meaning.
+        :param scouting_observation_id: Unique identifier of the
+            Scouting Observation.
+
+        """
+        uri = '{}/v4/layers/scoutingObservations/{}'.format(
+            api_uri, scouting_observation_id)
+        headers = self.headers(accept=json_content_type)
+
+        res = self.request('scouting_observation', 'GET', uri,
+                           headers=headers)
+
+        if res.status_code == 200:
+            return res.json()
+
+        log_http_error(res)
+        return None
+
+    def get_scouting_observation_attachments(self, scouting_observation_id):
+        """
+        Retrieve attachments associated with a given scouting observation.
+        Photos added to scouting notes in the FieldView app are capped to
+        20MB, and we won’t store photos larger than that in a scouting note.
+        https://dev.fieldview.com/technical-documentation/ for possible status
+        values and their meaning.
+        :param scouting_observation_id: Unique identifier of the
+            Scouting Observation.
+
+        """
+        uri = '{}/v4/layers/scoutingObservations/{}/attachments'.format(
+            api_uri, scouting_observation_id)
+        headers = self.headers(accept=json_content_type)
+
+        res = self.request('attachments', 'GET', uri, headers=headers)
+
+        if res.status_code == 200:
+            return res.json()['results']
+
+        log_http_error(res)
+        return []
+
+    def get_scouting_observation_attachments_contents(self,
+                                                      scouting_observation_id,
+                                                      attachment_id,
+                                                      content_type,
+                                                      length,
+                                                      **kwargs):
+        """
+        Retrieve the binary contents of a scouting observation’s attachment.
+        https://dev.fieldview.com/technical-documentation/ for possible status
+        values and their meaning.
+        :param scouting_observation_id: Unique identifier of the Scouting
+            Observation.
+        :param attachment_id : Unique identifiler of the attachment
+        :param kwargs: concurrency and chunk_size, see fetch_contents.
+
+        """
+        uri = '{}/v4/layers/scoutingObservations/{}/attachments/{}/contents'.\
+            format(api_uri,
+                   scouting_observation_id,
+                   attachment_id)
+        headers = self.headers(accept=content_type)
+
+        return self.fetch_contents(uri, headers, length, **kwargs)
+
+    def get_activities(self, next_token, activity, stream=False,
+                       limit=ACTIVITY_PAGE_SIZE):
+        """
+        Retrieve a list of field activities.
+        https://dev.fieldview.com/technical-documentation/ for possible status
+        values and their meaning.
+        :param next-token: Opaque string which allows for fetching the next
+            batch of results.
+        :param activity: name of activity
+        :param stream: Return the results as an iterator decoding activities
+            one at a time from the streamed response body.
+        :param limit: Max number of results to return, or a
+            page_size.AdaptivePageSize.
+
+        """
+        uri = '{}/v4/layers/{}'.format(api_uri, activity)
+        headers = self.headers(x_next_token=next_token)
+
+        res = self._request_page('activities', uri, headers, limit,
+                                 stream=stream)
+
+        if res.status_code in (200, 206):
+            token = res.headers['x-next-token'] \
+                if res.status_code == 206 else None
+            if stream:
+                return token, self._stream_results(res)
+            return token, res.json()['results']
+        if res.status_code == 304:
+            return None, None
+
+        log_http_error(res)
 
-    if res.status_code == 200:
-        return res.json()['results']
-    if res.status_code == 206:
-        next_token = res.headers['x-next-token']
-        return res.json()['results'] + get_fields(token, api_key, next_token)
+        return None, None
 
-    log_http_error(res)
-    return []
+    @staticmethod
+    def _stream_results(res):
+        with res:
+            yield from iter_results(res.iter_content(STREAM_CHUNK_SIZE))
+
+    def iter_activities(self, activity, next_token=None,
+                        limit=ACTIVITY_PAGE_SIZE, stream=False):
+        """
+        Lists all activities of a layer, page by page. For full listings
+        pass a page_size.AdaptivePageSize as limit, so pages grow as large
+        as the API allows while they stay fast.
+        :param activity: name of activity
+        :param next_token: Pagination token from previous request, or None.
+        :param limit: Max number of results per page, or a
+            page_size.AdaptivePageSize.
+        :param stream: Decode activities one at a time as each page arrives.
+        :return: PageIterator over activities.
+        """
+        uri = '{}/v4/layers/{}'.format(api_uri, activity)
+
+        def fetch_page(token, stream):
+            headers = self.headers(x_next_token=token)
+            return self._request_page('activities', uri, headers, limit,
+                                      stream=stream)
+
+        return PageIterator(fetch_page, next_token, stream)
+
+    def _request_page(self, endpoint, uri, headers, limit, **kwargs):
+        """
+        GETs one page of a listing with its x-limit taken from limit, a
+        number or a page_size.AdaptivePageSize. An adaptive limit is
+        adjusted after every page, and pages are requested with its read
+        timeout. On a timeout or 5xx the limit is shrunk and the page
+        retried for as long as it can still shrink; only then does
+        retry_policy retry the page at the same size.
+        :return: requests.Response
+        """
+        if not hasattr(limit, 'observe'):
+            headers = dict(headers, **{'x-limit': str(limit)})
+            return self.request(endpoint, 'GET', uri, headers=headers,
+                                **kwargs)
+        kwargs.setdefault('timeout', (CONNECT_TIMEOUT, limit.timeout))
+        while True:
+            page_headers = dict(headers, **{'x-limit': str(limit.limit)})
+            try:
+                res = self.request(endpoint, 'GET', uri,
+                                   headers=page_headers,
+                                   retry=limit.limit <= limit.minimum,
+                                   **kwargs)
+            except requests.Timeout:
+                if limit.failed():
+                    continue
+                raise
+            if res.status_code >= 500 and limit.failed():
+                res.close()
+                continue
+            if res.status_code in (200, 206):
+                limit.observe(res.elapsed.total_seconds(),
+                              response_sizes(res)[1])
+            return res
+
+    def get_activity_contents(self, layer_id, activity_id, length, **kwargs):
+        """
+        Retrieve a content of field activity.
+        https://dev.fieldview.com/technical-documentation/ for possible status
+        values and their meaning.
+        :param layer_id: name of activity
+        :param activity_id: id of activity
+        :param length: content length
+        :param kwargs: concurrency and chunk_size, see fetch_contents.
+
+        """
+        uri = '{}/v4/layers/{}/{}/contents'.format(
+            api_uri, layer_id, activity_id)
+        headers = self.headers()
+
+        return self.fetch_contents(uri, headers, length, **kwargs)
+
+    def fetch_contents(self, uri, headers, length,
+                       concurrency=DOWNLOAD_CONCURRENCY,
+                       chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """
+        Downloads length bytes from uri using range requests over the pooled
+        session. With concurrency > 1, up to that many range requests are kept
+        in flight on a thread pool; chunks are still yielded in order.
+        :param uri: contents uri
+        :param headers: headers to send with every range request
+        :param length: content length
+        :param concurrency: Max number of range requests in flight.
+        :param chunk_size: Size in bytes of each range request.
+        :return: generator of bytes chunks, in order.
+        """
+        ranges = ((start, min(length, start + chunk_size))
+                  for start in range(0, length, chunk_size))
+        if concurrency > 1:
+            responses = self._fetch_ranges_parallel(uri, headers, ranges,
+                                                    concurrency)
+        else:
+            responses = (self._fetch_range(uri, headers, start, end)
+                         for start, end in ranges)
+
+        started = time.monotonic()
+        received = 0
+        status = 0
+        try:
+            for res in responses:
+                if res.status_code == 200 or res.status_code == 206:
+                    received += len(res.content)
+                    yield res.content
+                else:
+                    log_http_error(res)
+                    break
+            else:
+                status = 200
+        finally:
+            metrics.record('contents_stream', status, None, received,
+                           time.monotonic() - started)
+
+    def _fetch_range(self, uri, headers, start, end):
+        headers = dict(headers)
+        headers['Range'] = 'bytes={}-{}'.format(start, end - 1)
+        # Ranges of a compressed body could not be decoded on their own.
+        headers['Accept-Encoding'] = 'identity'
+        res = self.request('contents', 'GET', uri, headers=headers)
+        return res
+
+    def _fetch_ranges_parallel(self, uri, headers, ranges, concurrency):
+        """
+        Yields the responses for ranges in order while keeping up to
+        concurrency requests running. Requests still pending when the
+        generator is closed early are cancelled.
+        """
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        pending = deque()
+        try:
+            for start, end in ranges:
+                pending.append(executor.submit(self._fetch_range, uri,
+                                               headers, start, end))
+                if len(pending) >= concurrency:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+
+# Module level API. Each call builds a lightweight ClimateClient around the
+# shared default session so existing callers keep working unchanged while
+# reusing pooled connections.
+
+_default_session = None
+_default_session_lock = threading.Lock()
+_client_options = {}
+
+
+def configure(**options):
+    """
+    Sets ClimateClient options (for example boundary_cache) shared by the
+    clients built for the module level functions. pool_size sizes the
+    default session; changing it replaces the session.
+    """
+    global _default_session
+    with _default_session_lock:
+        if 'pool_size' in options and \
+                options['pool_size'] != _client_options.get('pool_size'):
+            _default_session = None
+        _client_options.update(options)
 
 
-def get_boundary(boundary_id, token, api_key):
+def default_session():
     """
-    Retrieve field boundary from Climate. Note that boundary objects are
-    immutable, so whenever a field's boundary is updated the boundaryId
-    property of the field will change and you will need to fetch the
-    updated boundary.
-    :param boundary_id: UUID of field boundary to retrieve.
-    :param token: access_token
-    :param api_key: Provided by Climate
-    :return: geojson object representing the boundary of the field.
+    Returns the pooled session shared by the module level functions,
+    creating it on first use with the configured pool_size
+    (DEFAULT_POOL_SIZE unless configured).
     """
-    uri = '{}/v4/boundaries/{}'.format(api_uri, boundary_id)
-    headers = {
-        'authorization': bearer_token(token),
-        'accept': json_content_type,
-        'x-api-key': api_key
-    }
+    global _default_session
+    session = _default_session
+    if session is None:
+        with _default_session_lock:
+            if _default_session is None:
+                _default_session = pooled_session(_client_options.get(
+                    'pool_size', DEFAULT_POOL_SIZE))
+            session = _default_session
+    return session
+
+
+def client(token=None, api_key=None):
+    """
+    Returns a ClimateClient for token and api_key sharing the default session
+    and the options set with configure.
+    """
+    return ClimateClient(token, api_key, session=default_session(),
+                         **_client_options)
 
-    res = requests.get(uri, headers=headers)
-    Logger().info(to_curl(res.request))
 
-    if res.status_code == 200:
-        return res.json()
+def authorize(login_code, client_id, client_secret, redirect_uri):
+    """See ClimateClient.authorize."""
+    return client().authorize(login_code, client_id, client_secret,
+                              redirect_uri)
 
-    log_http_error(res)
-    return None
 
+def reauthorize(refresh_token, client_id, client_secret):
+    """See ClimateClient.reauthorize."""
+    return client().reauthorize(refresh_token, client_id, client_secret)
 
-def upload(f, content_type, token, api_key):
-    """Upload a file with the given content type to Climate
 
-    This example supports files up to 5 MiB (5,242,880 bytes).
+def get_fields(token, api_key, next_token=None):
+    """See ClimateClient.get_fields."""
+    return client(token, api_key).get_fields(next_token)
 
-    Returns The upload id if the upload is successful, False otherwise.
-    """
-    uri = '{}/v4/uploads'.format(api_uri)
-    headers = {
-        'authorization': bearer_token(token),
-        'x-api-key': api_key
-    }
-    md5 = file.md5(f)
-    length = file.length(f)
-    data = {
-        'md5': md5,
-        'length': length,
-        'contentType': content_type
-    }
 
-    # initiate upload
-    res = requests.post(uri, headers=headers, json=data)
-    Logger().info(to_curl(res.request))
-
-    if res.status_code == 201:
-        upload_id = res.json()
-        Logger().info("Upload Id: %s" % upload_id)
-        put_uri = '{}/{}'.format(uri, upload_id)
-
-        # for this example, size is assumed to be small enough for a
-        # single upload (less than or equal to 5 MiB)
-        headers['content-range'] = 'bytes {}-{}/{}'.format(0,
-                                                           (length - 1),
-                                                           length)
-        headers['content-type'] = binary_content_type
-
-        f.seek(0)
-
-        # send image
-        for position in range(0, length, CHUNK_SIZE):
-            buf = f.read(CHUNK_SIZE)
-            headers['content-range'] = 'bytes {}-{}/{}'.format(
-                position, position + len(buf) - 1, length)
-            try:
-                res = requests.put(put_uri, headers=headers, data=buf)
-                Logger().info(headers)
-            except Exception as e:
-                Logger().error("Exception: %s" % e)
+def iter_fields(token, api_key, next_token=None, stream=False):
+    """See ClimateClient.iter_fields."""
+    return client(token, api_key).iter_fields(next_token, stream)
 
-        if res.status_code == 204:
-            return upload_id
 
-    return False
+def get_boundary(boundary_id, token, api_key):
+    """See ClimateClient.get_boundary."""
+    return client(token, api_key).get_boundary(boundary_id)
 
 
-def get_upload_status(upload_id, token, api_key):
-    """
-    Retrieve the status of an upload. See
-    https://dev.fieldview.com/technical-documentation/ for possible status
-    values and their meaning.
-    :param upload_id: id of upload
-    :param token: access_token
-    :param api_key: Provided by Climate
-    :return: status json object containing upload id and status.
-    """
-    uri = '{}/v4/uploads/{}/status'.format(api_uri, upload_id)
-    headers = {
-        'authorization': bearer_token(token),
-        'accept': json_content_type,
-        'x-api-key': api_key
-    }
+def get_boundaries(boundary_ids, token, api_key, **kwargs):
+    """See ClimateClient.get_boundaries."""
+    return client(token, api_key).get_boundaries(boundary_ids, **kwargs)
 
-    res = requests.get(uri, headers=headers)
-    Logger().info(to_curl(res.request))
 
-    if res.status_code == 200:
-        return res.json()
+def prefetch_boundaries(fields, token, api_key, **kwargs):
+    """See ClimateClient.prefetch_boundaries."""
+    return client(token, api_key).prefetch_boundaries(fields, **kwargs)
 
-    log_http_error(res)
-    return None
 
+def upload(f, content_type, token, api_key, **kwargs):
+    """See ClimateClient.upload."""
+    return client(token, api_key).upload(f, content_type, **kwargs)
 
-def get_scouting_observations(token,
-                              api_key,
-                              limit=100,
-                              next_token=None,
-                              occurred_after=None,
-                              occurred_before=None):
-    """
-    Retrieve a list of scouting observations created or updated by the user
-    identified by the Authorization header.
-    https://dev.fieldview.com/technical-documentation/ for possible status
-    values and their meaning.
-    :param token: access_token
-    :param api_key: Provided by Climate
-    :param next-token: Opaque string which allows for fetching the next batch
-        of results.
-    :param limit: Max number of results to return per batch. Must be between
-        1 and 100 inclusive.
-    :param occurred_after: Optional start time by which to filter layer
-         results.
-    :param occurred_before: Optional end time by which to filter layer results.
-    :return: status json object containing scouting observation list
-        and status.
-    """
-    uri = '{}/v4/layers/scoutingObservations'.format(api_uri)
-    headers = {
-        'authorization': bearer_token(token),
-        'accept': json_content_type,
-        'x-api-key': api_key,
-        'x-limit': str(limit),
-        'x-next-token': next_token
-    }
-    params = {
-        'occurredAfter': occurred_after,
-        'occurredBefore': occurred_before
-    }
 
-    res = requests.get(uri, headers=headers, params=params)
-    Logger().info(to_curl(res.request))
+def upload_file(path, content_type, token, api_key, **kwargs):
+    """See ClimateClient.upload_file."""
+    return client(token, api_key).upload_file(path, content_type, **kwargs)
 
-    if res.status_code == 200:
-        return res.json()['results']
-    if res.status_code == 206:
-        next_token = res.headers['x-next-token']
-        return res.json()['results'] + \
-            get_scouting_observations(token,
-                                      api_key,
-                                      limit,
-                                      next_token,
-                                      occurred_after,
-                                      occurred_before)
-    log_http_error(res)
-    return []
 
+def get_upload_status(upload_id, token, api_key):
+    """See ClimateClient.get_upload_status."""
+    return client(token, api_key).get_upload_status(upload_id)
 
-def get_scouting_observation(token, api_key, scouting_observation_id):
-    """
-    Retrieve an individual scouting observation by id. Ids are retrieved via
-    the /layers/scoutingObservations route.
-    https://dev.fieldview.com/technical-documentation/ for possible status
-    values and their meaning.
-    :param token: access_token
-    :param api_key: Provided by Climate
-    :param scouting_observation_id: Unique identifier of the
-        Scouting Observation.
 
-    """
-    uri = '{}/v4/layers/scoutingObservations/{}'.format(
-        api_uri, scouting_observation_id)
-    headers = {
-        'authorization': bearer_token(token),
-        'accept': json_content_type,
-        'x-api-key': api_key
-    }
+def get_upload_statuses(upload_ids, token, api_key):
+    """See ClimateClient.get_upload_statuses."""
+    return client(token, api_key).get_upload_statuses(upload_ids)
 
-    res = requests.get(uri, headers=headers)
-    Logger().info(to_curl(res.request))
 
-    if res.status_code == 200:
-        return res.json()
+def get_scouting_observations(token,
+                              api_key,
+                              limit=OBSERVATION_PAGE_SIZE,
+                              next_token=None,
+                              occurred_after=None,
+                              occurred_before=None):
+    """See ClimateClient.get_scouting_observations."""
+    return client(token, api_key).get_scouting_observations(limit,
+                                                            next_token,
+                                                            occurred_after,
+                                                            occurred_before)
+
+
+def iter_scouting_observations(token,
+                               api_key,
+                               limit=OBSERVATION_PAGE_SIZE,
+                               next_token=None,
+                               occurred_after=None,
+                               occurred_before=None,
+                               stream=False):
+    """See ClimateClient.iter_scouting_observations."""
+    return client(token, api_key).iter_scouting_observations(limit,
+                                                             next_token,
+                                                             occurred_after,
+                                                             occurred_before,
+                                                             stream)
+
 
-    log_http_error(res)
-    return None
+def get_scouting_observation(token, api_key, scouting_observation_id):
+    """See ClimateClient.get_scouting_observation."""
+    return client(token, api_key).get_scouting_observation(
+        scouting_observation_id)
 
 
 def get_scouting_observation_attachments(token,
                                          api_key,
                                          scouting_observation_id):
-    """
-    Retrieve attachments associated with a given scouting observation. Photos
-    added to scouting notes in the FieldView app are capped to 20MB, and we
-    won’t store photos larger than that in a scouting note.
-    https://dev.fieldview.com/technical-documentation/ for possible status
-    values and their meaning.
-    :param token: access_token
-    :param api_key: Provided by Climate
-    :param scouting_observation_id: Unique identifier of the
-        Scouting Observation.
-
-    """
-    uri = '{}/v4/layers/scoutingObservations/{}/attachments'.format(
-        api_uri, scouting_observation_id)
-    headers = {
-        'authorization': bearer_token(token),
-        'accept': json_content_type,
-        'x-api-key': api_key
-    }
-
-    res = requests.get(uri, headers=headers)
-    Logger().info(to_curl(res.request))
+    """See ClimateClient.get_scouting_observation_attachments."""
+    return client(token, api_key).get_scouting_observation_attachments(
+        scouting_observation_id)
 
-    if res.status_code == 200:
-        return res.json()['results']
 
-    log_http_error(res)
-    return []
+def cached_response(entry, res):
+    """
+    Builds the response served in place of a 304 Not Modified.
+    :param entry: http_cache.CachedResponse
+    :param res: The 304 requests.Response.
+    :return: requests.Response with the status, headers and body of entry.
+    """
+    res.close()
+    cached = requests.Response()
+    cached.status_code = entry.status
+    cached.headers = CaseInsensitiveDict(entry.headers)
+    cached._content = entry.body
+    cached._content_consumed = True
+    cached.url = res.url
+    cached.request = res.request
+    cached.elapsed = res.elapsed
+    return cached
+
+
+def observe(res, endpoint):
+    """
+    Records metrics for a response and logs it.
+    :param res: requests.Response
+    :param endpoint: Short endpoint name, e.g. 'fields'.
+    """
+    sent, received = response_sizes(res)
+    metrics.record(endpoint, res.status_code, sent, received,
+                   res.elapsed.total_seconds())
+    log_response(res, endpoint)
 
 
 def log_http_error(response):
@@ -430,31 +1292,13 @@ def get_scouting_observation_attachments_contents(token,
                                                   scouting_observation_id,
                                                   attachment_id,
                                                   content_type,
-                                                  length):
-    """
-    Retrieve the binary contents of a scouting observation’s attachment.
-    https://dev.fieldview.com/technical-documentation/ for possible status
-    values and their meaning.
-    :param token: access_token
-    :param api_key: Provided by Climate
-    :param scouting_observation_id: Unique identifier of the Scouting
-        Observation.
-    :param attachment_id : Unique identifiler of the attachment
-
-    """
-
-    uri = '{}/v4/layers/scoutingObservations/{}/attachments/{}/contents'.\
-        format(api_uri,
-               scouting_observation_id,
-               attachment_id)
-
-    headers = {
-        'authorization': bearer_token(token),
-        'accept': content_type,
-        'x-api-key': api_key,
-    }
-
-    return fetch_contents(uri, headers, length)
+                                                  length,
+                                                  **kwargs):
+    """See ClimateClient.get_scouting_observation_attachments_contents."""
+    return client(token, api_key)\
+        .get_scouting_observation_attachments_contents(
+            scouting_observation_id, attachment_id, content_type, length,
+            **kwargs)
 
 
 def get_as_planted(token, api_key, next_token):
@@ -492,71 +1336,30 @@ def get_as_applied(token, api_key, next_token):
     return get_activities(token, api_key, next_token, "asApplied")
 
 
-def get_activities(token, api_key, next_token, activity):
-    """
-    Retrieve a list of field activities.
-    https://dev.fieldview.com/technical-documentation/ for possible status
-    values and their meaning.
-    :param token: access_token
-    :param api_key: Provided by Climate
-    :param next-token: Opaque string which allows for fetching the next batch
-        of results.
-    :param activity: name of activity
+def get_activities(token, api_key, next_token, activity, stream=False,
+                   limit=ACTIVITY_PAGE_SIZE):
+    """See ClimateClient.get_activities."""
+    return client(token, api_key).get_activities(next_token, activity,
+                                                 stream, limit)
 
-    """
-    uri = '{}/v4/layers/{}'.format(api_uri, activity)
 
-    headers = {
-        'authorization': bearer_token(token),
-        'x-api-key': api_key,
-        'x-next-token': next_token,
-        'x-limit': str(10)
-    }
+def iter_activities(token, api_key, activity, **kwargs):
+    """See ClimateClient.iter_activities."""
+    return client(token, api_key).iter_activities(activity, **kwargs)
 
-    res = requests.get(uri, headers=headers)
 
-    if res.status_code == 200:
-        return None, res.json()['results']
-    if res.status_code == 206:
-        return res.headers['x-next-token'], res.json()['results']
-    if res.status_code == 304:
-        return None, None
-
-    log_http_error(res)
-
-    return None, None
-
-
-def get_activity_contents(token, api_key, layer_id, activity_id, length):
-    """
-    Retrieve a content of field activity.
-    https://dev.fieldview.com/technical-documentation/ for possible status
-    values and their meaning.
-    :param token: access_token
-    :param api_key: Provided by Climate
-    :param layer_id: name of activity
-    :param activity_id: id of activity
-    :param length: content length
+def get_activity_contents(token, api_key, layer_id, activity_id, length,
+                          **kwargs):
+    """See ClimateClient.get_activity_contents."""
+    return client(token, api_key).get_activity_contents(layer_id,
+                                                        activity_id,
+                                                        length,
+                                                        **kwargs)
 
-    """
-    uri = '{}/v4/layers/{}/{}/contents'.format(api_uri, layer_id, activity_id)
-
-    headers = {
-        'authorization': bearer_token(token),
-        'x-api-key': api_key,
-    }
-
-    return fetch_contents(uri, headers, length)
 
-
-def fetch_contents(uri, headers, length):
-    chunk_size = 1 * 1024 * 1024
-    for start in range(0, length, chunk_size):
-        end = min(length, start + chunk_size)
-        headers['Range'] = 'bytes={}-{}'.format(start, end - 1)
-        res = requests.get(uri, headers=headers)
-        if res.status_code == 200 or res.status_code == 206:
-            yield res.content
-        else:
-            log_http_error(res)
-            break
+def fetch_contents(uri, headers, length,
+                   concurrency=DOWNLOAD_CONCURRENCY,
+                   chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """See ClimateClient.fetch_contents."""
+    return client().fetch_contents(uri, headers, length, concurrency,
+                                   chunk_size)
@@ -0,0 +1,686 @@
+"""
+Asynchronous Climate API client
+
+Mirrors the operations of climate.py as coroutines and async generators on
+top of aiohttp, for workers that fan out over many users from one event loop
+instead of holding a thread per in-flight request. All requests of a client
+share one connection pool, and at most `concurrency` of them are in flight at
+a time. Calls are retried and circuit broken like those of climate.py, by
+default with the same RetryPolicy and CircuitBreakers, waiting with
+asyncio.sleep. climate.api_uri and climate.token_uri are read on every call,
+so pointing them elsewhere (e.g. at mock_server) applies to both clients.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from urllib.parse import urlencode
+
+import aiohttp
+from multidict import CIMultiDict
+
+import climate
+import file
+import metrics
+from climate import (json_content_type, binary_content_type,
+                     authorization_header, bearer_token, log_http_error,
+                     ACTIVITY_PAGE_SIZE, BOUNDARY_CONCURRENCY, CHUNK_SIZE,
+                     CONNECT_TIMEOUT, DEFAULT_POOL_SIZE, OBSERVATION_PAGE_SIZE,
+                     READ_TIMEOUT, DOWNLOAD_CHUNK_SIZE, DOWNLOAD_CONCURRENCY,
+                     UPLOAD_CONCURRENCY, UPLOAD_RETRIES, UPLOAD_RETRY_DELAY,
+                     default_breakers, default_retry_policy)
+from logger import Logger
+from request_log import body_length, log_request
+from resilience import CircuitOpenError, retry_after_seconds
+from uploads import UploadResult, rejected
+
+
+class Response:
+    """
+    A response whose body has been read in full, with the same attributes as
+    the requests responses used in climate.py (status_code, headers, content,
+    text, json()).
+    """
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncPageIterator:
+    """
+    Async counterpart of climate.PageIterator: iterates over the records of
+    a paginated listing page by page and exposes next_token, done and
+    status_code the same way.
+    """
+
+    def __init__(self, fetch_page, next_token=None):
+        """
+        :param fetch_page: Coroutine function taking a next_token (or None)
+            and returning the Response for that page.
+        :param next_token: Pagination token to start from, or None.
+        """
+        self.next_token = next_token
+        self.done = False
+        self.status_code = None
+        self._fetch_page = fetch_page
+
+    async def __aiter__(self):
+        async for page in self.pages():
+            for record in page:
+                yield record
+
+    async def pages(self):
+        """
+        Yields each page of results as a list.
+        """
+        while not self.done:
+            res = await self._fetch_page(self.next_token)
+            self.status_code = res.status_code
+            if res.status_code not in (200, 206):
+                log_http_error(res)
+                return
+
+            yield res.json()['results']
+
+            if res.status_code == 200:
+                self.done = True
+                self.next_token = res.headers.get('x-next-token',
+                                                  self.next_token)
+            else:
+                self.next_token = res.headers['x-next-token']
+
+
+class AsyncClimateClient:
+    """
+    asyncio client for the Climate API. Must be used from a running event
+    loop; the aiohttp session is created on first use. Use it as an async
+    context manager, or call close() when done.
+    """
+
+    def __init__(self, token=None, api_key=None,
+                 pool_size=DEFAULT_POOL_SIZE, concurrency=None, session=None,
+                 boundary_cache=None, retry_policy=None, breakers=None,
+                 rate_limiter=None, user_id=None):
+        """
+        :param token: access_token
+        :param api_key: Provided by Climate.
+        :param pool_size: Max number of pooled connections. Ignored when
+            session is given.
+        :param concurrency: Max number of requests in flight, pool_size by
+            default.
+        :param session: Optional aiohttp.ClientSession to share between
+            clients. It is not closed by close().
+        :param boundary_cache: Optional boundary_cache.BoundaryCache used by
+            get_boundary.
+        :param retry_policy: resilience.RetryPolicy,
+            climate.default_retry_policy when None.
+        :param breakers: resilience.CircuitBreakers, climate.default_breakers
+            when None, so a failing endpoint is broken for both clients.
+        :param rate_limiter: Optional rate_limit.RateLimiter every call
+            waits on before it is sent, without blocking the event loop.
+            Share it with the climate.py clients using the same api_key.
+        :param user_id: Who the token belongs to, e.g. the user id of its
+            tokens.TokenManager. Upload progress is kept under it, so an
+            upload can resume after the token is refreshed.
+        """
+        self.token = token
+        self.api_key = api_key
+        self.user_id = user_id
+        self.boundary_cache = boundary_cache
+        self.retry_policy = retry_policy or default_retry_policy
+        self.breakers = breakers or default_breakers
+        self.rate_limiter = rate_limiter
+        self._pool_size = pool_size
+        self._session = session
+        self._owns_session = session is None
+        self._semaphore = asyncio.Semaphore(concurrency or pool_size)
+
+    @property
+    def session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self._pool_size)
+            timeout = aiohttp.ClientTimeout(total=None,
+                                            sock_connect=CONNECT_TIMEOUT,
+                                            sock_read=READ_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=timeout)
+        return self._session
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def headers(self, **extra):
+        """
+        Builds the headers sent on all non-auth API calls. See
+        climate.ClimateClient.headers.
+        """
+        headers = {
+            'authorization': bearer_token(self.token),
+            'x-api-key': self.api_key
+        }
+        for name, value in extra.items():
+            headers[name.replace('_', '-')] = value
+        return headers
+
+    def _user(self):
+        """
+        :return: Who upload progress belongs to: user_id, or a hash of the
+            access_token. Same as climate.ClimateClient._cache_user.
+        """
+        if self.user_id is not None:
+            return self.user_id
+        token = self.token or ''
+        return hashlib.sha1(token.encode('utf-8')).hexdigest()[:16]
+
+    async def request(self, endpoint, method, uri, headers=None,
+                      params=None, retry=True, **kwargs):
+        """
+        Sends a request once the rate_limiter (if any) allows it and a
+        concurrency slot is free, and reads the whole body. None valued
+        headers and params are dropped, as requests does. Failures are
+        retried according to retry_policy, and the call fails fast with
+        resilience.CircuitOpenError while the endpoint's circuit breaker is
+        open; see climate.ClimateClient.request.
+        :param endpoint: Short endpoint name used for logging and circuit
+            breaking.
+        :param retry: False to make a single attempt, for callers that retry
+            themselves.
+        :return: Response
+        """
+        if headers:
+            headers = {k: v for k, v in headers.items() if v is not None}
+        if params:
+            params = {k: v for k, v in params.items() if v is not None}
+        breaker = self.breakers.get(endpoint)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(
+                    'Circuit open for {}, not calling {}'.format(endpoint,
+                                                                 uri))
+            try:
+                res = await self._send(endpoint, method, uri, headers,
+                                       params, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                breaker.failure()
+                if not (retry and
+                        self.retry_policy.should_retry(method, attempt)):
+                    raise
+                res, reason = None, e
+            else:
+                if res.status_code >= 500:
+                    breaker.failure()
+                else:
+                    breaker.success()
+                if not (retry and self.retry_policy.should_retry(
+                        method, attempt, res.status_code)):
+                    return res
+                reason = res.status_code
+            delay = self.retry_policy.delay(attempt, res)
+            Logger().warning('Retrying {} {} in {:.1f}s after {}'.format(
+                endpoint, method, delay, reason))
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _send(self, endpoint, method, uri, headers, params, **kwargs):
+        if self.rate_limiter is not None:
+            wait = self.rate_limiter.reserve(endpoint)
+            if wait:
+                await asyncio.sleep(wait)
+        async with self._semaphore:
+            started = time.monotonic()
+            async with self.session.request(method, uri, headers=headers,
+                                            params=params, **kwargs) as res:
+                content = await res.read()
+                elapsed = time.monotonic() - started
+                sent = body_length(kwargs.get('data'))
+                metrics.record(endpoint, res.status, sent, len(content),
+                               elapsed)
+                log_request(endpoint, method, uri, res.status, sent,
+                            len(content), elapsed)
+                return Response(res.status, CIMultiDict(res.headers),
+                                content)
+
+    async def authorize(self, login_code, client_id, client_secret,
+                        redirect_uri):
+        """See climate.ClimateClient.authorize."""
+        headers = {
+            'authorization': authorization_header(client_id, client_secret),
+            'content-type': 'application/x-www-form-urlencoded',
+            'accept': 'application/json'
+        }
+        data = {
+            'grant_type': 'authorization_code',
+            'redirect_uri': redirect_uri,
+            'code': login_code
+        }
+        res = await self.request('token', 'POST', climate.token_uri,
+                                 headers=headers, data=urlencode(data))
+        if res.status_code == 200:
+            return res.json()
+
+        Logger().error("Auth failed: %s" % res.status_code)
+        Logger().error("Auth failed: %s" % res.text)
+        return None
+
+    async def reauthorize(self, refresh_token, client_id, client_secret):
+        """See climate.ClimateClient.reauthorize."""
+        headers = {
+            'authorization': authorization_header(client_id, client_secret),
+            'content-type': 'application/x-www-form-urlencoded',
+            'accept': 'application/json'
+        }
+        data = {
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh_token
+        }
+        res = await self.request('token', 'POST', climate.token_uri,
+                                 headers=headers, data=urlencode(data))
+        if res.status_code == 200:
+            return res.json()
+
+        log_http_error(res)
+        return None
+
+    async def get_fields(self, next_token=None):
+        """See climate.ClimateClient.get_fields."""
+        return [f async for f in self.iter_fields(next_token)]
+
+    def iter_fields(self, next_token=None):
+        """See climate.ClimateClient.iter_fields.
+        :return: AsyncPageIterator over fields.
+        """
+        uri = '{}/v4/fields'.format(climate.api_uri)
+
+        async def fetch_page(token):
+            headers = self.headers(accept=json_content_type,
+                                   x_next_token=token)
+            return await self.request('fields', 'GET', uri, headers=headers)
+
+        return AsyncPageIterator(fetch_page, next_token)
+
+    async def get_boundary(self, boundary_id):
+        """See climate.ClimateClient.get_boundary."""
+        if self.boundary_cache is not None:
+            boundary = self.boundary_cache.get(boundary_id)
+            if boundary is not None:
+                return boundary
+
+        uri = '{}/v4/boundaries/{}'.format(climate.api_uri, boundary_id)
+        headers = self.headers(accept=json_content_type)
+        res = await self.request('boundaries', 'GET', uri, headers=headers)
+        if res.status_code == 200:
+            boundary = res.json()
+            if self.boundary_cache is not None:
+                self.boundary_cache.put(boundary_id, boundary)
+            return boundary
+
+        log_http_error(res)
+        return None
+
+    async def get_boundaries(self, boundary_ids,
+                             concurrency=BOUNDARY_CONCURRENCY):
+        """See climate.ClimateClient.get_boundaries."""
+        boundary_ids = list(dict.fromkeys(boundary_ids))
+        slots = asyncio.Semaphore(max(1, concurrency))
+
+        async def fetch(boundary_id):
+            async with slots:
+                return await self.get_boundary(boundary_id)
+
+        boundaries = await asyncio.gather(*(fetch(b) for b in boundary_ids))
+        return dict(zip(boundary_ids, boundaries))
+
+    async def prefetch_boundaries(self, fields,
+                                  concurrency=BOUNDARY_CONCURRENCY):
+        """See climate.ClimateClient.prefetch_boundaries."""
+        return await self.get_boundaries((f['boundaryId'] for f in fields
+                                          if f.get('boundaryId')),
+                                         concurrency)
+
+    async def upload(self, f, content_type, concurrency=UPLOAD_CONCURRENCY,
+                     retries=UPLOAD_RETRIES, progress=None, digest=None):
+        """See climate.ClimateClient.upload.
+        Blocking file reads and hashing run in the loop's default executor.
+        """
+        loop = asyncio.get_event_loop()
+        if digest:
+            md5, length = digest
+        else:
+            md5, length = await loop.run_in_executor(
+                None, file.md5_and_length, f)
+
+        user = self._user()
+        upload_id, acknowledged = None, set()
+        if progress:
+            upload_id, acknowledged = progress.load(user, md5, length,
+                                                    content_type, CHUNK_SIZE)
+        resumed = bool(upload_id)
+        if resumed:
+            Logger().info("Resuming upload Id: %s" % upload_id)
+        else:
+            upload_id = await self._create_upload(md5, length, content_type)
+            if not upload_id:
+                return UploadResult(None, False, length, md5, 0,
+                                    [(0, length)])
+            if progress:
+                progress.start(user, md5, length, content_type, CHUNK_SIZE,
+                               upload_id)
+
+        put_uri = '{}/v4/uploads/{}'.format(climate.api_uri, upload_id)
+        positions = [position for position in range(0, length, CHUNK_SIZE)
+                     if position not in acknowledged]
+        read_lock = threading.Lock()
+        slots = asyncio.Semaphore(max(1, concurrency))
+
+        def read(position):
+            with read_lock:
+                f.seek(position)
+                return f.read(CHUNK_SIZE)
+
+        async def send(position):
+            async with slots:
+                buf = await loop.run_in_executor(None, read, position)
+                status = await self._put_chunk(put_uri, buf, position,
+                                               length, retries)
+            if progress and 200 <= status < 300:
+                progress.acknowledge(user, md5, length, content_type,
+                                     position)
+            return status
+
+        statuses = await asyncio.gather(*(send(p) for p in positions))
+        results = [200 <= status < 300 for status in statuses]
+
+        failed = [(position, min(length, position + CHUNK_SIZE))
+                  for position, ok in zip(positions, results) if not ok]
+        sent = length - sum(end - start for start, end in failed)
+        if resumed and any(rejected(status) for status in statuses):
+            Logger().warning("Upload Id {} was refused, starting over".format(
+                upload_id))
+            progress.finish(user, md5, length, content_type)
+            return await self.upload(f, content_type, concurrency, retries,
+                                     progress, (md5, length))
+        if not failed and progress:
+            progress.finish(user, md5, length, content_type)
+        return UploadResult(upload_id, not failed, length, md5, sent, failed)
+
+    async def _create_upload(self, md5, length, content_type):
+        uri = '{}/v4/uploads'.format(climate.api_uri)
+        data = {
+            'md5': md5,
+            'length': length,
+            'contentType': content_type
+        }
+        res = await self.request('uploads', 'POST', uri,
+                                 headers=self.headers(), json=data)
+        if res.status_code == 201:
+            upload_id = res.json()
+            Logger().info("Upload Id: %s" % upload_id)
+            return upload_id
+
+        log_http_error(res)
+        return None
+
+    async def _put_chunk(self, put_uri, buf, position, length, retries):
+        """
+        See climate.ClimateClient._put_chunk.
+        :return: Status of the last attempt, or 0 without a response.
+        """
+        content_range = 'bytes {}-{}/{}'.format(
+            position, position + len(buf) - 1, length)
+        headers = self.headers(content_type=binary_content_type,
+                               content_range=content_range)
+        res = None
+        status = 0
+        for attempt in range(retries + 1):
+            if attempt:
+                delay = retry_after_seconds(res)
+                if delay is None:
+                    delay = UPLOAD_RETRY_DELAY * 2 ** (attempt - 1)
+                await asyncio.sleep(min(delay, self.retry_policy.max_delay))
+            try:
+                res = await self.request('upload_chunk', 'PUT', put_uri,
+                                         headers=headers, retry=False,
+                                         data=buf)
+            except CircuitOpenError as e:
+                # Fail the chunk at once; the upload can be resumed later.
+                Logger().error("Upload of {} failed: {}".format(
+                    content_range, e))
+                return 0
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                Logger().error("Upload of {} failed: {}".format(
+                    content_range, e))
+                res = None
+                status = 0
+                continue
+            status = res.status_code
+            if 200 <= status < 300:
+                return status
+            log_http_error(res)
+            if rejected(status):
+                return status
+        return status
+
+    async def get_upload_status(self, upload_id):
+        """See climate.ClimateClient.get_upload_status."""
+        uri = '{}/v4/uploads/{}/status'.format(climate.api_uri, upload_id)
+        headers = self.headers(accept=json_content_type)
+        res = await self.request('upload_status', 'GET', uri, headers=headers)
+        if res.status_code == 200:
+            return res.json()
+
+        log_http_error(res)
+        return None
+
+    async def get_scouting_observations(self,
+                                        limit=OBSERVATION_PAGE_SIZE,
+                                        next_token=None,
+                                        occurred_after=None,
+                                        occurred_before=None):
+        """See climate.ClimateClient.get_scouting_observations."""
+        observations = self.iter_scouting_observations(limit,
+                                                       next_token,
+                                                       occurred_after,
+                                                       occurred_before)
+        return [o async for o in observations]
+
+    def iter_scouting_observations(self,
+                                   limit=OBSERVATION_PAGE_SIZE,
+                                   next_token=None,
+                                   occurred_after=None,
+                                   occurred_before=None):
+        """See climate.ClimateClient.iter_scouting_observations.
+        :return: AsyncPageIterator over scouting observations.
+        """
+        uri = '{}/v4/layers/scoutingObservations'.format(climate.api_uri)
+        params = {
+            'occurredAfter': occurred_after,
+            'occurredBefore': occurred_before
+        }
+
+        async def fetch_page(token):
+            headers = self.headers(accept=json_content_type,
+                                   x_next_token=token)
+            return await self._request_page('scouting_observations', uri,
+                                            headers, limit, params=params)
+
+        return AsyncPageIterator(fetch_page, next_token)
+
+    async def get_scouting_observation(self, scouting_observation_id):
+        """See climate.ClimateClient.get_scouting_observation."""
+        uri = '{}/v4/layers/scoutingObservations/{}'.format(
+            climate.api_uri, scouting_observation_id)
+        headers = self.headers(accept=json_content_type)
+        res = await self.request('scouting_observation', 'GET', uri,
+                                 headers=headers)
+        if res.status_code == 200:
+            return res.json()
+
+        log_http_error(res)
+        return None
+
+    async def get_scouting_observation_attachments(self,
+                                                   scouting_observation_id):
+        """See climate.ClimateClient.get_scouting_observation_attachments."""
+        uri = '{}/v4/layers/scoutingObservations/{}/attachments'.format(
+            climate.api_uri, scouting_observation_id)
+        headers = self.headers(accept=json_content_type)
+        res = await self.request('attachments', 'GET', uri, headers=headers)
+        if res.status_code == 200:
+            return res.json()['results']
+
+        log_http_error(res)
+        return []
+
+    def get_scouting_observation_attachments_contents(self,
+                                                      scouting_observation_id,
+                                                      attachment_id,
+                                                      content_type,
+                                                      length,
+                                                      **kwargs):
+        """
+        See climate.ClimateClient
+        .get_scouting_observation_attachments_contents.
+        :return: async generator of bytes chunks, in order.
+        """
+        uri = '{}/v4/layers/scoutingObservations/{}/attachments/{}/contents'.\
+            format(climate.api_uri,
+                   scouting_observation_id,
+                   attachment_id)
+        headers = self.headers(accept=content_type)
+
+        return self.fetch_contents(uri, headers, length, **kwargs)
+
+    async def get_activities(self, next_token, activity,
+                             limit=ACTIVITY_PAGE_SIZE):
+        """See climate.ClimateClient.get_activities."""
+        uri = '{}/v4/layers/{}'.format(climate.api_uri, activity)
+        headers = self.headers(x_next_token=next_token)
+
+        res = await self._request_page('activities', uri, headers, limit)
+
+        if res.status_code == 200:
+            return None, res.json()['results']
+        if res.status_code == 206:
+            return res.headers['x-next-token'], res.json()['results']
+        if res.status_code == 304:
+            return None, None
+
+        log_http_error(res)
+
+        return None, None
+
+    def iter_activities(self, activity, next_token=None,
+                        limit=ACTIVITY_PAGE_SIZE):
+        """See climate.ClimateClient.iter_activities.
+        :return: AsyncPageIterator over activities.
+        """
+        uri = '{}/v4/layers/{}'.format(climate.api_uri, activity)
+
+        async def fetch_page(token):
+            headers = self.headers(x_next_token=token)
+            return await self._request_page('activities', uri, headers,
+                                            limit)
+
+        return AsyncPageIterator(fetch_page, next_token)
+
+    async def _request_page(self, endpoint, uri, headers, limit, **kwargs):
+        """See climate.ClimateClient._request_page."""
+        if not hasattr(limit, 'observe'):
+            headers = dict(headers, **{'x-limit': str(limit)})
+            return await self.request(endpoint, 'GET', uri, headers=headers,
+                                      **kwargs)
+        kwargs.setdefault('timeout', aiohttp.ClientTimeout(
+            total=None, sock_connect=CONNECT_TIMEOUT,
+            sock_read=limit.timeout))
+        while True:
+            page_headers = dict(headers, **{'x-limit': str(limit.limit)})
+            started = time.monotonic()
+            try:
+                res = await self.request(endpoint, 'GET', uri,
+                                         headers=page_headers,
+                                         retry=limit.limit <= limit.minimum,
+                                         **kwargs)
+            except asyncio.TimeoutError:
+                if limit.failed():
+                    continue
+                raise
+            if res.status_code >= 500 and limit.failed():
+                continue
+            if res.status_code in (200, 206):
+                limit.observe(time.monotonic() - started, len(res.content))
+            return res
+
+    def get_activity_contents(self, layer_id, activity_id, length, **kwargs):
+        """
+        See climate.ClimateClient.get_activity_contents.
+        :return: async generator of bytes chunks, in order.
+        """
+        uri = '{}/v4/layers/{}/{}/contents'.format(
+            climate.api_uri, layer_id, activity_id)
+        return self.fetch_contents(uri, self.headers(), length, **kwargs)
+
+    async def fetch_contents(self, uri, headers, length,
+                             concurrency=DOWNLOAD_CONCURRENCY,
+                             chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """
+        See climate.ClimateClient.fetch_contents. Up to concurrency range
+        requests run as tasks while chunks are yielded in order.
+        """
+        pending = deque()
+        try:
+            for start in range(0, length, chunk_size):
+                end = min(length, start + chunk_size)
+                pending.append(asyncio.ensure_future(
+                    self._fetch_range(uri, headers, start, end)))
+                if len(pending) < max(1, concurrency):
+                    continue
+                res = await pending.popleft()
+                if not self._check_range(res):
+                    return
+                yield res.content
+            while pending:
+                res = await pending.popleft()
+                if not self._check_range(res):
+                    return
+                yield res.content
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _fetch_range(self, uri, headers, start, end):
+        headers = dict(headers)
+        headers['Range'] = 'bytes={}-{}'.format(start, end - 1)
+        # Ranges of a compressed body could not be decoded on their own.
+        headers['Accept-Encoding'] = 'identity'
+        return await self.request('contents', 'GET', uri, headers=headers)
+
+    @staticmethod
+    def _check_range(res):
+        if res.status_code == 200 or res.status_code == 206:
+            return True
+        log_http_error(res)
+        return False
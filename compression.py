@@ -0,0 +1,130 @@
+"""
+Compression
+
+HTTP content coding for the app's traffic. JSON listings and the pages that
+dump them compress to a fraction of their size, so:
+
+ - API calls offer Accept-Encoding with the best codings the HTTP stack can
+   decode (zstd and br when urllib3 supports them, then gzip),
+ - the web pages are compressed with the best coding the browser accepts
+   once they are larger than MIN_SIZE,
+ - upload chunks can be sent with Content-Encoding when their content type
+   is not compressed already.
+
+gzip always works; brotli (pip install brotli) and zstd (pip install
+zstandard) are used when installed.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bodies smaller than this are sent as they are: the saving would not be
+# worth the CPU, or would not even save a packet.
+MIN_SIZE = 1024
+
+# Levels tuned for compressing responses on the fly rather than for size.
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+# Codings by preference.
+PREFERENCE = ('zstd', 'br', 'gzip')
+
+# Content types that are compressed already, or nearly incompressible.
+COMPRESSED_TYPES = ('application/zip', 'application/gzip',
+                    'application/x-gzip', 'application/zstd',
+                    'image/jpeg', 'image/png', 'image/gif', 'image/webp',
+                    'video/', 'audio/')
+
+# Content types worth compressing on the way out of the web app.
+TEXT_TYPES = ('text/', 'application/json', 'application/javascript',
+              'application/xml', 'image/svg+xml')
+
+
+def _encoders():
+    encoders = {'gzip': lambda data: gzip.compress(data, GZIP_LEVEL)}
+    if brotli is not None:
+        encoders['br'] = lambda data: brotli.compress(
+            data, quality=BROTLI_QUALITY)
+    if zstandard is not None:
+        encoders['zstd'] = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress
+    return encoders
+
+
+ENCODERS = _encoders()
+
+
+def accept_encoding(decodable):
+    """
+    :param decodable: Codings the client can decode, e.g. urllib3's
+        HTTPResponse.CONTENT_DECODERS.
+    :return: Accept-Encoding header value offering them, best first.
+    """
+    offered = [coding for coding in PREFERENCE if coding in decodable]
+    offered += [coding for coding in ('deflate',) if coding in decodable]
+    return ', '.join(offered) or 'identity'
+
+
+def negotiate(header):
+    """
+    :param header: Accept-Encoding request header, or None.
+    :return: The coding in ENCODERS the client prefers (by q-value, then by
+        PREFERENCE), or None to send the body as it is.
+    """
+    weights = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        q = 1.0
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            weights[coding] = q
+    best = None
+    for coding in PREFERENCE:
+        q = weights.get(coding, weights.get('*', 0.0))
+        if coding in ENCODERS and q > 0 and \
+                (best is None or q > weights.get(best, weights.get('*'))):
+            best = coding
+    return best
+
+
+def compress(data, coding):
+    """
+    :param data: bytes.
+    :param coding: A coding in ENCODERS.
+    :return: data compressed with coding.
+    """
+    return ENCODERS[coding](data)
+
+
+def compressible(content_type, text_only=False):
+    """
+    :param content_type: Content type of a body, parameters allowed.
+    :param text_only: Only accept TEXT_TYPES, rather than anything not in
+        COMPRESSED_TYPES.
+    :return: True if the body is worth compressing.
+    """
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if not content_type:
+        return False
+    if text_only:
+        return content_type.startswith(TEXT_TYPES) or \
+            content_type.endswith(('+json', '+xml'))
+    return not content_type.startswith(COMPRESSED_TYPES)
@@ -0,0 +1,303 @@
+"""
+Download spool
+
+Activity and attachment contents are downloaded once into a local file
+cache and served from there with send_file, so the web server can hand the
+file to the socket (sendfile, or X-Sendfile behind a proxy) instead of
+copying every chunk through Python. Repeat downloads of the same object do
+not call Climate again.
+
+A miss does not hold the response back until the download is over: the
+download runs in a background thread into a partial file, and every request
+for the object (the first one included) streams that file as it grows.
+Concurrent requests within a process therefore share one download, and a
+client going away does not abort it. Objects larger than the spool are streamed
+straight through without being kept.
+
+The files are their own index: a file is complete when its size is the
+expected length, and its mtime, touched on every hit, orders eviction. Once
+the spool grows past its size budget the least recently used files are
+deleted. Several worker processes can therefore share one spool directory.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+MAX_BYTES = 1024 * 1024 * 1024
+PART_SUFFIX = '.part'
+# Partial files older than this were left by a crashed download.
+STALE_PART_AGE = 3600
+# Size of the chunks read back from the spool while streaming.
+READ_SIZE = 1024 * 1024
+
+
+class DownloadError(Exception):
+    """
+    The download failed or ended before all the bytes were received.
+    """
+
+
+class _Download:
+    """
+    A download in progress: written bytes so far, and its outcome once done.
+    """
+
+    def __init__(self, part):
+        self.part = part
+        self.written = 0
+        self.done = False
+        self.error = None
+        self.changed = threading.Condition()
+
+
+class DownloadSpool:
+    """
+    Size-bounded LRU cache of downloaded contents in a directory. Safe to
+    share between threads and processes.
+    """
+
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        """
+        :param directory: Directory to keep the files in. Created if
+            missing, and restricted to the owner.
+        :param max_bytes: Disk space the spool may use.
+        """
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # Also applies to an existing directory; fails if someone else
+        # owns it.
+        os.chmod(directory, 0o700)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        # key -> _Download
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def open(self, key, length):
+        """
+        :param key: str naming the object, e.g. user, layer, activity and
+            length. Include who may see it: files are served to anyone
+            asking with the same key.
+        :param length: Size of the contents in bytes.
+        :return: Binary file object open on the spooled contents, or None
+            if they are not (completely) spooled.
+        """
+        f = self._open_complete(self._path(key), length)
+        if f is not None:
+            with self._lock:
+                self.hits += 1
+        return f
+
+    def path(self, key, length):
+        """
+        Like open, for callers that hand the file to something else to read
+        (send_file, X-Sendfile). The file can be evicted before it is opened,
+        so be ready for FileNotFoundError.
+        :return: Path of the spooled contents, or None if they are not
+            (completely) spooled.
+        """
+        path = self._path(key)
+        try:
+            if os.stat(path).st_size != length:
+                return None
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def stream(self, key, length, download):
+        """
+        Streams the contents of key, joining the download in progress for
+        key or starting one in the background. Contents larger than the
+        spool are streamed from download without being kept.
+        :param key: See open.
+        :param length: Size of the contents in bytes.
+        :param download: Function returning an iterable of the bytes chunks
+            of the contents, e.g. climate.get_activity_contents. Called from
+            a background thread, at most once per key at a time.
+        :return: Generator of bytes chunks. Raises DownloadError when the
+            download fails or is short.
+        """
+        if length > self.max_bytes:
+            return self._direct(length, download)
+        path = self._path(key)
+        with self._lock:
+            f = self._open_complete(path, length)
+            if f is not None:
+                self.hits += 1
+                return self._read(f, length, None)
+            current = self._inflight.get(key)
+            if current is None:
+                self.misses += 1
+                current = _Download('{}.{}{}'.format(path, uuid.uuid4().hex,
+                                                     PART_SUFFIX))
+                out = open(current.part, 'wb')
+                self._inflight[key] = current
+                threading.Thread(target=self._download,
+                                 args=(key, path, length, download, current,
+                                       out),
+                                 daemon=True).start()
+            else:
+                self.shared += 1
+            # Opened under the lock: the partial file is only renamed or
+            # removed under it, and an open file survives both.
+            f = open(current.part, 'rb')
+        return self._read(f, length, current)
+
+    def stats(self):
+        """
+        :return: dict of hit/miss counters and the disk space used.
+        """
+        files = self._files()
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'shared': self.shared,
+                'files': len(files),
+                'bytes': sum(size for _, size, _ in files)
+            }
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name)
+
+    @staticmethod
+    def _open_complete(path, length):
+        """
+        :return: path opened for reading if it holds length bytes, else None.
+            A hit marks the file as recently used.
+        """
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        if os.fstat(f.fileno()).st_size != length:
+            f.close()
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # Evicted meanwhile; the open file is still readable.
+        return f
+
+    @staticmethod
+    def _direct(length, download):
+        received = 0
+        try:
+            for chunk in download():
+                received += len(chunk)
+                yield chunk
+        except DownloadError:
+            raise
+        except Exception as e:
+            raise DownloadError(str(e)) from e
+        if received != length:
+            raise DownloadError('Received {} of {} bytes'.format(received,
+                                                                 length))
+
+    @staticmethod
+    def _read(f, length, current):
+        """
+        Yields the contents of f, waiting for current (if not None) to write
+        them.
+        """
+        with f:
+            sent = 0
+            while sent < length:
+                if current is not None:
+                    with current.changed:
+                        while current.written <= sent and not current.done:
+                            current.changed.wait()
+                        if current.error is not None:
+                            raise current.error
+                        available = current.written - sent
+                else:
+                    available = length - sent
+                chunk = f.read(min(available, READ_SIZE))
+                if not chunk:
+                    raise DownloadError('Spooled file ended at {} of {} '
+                                        'bytes'.format(sent, length))
+                sent += len(chunk)
+                yield chunk
+
+    def _download(self, key, path, length, download, current, out):
+        """
+        Writes the contents to the partial file of current and moves it into
+        place only when all length bytes were received.
+        """
+        error = None
+        try:
+            with out:
+                self._make_room(length)
+                for chunk in download():
+                    out.write(chunk)
+                    out.flush()
+                    with current.changed:
+                        current.written += len(chunk)
+                        current.changed.notify_all()
+            if current.written != length:
+                error = DownloadError('Received {} of {} bytes'.format(
+                    current.written, length))
+        except Exception as e:
+            error = DownloadError(str(e))
+            error.__cause__ = e
+        with self._lock:
+            if error is None:
+                os.replace(current.part, path)
+            else:
+                os.remove(current.part)
+            del self._inflight[key]
+        with current.changed:
+            current.error = error
+            current.done = True
+            current.changed.notify_all()
+
+    def _files(self):
+        """
+        :return: list of (path, size, mtime) of the complete files.
+        """
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(PART_SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((entry.path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _make_room(self, length):
+        """
+        Deletes least recently used files until length more bytes fit, and
+        partial files left behind by crashed downloads.
+        """
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(PART_SUFFIX):
+                try:
+                    if entry.stat().st_mtime < now - STALE_PART_AGE:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+        files = sorted(self._files(), key=lambda f: f[2])
+        used = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if used + length <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            used -= size
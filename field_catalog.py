@@ -0,0 +1,165 @@
+"""
+Field catalog
+
+In-memory index of a user's fields for the web pages. Fields are kept as
+compact FieldRecord objects (id, name and boundaryId only, in __slots__)
+instead of the raw JSON dicts, and are indexed by id and by boundaryId so
+lookups are O(1) however many fields the user has. An optional index of
+lower-cased names answers name prefix queries with a binary search.
+
+The catalog is updated in place, one page of get_fields results at a time.
+The name index is sorted once per update rather than once per field, so
+loading tens of thousands of fields stays O(n log n).
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import threading
+from bisect import bisect_left, insort
+
+
+class FieldRecord:
+    """
+    The parts of a field the app uses.
+    """
+    __slots__ = ('id', 'name', 'boundary_id')
+
+    def __init__(self, id, name, boundary_id):
+        self.id = id
+        self.name = name
+        self.boundary_id = boundary_id
+
+    @classmethod
+    def from_json(cls, field):
+        """
+        :param field: Field object as returned by get_fields.
+        """
+        return cls(field['id'], field.get('name'), field.get('boundaryId'))
+
+
+class FieldCatalog:
+    """
+    Fields of one user indexed by id, boundaryId and optionally name. Safe to
+    share between threads; iteration is in insertion order.
+    """
+
+    def __init__(self, fields=(), name_index=False):
+        """
+        :param fields: Fields (JSON objects) to start with.
+        :param name_index: Also index names for with_prefix.
+        """
+        self._by_id = {}
+        self._by_boundary = {}
+        # Sorted (lower-cased name, id) pairs, or None without a name index.
+        self._names = [] if name_index else None
+        self._lock = threading.Lock()
+        self.update(fields)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, field_id):
+        return field_id in self._by_id
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._by_id.values()))
+
+    def get(self, field_id):
+        """
+        :return: FieldRecord with the id, or None.
+        """
+        return self._by_id.get(field_id)
+
+    def by_boundary(self, boundary_id):
+        """
+        :return: FieldRecord whose boundaryId is boundary_id, or None.
+        """
+        return self._by_boundary.get(boundary_id)
+
+    def boundary_ids(self):
+        """
+        :return: list of the boundaryIds of all fields.
+        """
+        return list(self._by_boundary)
+
+    def with_prefix(self, prefix):
+        """
+        :return: list of FieldRecords whose name starts with prefix, ignoring
+            case, in name order.
+        """
+        if self._names is None:
+            raise ValueError('FieldCatalog was created without name_index')
+        prefix = prefix.lower()
+        with self._lock:
+            i = bisect_left(self._names, (prefix, ''))
+            ids = []
+            while i < len(self._names) and \
+                    self._names[i][0].startswith(prefix):
+                ids.append(self._names[i][1])
+                i += 1
+            return [self._by_id[field_id] for field_id in ids]
+
+    def update(self, fields):
+        """
+        Adds or replaces fields by id, e.g. with a page of get_fields
+        results.
+        :param fields: Iterable of field JSON objects.
+        """
+        with self._lock:
+            # id -> name key, so a field repeated in fields is indexed once.
+            names = {}
+            for field in fields:
+                record = FieldRecord.from_json(field)
+                if record.id in self._by_id:
+                    self._remove(record.id)
+                self._by_id[record.id] = record
+                if record.boundary_id:
+                    self._by_boundary[record.boundary_id] = record
+                names[record.id] = self._name_key(record)
+            if self._names is None or not names:
+                return
+            if len(names) == 1:
+                insort(self._names, *names.values())
+            else:
+                # Timsort merges the sorted index with the new run in
+                # linear time plus sorting the new names.
+                self._names.extend(names.values())
+                self._names.sort()
+
+    def remove(self, field_id):
+        with self._lock:
+            self._remove(field_id)
+
+    def retain(self, field_ids):
+        """
+        Removes every field whose id is not in field_ids.
+        :return: Number of fields removed.
+        """
+        with self._lock:
+            missing = [i for i in self._by_id if i not in field_ids]
+            names, self._names = self._names, None
+            for field_id in missing:
+                self._remove(field_id)
+            if names is not None:
+                # One pass instead of a list deletion per removed field.
+                removed = set(missing)
+                self._names = [key for key in names if key[1] not in removed]
+            return len(missing)
+
+    @staticmethod
+    def _name_key(record):
+        return (record.name or '').lower(), record.id
+
+    def _remove(self, field_id):
+        record = self._by_id.pop(field_id, None)
+        if record is None:
+            return
+        if self._by_boundary.get(record.boundary_id) is record:
+            del self._by_boundary[record.boundary_id]
+        if self._names is not None:
+            key = self._name_key(record)
+            i = bisect_left(self._names, key)
+            if i < len(self._names) and self._names[i] == key:
+                del self._names[i]
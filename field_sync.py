@@ -0,0 +1,186 @@
+"""
+Incremental field sync
+
+get_fields pages are ordered by date modified, so the x-next-token of the
+last page works as a cursor: listing again from it only returns fields
+changed since. FieldSync keeps that cursor per user and applies just the
+changed fields to a local FieldStore, making a refresh cost proportional to
+the number of changes rather than the number of fields.
+
+Deleted fields never show up in such a listing, so every full_sync_interval
+FieldSync does a full listing instead and removes fields that are no longer
+there.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from logger import Logger
+
+FULL_SYNC_INTERVAL = 24 * 60 * 60
+
+
+class FieldStore:
+    """
+    SQLite store of each user's fields and field sync cursor. Safe to share
+    between threads.
+    """
+
+    def __init__(self, path=':memory:'):
+        """
+        :param path: SQLite file, in memory by default. The fields are
+            users' private data: a file is created with mode 0600, and
+            should be kept in a directory only the app's user can access.
+        """
+        self._lock = threading.Lock()
+        if path != ':memory:':
+            # SQLite creates the file with the umask's mode; create it
+            # private first.
+            os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+            os.chmod(path, 0o600)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS fields ('
+                         'user_id TEXT NOT NULL, '
+                         'id TEXT NOT NULL, '
+                         'field TEXT NOT NULL, '
+                         'PRIMARY KEY (user_id, id))')
+        self._db.execute('CREATE TABLE IF NOT EXISTS cursors ('
+                         'user_id TEXT PRIMARY KEY, '
+                         'next_token TEXT, '
+                         'full_sync REAL NOT NULL)')
+        self._db.commit()
+
+    def fields(self, user_id):
+        """
+        :return: list of the user's fields.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT field FROM fields WHERE user_id = ? ORDER BY rowid',
+                (user_id,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def field(self, user_id, field_id):
+        """
+        :return: The user's field with the id, or None.
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT field FROM fields WHERE user_id = ? AND id = ?',
+                (user_id, field_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def upsert(self, user_id, fields):
+        """
+        Adds or replaces fields by id.
+        """
+        with self._lock:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO fields VALUES (?, ?, ?)',
+                ((user_id, f['id'], json.dumps(f)) for f in fields))
+            self._db.commit()
+
+    def delete_missing(self, user_id, field_ids):
+        """
+        Deletes the user's fields whose id is not in field_ids.
+        :return: number of fields deleted.
+        """
+        with self._lock:
+            stored = self._db.execute(
+                'SELECT id FROM fields WHERE user_id = ?',
+                (user_id,)).fetchall()
+            missing = [(user_id, row[0]) for row in stored
+                       if row[0] not in field_ids]
+            self._db.executemany(
+                'DELETE FROM fields WHERE user_id = ? AND id = ?', missing)
+            self._db.commit()
+        return len(missing)
+
+    def cursor(self, user_id):
+        """
+        :return: (next_token, time of the last full sync), or (None, None)
+            if the user was never synced.
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT next_token, full_sync FROM cursors '
+                'WHERE user_id = ?', (user_id,)).fetchone()
+        return row if row else (None, None)
+
+    def set_cursor(self, user_id, next_token, full_sync):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO cursors VALUES (?, ?, ?)',
+                             (user_id, next_token, full_sync))
+            self._db.commit()
+
+
+class FieldSync:
+    """
+    Brings a FieldStore up to date with a user's fields in Climate.
+    """
+
+    def __init__(self, store, full_sync_interval=FULL_SYNC_INTERVAL):
+        """
+        :param store: FieldStore to sync into.
+        :param full_sync_interval: Seconds between full listings that detect
+            deleted fields.
+        """
+        self.store = store
+        self.full_sync_interval = full_sync_interval
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def sync(self, user_id, client, catalog=None):
+        """
+        Applies fields changed since the last sync, or does a full sync when
+        the user has no cursor yet or the last full sync is older than
+        full_sync_interval. Concurrent syncs of the same user are serialized.
+        If a listing fails part way, the fetched fields are kept but the
+        cursor is not advanced and nothing is deleted.
+        :param user_id: id of the user the fields belong to.
+        :param client: climate.ClimateClient with the user's access_token.
+        :param catalog: Optional field_catalog.FieldCatalog of the user,
+            updated with each page as it arrives.
+        :return: dict with the number of fields updated and deleted, and
+            whether it was a full sync.
+        """
+        with self._user_lock(user_id):
+            next_token, full_sync = self.store.cursor(user_id)
+            now = time.time()
+            full = full_sync is None or \
+                now - full_sync >= self.full_sync_interval
+            if full:
+                next_token = None
+
+            fields = client.iter_fields(next_token)
+            seen = set()
+            for page in fields.pages():
+                self.store.upsert(user_id, page)
+                if catalog is not None:
+                    catalog.update(page)
+                seen.update(f['id'] for f in page)
+
+            result = {'updated': len(seen), 'deleted': 0, 'full': full}
+            if not fields.done:
+                Logger().error("Field sync for {} stopped with status {}"
+                               .format(user_id, fields.status_code))
+                return result
+
+            if full:
+                result['deleted'] = self.store.delete_missing(user_id, seen)
+                if catalog is not None:
+                    catalog.retain(seen)
+                full_sync = now
+            self.store.set_cursor(user_id, fields.next_token, full_sync)
+            Logger().info("Field sync for {}: {}".format(user_id, result))
+            return result
+
+    def _user_lock(self, user_id):
+        with self._locks_lock:
+            return self._locks.setdefault(user_id, threading.Lock())
@@ -6,8 +6,12 @@ Copyright © 2018 The Climate Corporation
 """
 
 import hashlib
+import mmap
 import os
 
+BUFFER_SIZE = 1024 * 1024
+SIDECAR_SUFFIX = '.md5'
+
 
 def length(f):
     """Get the length of a file"""
@@ -18,11 +22,78 @@ def length(f):
 
 def md5(f):
     """Get the md5 of a file's contents"""
+    return md5_and_length(f)[0]
+
+
+def md5_and_length(f, buffer_size=BUFFER_SIZE):
+    """
+    Get the md5 and length of a file's contents in a single pass, reading
+    into one reusable buffer.
+    :param f: file object, read from the start.
+    :param buffer_size: Size of the read buffer.
+    :return: (md5 hex digest, length in bytes)
+    """
     f.seek(0)
     md5 = hashlib.md5()
-    chunk_size = 2**10
+    length = 0
+    readinto = getattr(f, 'readinto', None)
+
+    if readinto is None:
+        for bytes_chunk in iter(lambda: f.read(buffer_size), b''):
+            md5.update(bytes_chunk)
+            length += len(bytes_chunk)
+        return md5.hexdigest(), length
+
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    while True:
+        n = readinto(buf)
+        if not n:
+            break
+        md5.update(view[:n])
+        length += n
+
+    return md5.hexdigest(), length
+
+
+def path_md5_and_length(path):
+    """
+    Get the md5 and length of the file at path by hashing a memory map of it,
+    which avoids copying the contents through Python buffers.
+    :param path: path of the file.
+    :return: (md5 hex digest, length in bytes)
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return hashlib.md5().hexdigest(), 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return hashlib.md5(m).hexdigest(), size
+
 
-    for bytes_chunk in iter(lambda: f.read(chunk_size), b''):
-        md5.update(bytes_chunk)
+def cached_md5_and_length(path):
+    """
+    Get the md5 and length of the file at path, using a "<path>.md5" sidecar
+    file when one exists and still matches the file's size and modification
+    time. Otherwise the digest is computed with path_md5_and_length and the
+    sidecar is (re)written.
+    :param path: path of the file.
+    :return: (md5 hex digest, length in bytes)
+    """
+    stat = os.stat(path)
+    sidecar = path + SIDECAR_SUFFIX
+    try:
+        with open(sidecar) as f:
+            md5, size, mtime = f.read().split()
+        if int(size) == stat.st_size and int(mtime) == stat.st_mtime_ns:
+            return md5, stat.st_size
+    except (OSError, ValueError):
+        pass
 
-    return md5.hexdigest()
+    md5, size = path_md5_and_length(path)
+    try:
+        with open(sidecar, 'w') as f:
+            f.write('{} {} {}\n'.format(md5, size, stat.st_mtime_ns))
+    except OSError:
+        pass
+    return md5, size
@@ -0,0 +1,244 @@
+"""
+Boundary geometry metrics
+
+Area, centroid and bounding box of field boundaries, computed for many
+boundaries at once. The boundaries' rings are packed into flat NumPy
+coordinate arrays with ring and boundary offsets, and every metric is a
+handful of vectorised operations over all vertices, instead of a Python loop
+per ring.
+
+Areas are in square metres, computed on a local equirectangular projection
+around each boundary (accurate to well under 1% for field sized polygons);
+centroids and bounding boxes are in the boundary's longitude/latitude.
+
+Boundaries are immutable, so metrics are cached by boundary_id.
+
+NumPy is listed in requirements.txt. Where it cannot be installed the
+same metrics are computed in pure Python, one boundary at a time.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import math
+import threading
+from collections import namedtuple, OrderedDict
+
+from spatial_index import polygons
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EARTH_RADIUS = 6371008.8
+METRES_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+# area: square metres.
+# centroid: (longitude, latitude), or None for an empty boundary.
+# bbox: (min longitude, min latitude, max longitude, max latitude), or None.
+BoundaryMetrics = namedtuple('BoundaryMetrics', ['area', 'centroid', 'bbox'])
+
+EMPTY = BoundaryMetrics(0.0, None, None)
+
+
+class PackedBoundaries:
+    """
+    Rings of many boundaries in flat arrays: x and y hold every vertex,
+    ring_offsets[i]:ring_offsets[i + 1] are the vertices of ring i, and
+    boundary_offsets[j]:boundary_offsets[j + 1] are the rings of boundary
+    j. hole[i] is True for the inner rings of a polygon.
+    """
+
+    def __init__(self, geojsons):
+        """
+        :param geojsons: list of boundaries as returned by get_boundary.
+        """
+        xs, ys, ring_offsets, boundary_offsets, holes = [], [], [0], [0], []
+        for geojson in geojsons:
+            for polygon in polygons(geojson):
+                for i, ring in enumerate(polygon):
+                    if len(ring) < 3:
+                        continue
+                    ring_xs, ring_ys = zip(*ring)
+                    xs.extend(ring_xs)
+                    ys.extend(ring_ys)
+                    ring_offsets.append(len(xs))
+                    holes.append(i > 0)
+            boundary_offsets.append(len(holes))
+        self.x = np.array(xs, dtype=np.float64)
+        self.y = np.array(ys, dtype=np.float64)
+        self.ring_offsets = np.array(ring_offsets, dtype=np.int64)
+        self.boundary_offsets = np.array(boundary_offsets, dtype=np.int64)
+        self.hole = np.array(holes, dtype=bool)
+
+    def __len__(self):
+        return len(self.boundary_offsets) - 1
+
+    def metrics(self):
+        """
+        :return: list of BoundaryMetrics, one per boundary.
+        """
+        count = len(self)
+        rings = len(self.hole)
+        if not rings:
+            return [EMPTY] * count
+        ring_sizes = np.diff(self.ring_offsets)
+        ring_boundary = np.repeat(np.arange(count),
+                                  np.diff(self.boundary_offsets))
+        vertex_ring = np.repeat(np.arange(rings), ring_sizes)
+        vertex_boundary = ring_boundary[vertex_ring]
+        starts = self.ring_offsets[:-1]
+
+        # Bounding boxes, from the per ring extremes.
+        ring_min_x = np.minimum.reduceat(self.x, starts)
+        ring_max_x = np.maximum.reduceat(self.x, starts)
+        ring_min_y = np.minimum.reduceat(self.y, starts)
+        ring_max_y = np.maximum.reduceat(self.y, starts)
+        min_x = np.full(count, np.inf)
+        max_x = np.full(count, -np.inf)
+        min_y = np.full(count, np.inf)
+        max_y = np.full(count, -np.inf)
+        np.minimum.at(min_x, ring_boundary, ring_min_x)
+        np.maximum.at(max_x, ring_boundary, ring_max_x)
+        np.minimum.at(min_y, ring_boundary, ring_min_y)
+        np.maximum.at(max_y, ring_boundary, ring_max_y)
+
+        # Boundaries without rings are zeroed, and reported as EMPTY.
+        empty = np.isinf(min_x)
+        for bound in (min_x, min_y, max_x, max_y):
+            bound[empty] = 0.0
+
+        # Local projection in metres around each boundary's bbox corner.
+        scale_x = np.cos(np.radians((min_y + max_y) / 2)) * METRES_PER_DEGREE
+        px = (self.x - min_x[vertex_boundary]) * scale_x[vertex_boundary]
+        py = (self.y - min_y[vertex_boundary]) * METRES_PER_DEGREE
+
+        # Shoelace terms of each edge (vertex to next vertex in its ring).
+        following = np.arange(1, len(px) + 1)
+        following[self.ring_offsets[1:] - 1] = starts
+        nx, ny = px[following], py[following]
+        cross = px * ny - nx * py
+        twice_area = np.add.reduceat(cross, starts)
+        cx_sum = np.add.reduceat((px + nx) * cross, starts)
+        cy_sum = np.add.reduceat((py + ny) * cross, starts)
+
+        # Outer rings add, holes subtract, whatever their winding.
+        sign = np.where(self.hole, -1.0, 1.0) * np.sign(twice_area)
+        area = np.bincount(ring_boundary, sign * twice_area / 2,
+                           minlength=count)
+        cx = np.bincount(ring_boundary, sign * cx_sum / 6, minlength=count)
+        cy = np.bincount(ring_boundary, sign * cy_sum / 6, minlength=count)
+
+        # Degenerate boundaries (no area) fall back to the bbox center.
+        solid = (area > 0) & (scale_x > 0)
+        safe_area = np.where(solid, area, 1.0)
+        safe_scale = np.where(solid, scale_x, 1.0)
+        centroid_x = np.where(solid, min_x + cx / safe_area / safe_scale,
+                              (min_x + max_x) / 2)
+        centroid_y = np.where(
+            solid, min_y + cy / safe_area / METRES_PER_DEGREE,
+            (min_y + max_y) / 2)
+
+        result = []
+        for row in zip(empty.tolist(), area.tolist(), centroid_x.tolist(),
+                       centroid_y.tolist(), min_x.tolist(), min_y.tolist(),
+                       max_x.tolist(), max_y.tolist()):
+            if row[0]:
+                result.append(EMPTY)
+            else:
+                result.append(BoundaryMetrics(row[1], row[2:4], row[4:]))
+        return result
+
+
+def boundary_metrics(geojson):
+    """
+    Pure Python metrics of one boundary, used when NumPy is not installed.
+    :return: BoundaryMetrics
+    """
+    rings = [(ring, i > 0) for polygon in polygons(geojson)
+             for i, ring in enumerate(polygon) if len(ring) >= 3]
+    if not rings:
+        return EMPTY
+    min_x = min(p[0] for ring, _ in rings for p in ring)
+    max_x = max(p[0] for ring, _ in rings for p in ring)
+    min_y = min(p[1] for ring, _ in rings for p in ring)
+    max_y = max(p[1] for ring, _ in rings for p in ring)
+    scale_x = math.cos(math.radians((min_y + max_y) / 2)) * METRES_PER_DEGREE
+    area = cx = cy = 0.0
+    for ring, hole in rings:
+        points = [((x - min_x) * scale_x, (y - min_y) * METRES_PER_DEGREE)
+                  for x, y in ring]
+        twice_area = ring_cx = ring_cy = 0.0
+        for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]):
+            cross = x1 * y2 - x2 * y1
+            twice_area += cross
+            ring_cx += (x1 + x2) * cross
+            ring_cy += (y1 + y2) * cross
+        sign = (-1.0 if hole else 1.0) * math.copysign(1.0, twice_area)
+        area += sign * twice_area / 2
+        cx += sign * ring_cx / 6
+        cy += sign * ring_cy / 6
+    if area > 0 and scale_x:
+        centroid = (min_x + cx / area / scale_x,
+                    min_y + cy / area / METRES_PER_DEGREE)
+    else:
+        centroid = ((min_x + max_x) / 2, (min_y + max_y) / 2)
+    return BoundaryMetrics(area, centroid, (min_x, min_y, max_x, max_y))
+
+
+def compute(geojsons):
+    """
+    :param geojsons: list of boundaries as returned by get_boundary.
+    :return: list of BoundaryMetrics, in the same order.
+    """
+    if np is None:
+        return [boundary_metrics(g) for g in geojsons]
+    return PackedBoundaries(geojsons).metrics()
+
+
+class GeometryCache:
+    """
+    BoundaryMetrics by boundary_id, computed in batches. Safe to share
+    between threads.
+    """
+
+    def __init__(self, capacity=100000):
+        """
+        :param capacity: Max number of boundaries kept.
+        """
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, boundaries):
+        """
+        :param boundaries: dict of boundary_id to geojson; boundaries that
+            could not be fetched (None) are skipped.
+        :return: dict of boundary_id to BoundaryMetrics.
+        """
+        result = {}
+        missing = []
+        with self._lock:
+            for boundary_id, geojson in boundaries.items():
+                metrics = self._entries.get(boundary_id)
+                if metrics is not None:
+                    self._entries.move_to_end(boundary_id)
+                    result[boundary_id] = metrics
+                elif geojson is not None:
+                    missing.append(boundary_id)
+        if missing:
+            computed = compute([boundaries[i] for i in missing])
+            result.update(zip(missing, computed))
+            with self._lock:
+                for boundary_id, metrics in zip(missing, computed):
+                    self._entries[boundary_id] = metrics
+                while len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+        return result
+
+    def get(self, boundary_id, geojson):
+        """
+        :return: BoundaryMetrics of one boundary.
+        """
+        return self.get_many({boundary_id: geojson}).get(boundary_id)
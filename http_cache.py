@@ -0,0 +1,184 @@
+"""
+Conditional request cache
+
+Keeps the body of GET responses that carry an ETag or Last-Modified
+validator, keyed by user, uri, query and page token. The next GET of the
+same page is sent with If-None-Match / If-Modified-Since; when Climate
+answers 304 Not Modified the cached body is served, so revisiting a page
+costs a round trip but no payload.
+
+Like the boundary cache it has a bounded in-memory LRU (bounded by entries
+and bytes) and an optional SQLite file on local disk (sqlite_lru.SQLiteLRU),
+read and written outside the memory tier's lock. The bodies are users'
+private data, so the file is only readable by the app's user.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import json
+import threading
+from collections import namedtuple, OrderedDict
+from urllib.parse import urlencode
+
+from sqlite_lru import SQLiteLRU
+
+# Response headers stored with a cached body.
+KEPT_HEADERS = ('content-type', 'etag', 'last-modified', 'x-next-token')
+
+# status: status of the response the body came with (200 or 206).
+# headers: dict of the KEPT_HEADERS it had.
+# body: bytes.
+CachedResponse = namedtuple('CachedResponse', ['status', 'headers', 'body'])
+
+
+def cache_key(user, uri, params=None, headers=None):
+    """
+    :param user: Whose response it is, e.g. a user id; bodies are never
+        shared between users.
+    :param uri: Request uri.
+    :param params: Query parameters, or None.
+    :param headers: Request headers; x-next-token and x-limit select the
+        page.
+    :return: str key.
+    """
+    headers = headers or {}
+    query = urlencode(sorted((k, v) for k, v in (params or {}).items()
+                             if v is not None))
+    return '{} {}?{} {} {}'.format(user, uri, query,
+                                   headers.get('x-next-token') or '',
+                                   headers.get('x-limit') or '')
+
+
+def cacheable(status, headers):
+    """
+    :return: True if a response with status and headers can be validated
+        later.
+    """
+    return status in (200, 206) and \
+        ('etag' in headers or 'last-modified' in headers)
+
+
+def conditional_headers(entry):
+    """
+    :return: dict of the If-None-Match / If-Modified-Since headers to
+        revalidate entry.
+    """
+    headers = {}
+    if entry.headers.get('etag'):
+        headers['if-none-match'] = entry.headers['etag']
+    if entry.headers.get('last-modified'):
+        headers['if-modified-since'] = entry.headers['last-modified']
+    return headers
+
+
+class ValidatorCache:
+    """
+    Two tier cache of validated responses. Safe to share between threads.
+    """
+
+    def __init__(self, capacity=1024, max_bytes=64 * 1024 * 1024, path=None,
+                 disk_capacity=None):
+        """
+        :param capacity: Max number of responses kept in memory.
+        :param max_bytes: Max total size of the bodies kept in memory.
+        :param path: Optional SQLite file for the disk tier, created with
+            mode 0600. Keep it in a directory only the app's user can access.
+        :param disk_capacity: Max number of responses kept on disk, or None
+            for no limit.
+        """
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.disk_capacity = disk_capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk = None
+        if path:
+            self._disk = SQLiteLRU(path, 'responses', 'key',
+                                   [('status', 'INTEGER'),
+                                    ('headers', 'TEXT'),
+                                    ('body', 'BLOB')],
+                                   capacity=disk_capacity, private=True)
+
+    def get(self, key):
+        """
+        :return: The CachedResponse stored under key, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        entry = self._disk_get(key)
+        if entry is not None:
+            with self._lock:
+                self._memory_put(key, entry)
+        return entry
+
+    def put(self, key, status, headers, body):
+        """
+        Stores a response in both tiers.
+        :param headers: Response headers; only KEPT_HEADERS are stored.
+        """
+        entry = CachedResponse(status, {name: headers[name]
+                                        for name in KEPT_HEADERS
+                                        if name in headers}, bytes(body))
+        with self._lock:
+            self._memory_put(key, entry)
+        self._disk_put(key, entry)
+
+    def record(self, hit):
+        """
+        Counts a revalidation answered with 304 (hit) or with a new body.
+        """
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """
+        :return: dict of hit/miss counters and the number and size of the
+            responses in memory.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'memory_entries': len(self._entries),
+                'memory_bytes': self._bytes
+            }
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+
+    def _memory_put(self, key, entry):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old.body)
+        if len(entry.body) > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += len(entry.body)
+        while len(self._entries) > self.capacity or \
+                self._bytes > self.max_bytes:
+            _, dropped = self._entries.popitem(last=False)
+            self._bytes -= len(dropped.body)
+
+    def _disk_get(self, key):
+        if self._disk is None:
+            return None
+        row = self._disk.get(key)
+        if row is None:
+            return None
+        return CachedResponse(row[0], json.loads(row[1]), bytes(row[2]))
+
+    def _disk_put(self, key, entry):
+        if self._disk is not None:
+            self._disk.put(key, (entry.status, json.dumps(entry.headers),
+                                 entry.body))
@@ -0,0 +1,125 @@
+"""
+Incremental JSON decoding
+
+Decodes the records of a list page ({"results": [...], ...}) while the
+response body is still arriving, so each record can be handed to the caller
+as soon as it is complete. Only the undecoded tail of the body is buffered,
+which bounds memory by the largest single record instead of the whole page.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import codecs
+import json
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+# Characters that can follow a decoded prefix of a longer number.
+_NUMBER_CONTINUATION = '.eE+-'
+
+
+class _Reader:
+    """
+    Text buffer over an iterable of byte chunks.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def more(self):
+        """
+        Appends the next chunk to the buffer, dropping what was consumed.
+        :return: False at the end of the body.
+        """
+        if self.eof:
+            return False
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        for chunk in self._chunks:
+            text = self._utf8.decode(chunk)
+            if text:
+                self.buf += text
+                return True
+        self.buf += self._utf8.decode(b'', final=True)
+        self.eof = True
+        return True
+
+    def peek(self):
+        """
+        Skips whitespace.
+        :return: The next character, or '' at the end of the body.
+        """
+        while True:
+            while self.pos < len(self.buf) and \
+                    self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.more():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError('Expected {!r} at {!r}'.format(
+                chars, self.buf[self.pos:self.pos + 20]))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """
+        Decodes the next complete JSON value, reading more of the body until
+        it is complete.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if not self.more():
+                    raise
+                continue
+            # A number cut by a chunk boundary decodes as its prefix ("12."
+            # as 12), so it is only complete once a delimiter follows.
+            if not self.eof and isinstance(value, (int, float)) and \
+                    not isinstance(value, bool) and \
+                    (end == len(self.buf) or
+                     self.buf[end] in _NUMBER_CONTINUATION):
+                self.more()
+                continue
+            self.pos = end
+            return value
+
+
+def iter_results(chunks, key='results'):
+    """
+    Yields the items of the key array of a JSON object body, decoding them
+    one at a time. Other members of the object are decoded and discarded.
+    :param chunks: Iterable of bytes, e.g. Response.iter_content().
+    :param key: Name of the array member to yield from.
+    """
+    reader = _Reader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        name = reader.value()
+        reader.expect(':')
+        if name == key and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() != ']':
+                while True:
+                    yield reader.value()
+                    if reader.expect(',]') == ']':
+                        break
+            else:
+                reader.expect(']')
+        else:
+            reader.value()
+        if reader.expect(',}') == '}':
+            return
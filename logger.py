@@ -17,7 +17,6 @@ class Logger:
             Logger.instance = logger
             logger.setLevel(logging.INFO)
             handler = logging.StreamHandler(sys.stdout)
-            handler.setLevel(logging.INFO)
             formatter = logging.Formatter('%(levelname)s - %(message)s')
             handler.setFormatter(formatter)
             logger.addHandler(handler)
@@ -15,20 +15,40 @@ URIs.
 This file (main.py) provides the web UI and framework for the demo app. All
 the work with the Climate API happens in climate.py.
 
-Note: For this example, only one "user" can be logged into the example app at
-a time.
+Each browser session has its own user state, kept in a session store (see
+sessions.py), so many users can be logged in at once.
 
 License:
 Copyright © 2018 The Climate Corporation
 """
 
+import itertools
 import json
 import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from logger import Logger
 
-from flask import Flask, request, redirect, url_for, send_from_directory
-from flask import Response, stream_with_context
+from flask import Flask, abort, request, redirect, url_for
+from flask import send_file, send_from_directory
+from flask import Response, session
 import climate
+import compression
+import metrics
+import request_log
+from boundary_cache import BoundaryCache
+from download_spool import DownloadError, DownloadSpool
+from field_catalog import FieldCatalog
+from field_sync import FieldStore, FieldSync
+from geometry import GeometryCache
+from http_cache import ValidatorCache
+from rate_limit import RateLimiter
+from sessions import MemorySessionStore, SQLiteSessionStore
+from spatial_index import SpatialIndex
+from tokens import TokenManager, TokenStore
+from uploads import UploadProgress, UploadStatusPoller
 
 # Configuration of your Climate partner credentials. This assumes you have
 # placed them in your environment. You may
@@ -43,32 +63,241 @@ CLIMATE_API_KEY = os.environ['CLIMATE_API_KEY']       # X-Api-Key header
 app = Flask(__name__)
 logger = Logger(app.logger)
 
-# User state - only one user at a time. In your application this would be
-# handled by your session management and backing
-# storage.
-
-_state = {}
+# Range downloads and upload chunks make one call per MiB or so; only log a
+# sample of the successful ones.
+request_log.set_sample_rate('contents', 0.1)
+request_log.set_sample_rate('upload_chunk', 0.1)
+
+# Acknowledged chunks of in-flight uploads, so a retried upload of the same
+# file resumes instead of starting over.
+upload_progress = UploadProgress(
+    os.path.join(tempfile.gettempdir(), 'climate-upload-progress'))
+
+# Statuses of uploads that are still being processed, polled in batches in
+# the background until they reach INBOX, SUCCESS or INVALID.
+status_poller = UploadStatusPoller(
+    lambda tokens, upload_ids: climate.get_upload_statuses(
+        upload_ids, tokens, CLIMATE_API_KEY))
+
+# Boundaries are immutable, so they are cached in memory and on disk. After
+# login all of a user's boundaries are prefetched in the background, so field
+# pages are normally served from the cache. They are users' field geometry:
+# the disk tier is kept in a directory only we can access.
+boundaries_directory = os.path.join(tempfile.gettempdir(),
+                                    'climate-boundaries')
+os.makedirs(boundaries_directory, mode=0o700, exist_ok=True)
+os.chmod(boundaries_directory, 0o700)
+boundary_cache = BoundaryCache(
+    capacity=1024,
+    path=os.path.join(boundaries_directory, 'boundaries.sqlite'),
+    disk_capacity=65536)
+climate.configure(boundary_cache=boundary_cache)
+PREFETCH_WORKERS = 2
+prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
+_prefetching = set()
+_prefetching_lock = threading.Lock()
+
+# Connections kept open to Climate by the session all requests share. Each
+# request thread (CLIMATE_REQUEST_THREADS, as many as the server runs) may
+# download DOWNLOAD_CONCURRENCY ranges at once, and each prefetch worker
+# fetches BOUNDARY_CONCURRENCY boundaries. Set CLIMATE_POOL_SIZE to override.
+REQUEST_THREADS = int(os.environ.get('CLIMATE_REQUEST_THREADS') or 8)
+climate.configure(pool_size=int(
+    os.environ.get('CLIMATE_POOL_SIZE') or
+    REQUEST_THREADS * climate.DOWNLOAD_CONCURRENCY +
+    PREFETCH_WORKERS * climate.BOUNDARY_CONCURRENCY))
+
+# Requests per second (and burst) allowed per endpoint family under our API
+# key, shared by all worker processes on this host. Adjust to your quota.
+climate.configure(rate_limiter=RateLimiter(
+    {
+        'token': (2, 10),
+        'fields': (20, 40),
+        'layers': (20, 40),
+        'uploads': (10, 20)
+    },
+    directory=os.path.join(tempfile.gettempdir(), 'climate-rate-limits'),
+    key=CLIMATE_API_KEY))
+
+# Activity and scouting observation pages revisited by a user are
+# revalidated with their ETag / Last-Modified instead of downloaded again.
+# The bodies are users' private data: they are kept in a directory only we
+# can access (chmod fails if someone else owns it).
+responses_directory = os.path.join(tempfile.gettempdir(), 'climate-responses')
+os.makedirs(responses_directory, mode=0o700, exist_ok=True)
+os.chmod(responses_directory, 0o700)
+climate.configure(validator_cache=ValidatorCache(
+    capacity=1024,
+    path=os.path.join(responses_directory, 'responses.sqlite'),
+    disk_capacity=16384))
+
+# Activity and attachment contents are downloaded once to local disk and
+# served from there with send_file. Set CLIMATE_X_SENDFILE when running
+# behind a web server that handles X-Sendfile (it must run as our user: the
+# spool directory is private).
+download_spool = DownloadSpool(
+    os.path.join(tempfile.gettempdir(), 'climate-downloads'),
+    max_bytes=1024 * 1024 * 1024)
+app.config['USE_X_SENDFILE'] = bool(os.environ.get('CLIMATE_X_SENDFILE'))
+
+# Local copy of each user's fields, kept up to date incrementally from the
+# last x-next-token instead of listing every field on each login. Kept in a
+# directory only we can access, like the responses.
+fields_directory = os.path.join(tempfile.gettempdir(), 'climate-fields')
+os.makedirs(fields_directory, mode=0o700, exist_ok=True)
+os.chmod(fields_directory, 0o700)
+field_store = FieldStore(os.path.join(fields_directory, 'fields.sqlite'))
+field_sync = FieldSync(field_store)
+
+# Indexed in-memory catalog of each user's fields, loaded from field_store
+# and updated page by page when the fields are synced.
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+# Spatial index of each user's field boundaries, built by the boundary
+# prefetch, used to tell which field a scouting observation is in.
+_spatial_indexes = {}
+
+# Area, centroid and bounding box of each boundary, computed in one batch
+# per user by the boundary prefetch.
+geometry_cache = GeometryCache()
+
+# Refresh tokens are only valid until the next refresh, so they are persisted
+# atomically as soon as they are issued. Set CLIMATE_TOKEN_DIR to keep them
+# somewhere more durable than the temp directory.
+token_store = TokenStore(
+    os.environ.get('CLIMATE_TOKEN_DIR') or
+    os.path.join(tempfile.gettempdir(), 'climate-tokens'))
+
+# User state, per browser session. The Flask session cookie only carries a
+# session id; the state lives in the session store. Set CLIMATE_SESSION_DB to
+# a SQLite file (and CLIMATE_SESSION_SECRET to a shared secret) to share
+# sessions between worker processes.
+app.secret_key = os.environ.get('CLIMATE_SESSION_SECRET') or os.urandom(24)
+if os.environ.get('CLIMATE_SESSION_DB'):
+    session_store = SQLiteSessionStore(os.environ['CLIMATE_SESSION_DB'])
+else:
+    session_store = MemorySessionStore()
+
+# Token managers of this process by user id. A user whose session was
+# started in another worker process gets one loaded from token_store.
+_token_managers = {}
+_token_managers_lock = threading.Lock()
+
+
+def session_id():
+    if 'sid' not in session:
+        session['sid'] = uuid.uuid4().hex
+    return session['sid']
+
+
+def token_manager(user_id):
+    tokens = _token_managers.get(user_id)
+    if tokens is None:
+        with _token_managers_lock:
+            tokens = _token_managers.get(user_id)
+            if tokens is None:
+                tokens = TokenManager(CLIMATE_API_ID,
+                                      CLIMATE_API_SECRET,
+                                      user_id=user_id,
+                                      store=token_store)
+                _token_managers[user_id] = tokens
+    return tokens
 
 
 def set_state(**kwargs):
-    global _state
-    if 'access_token' in kwargs:
-        _state['access_token'] = kwargs['access_token']
-    if 'refresh_token' in kwargs:
-        _state['refresh_token'] = kwargs['refresh_token']
+    values = {}
+    if 'tokens' in kwargs:
+        tokens = kwargs['tokens']
+        if tokens:
+            with _token_managers_lock:
+                _token_managers[tokens.user_id] = tokens
+        values['user_id'] = tokens.user_id if tokens else None
     if 'user' in kwargs:
-        _state['user'] = kwargs['user']
-    if 'fields' in kwargs:
-        _state['fields'] = kwargs['fields']
+        values['user'] = kwargs['user']
+    session_store.set(session_id(), **values)
 
 
 def clear_state():
-    set_state(access_token=None, refresh_token=None, user=None, fields=None)
+    session_store.delete(session_id())
 
 
 def state(key):
-    global _state
-    return _state.get(key)
+    if key == 'tokens':
+        user_id = session_store.get(session_id(), 'user_id')
+        return token_manager(user_id) if user_id else None
+    return session_store.get(session_id(), key)
+
+
+def field_catalog(user_id):
+    """
+    :param user_id: id of the user.
+    :return: FieldCatalog of the user's fields.
+    """
+    catalog = _catalogs.get(user_id)
+    if catalog is None:
+        with _catalogs_lock:
+            catalog = _catalogs.get(user_id)
+            if catalog is None:
+                catalog = FieldCatalog(field_store.fields(user_id),
+                                       name_index=True)
+                _catalogs[user_id] = catalog
+    return catalog
+
+
+def prefetch_boundaries(tokens, catalog):
+    """
+    Fetches the boundaries of the user's fields into boundary_cache in the
+    background, brings the user's spatial index up to date with them and
+    computes their geometry metrics.
+    At most one prefetch runs per user at a time.
+    :param tokens: TokenManager of the user.
+    :param catalog: FieldCatalog of the user.
+    """
+    user_id = tokens.user_id
+    with _prefetching_lock:
+        if user_id in _prefetching:
+            return
+        _prefetching.add(user_id)
+
+    def prefetch():
+        try:
+            boundaries = climate.get_boundaries(catalog.boundary_ids(),
+                                                tokens, CLIMATE_API_KEY)
+            index = _spatial_indexes.get(user_id) or SpatialIndex()
+            index.sync(catalog, boundaries)
+            _spatial_indexes[user_id] = index
+            geometry_cache.get_many(boundaries)
+        except Exception:
+            app.logger.exception('Boundary prefetch failed for %s', user_id)
+        finally:
+            with _prefetching_lock:
+                _prefetching.discard(user_id)
+
+    prefetch_executor.submit(prefetch)
+
+
+@app.after_request
+def compress_response(response):
+    """
+    Compresses text responses of at least compression.MIN_SIZE bytes with
+    the best coding the browser accepts. Files sent with send_file and
+    streamed responses are left alone.
+    """
+    if response.direct_passthrough or response.is_streamed or \
+            not 200 <= response.status_code < 300 or \
+            'Content-Encoding' in response.headers or \
+            not compression.compressible(response.mimetype, text_only=True):
+        return response
+    data = response.get_data()
+    if len(data) < compression.MIN_SIZE:
+        return response
+    response.vary.add('Accept-Encoding')
+    coding = compression.negotiate(request.headers.get('Accept-Encoding'))
+    if coding is not None:
+        response.set_data(compression.compress(data, coding))
+        response.headers['Content-Encoding'] = coding
+    return response
 
 
 # Routes
@@ -108,7 +337,10 @@ def user_homepage():
     refreshing the authorization token.
     :return: None
     """
-    field_list = render_ul(render_field_link(f) for f in state('fields'))
+    catalog = field_catalog(state('user_id'))
+    prefix = request.args.get('prefix')
+    fields = catalog.with_prefix(prefix) if prefix else catalog
+    field_list = render_ul(render_field_link(f) for f in fields)
     return """
            <h1>Partner API Demo Site</h1>
            <p>User name retrieved from FieldView: {first} {last}</p>
@@ -128,8 +360,8 @@ def user_homepage():
            <p><a href="{logout}">Log out</a></p>
            """.format(first=state('user')['firstname'],
                       last=state('user')['lastname'],
-                      access_token=state('access_token'),
-                      refresh_token=state('refresh_token'),
+                      access_token=state('tokens').access_token,
+                      refresh_token=state('tokens').refresh_token,
                       fields=field_list,
                       upload=url_for('upload_form'),
                       logout=url_for('logout_redirect'),
@@ -156,18 +388,25 @@ def login_redirect():
                                  CLIMATE_API_SECRET,
                                  redirect_uri())
         if resp:
-            # Store tokens and user in state for subsequent requests.
-            access_token = resp['access_token']
-            refresh_token = resp['refresh_token']
-            set_state(user=resp['user'],
-                      access_token=access_token,
-                      refresh_token=refresh_token)
-
-            # Fetch fields and store in state just for example purposes. You
-            # might well do this at the time of need,
+            # Store tokens and user in state for subsequent requests. The
+            # token manager refreshes the access_token before it expires.
+            user_id = resp['user']['id']
+            tokens = TokenManager(CLIMATE_API_ID,
+                                  CLIMATE_API_SECRET,
+                                  user_id=user_id,
+                                  store=token_store)
+            tokens.update(resp)
+            set_state(user=resp['user'], tokens=tokens)
+
+            # Sync fields changed since the last login into the local field
+            # store and the user's field catalog, just for example purposes.
+            # You might well do this at the time of need,
             # or not at all depending on your app.
-            fields = climate.get_fields(access_token, CLIMATE_API_KEY)
-            set_state(fields=fields)
+            catalog = field_catalog(user_id)
+            field_sync.sync(user_id,
+                            climate.client(tokens, CLIMATE_API_KEY),
+                            catalog=catalog)
+            prefetch_boundaries(tokens, catalog)
 
     return redirect(url_for('home'))
 
@@ -180,15 +419,11 @@ def refresh_token():
     this also refreshes the user data.
     :return:
     """
-    resp = climate.reauthorize(state('refresh_token'),
-                               CLIMATE_API_ID,
-                               CLIMATE_API_SECRET)
-    if resp:
-        # Store tokens and user in state for subsequent requests.
-        access_token = resp['access_token']
-        refresh_token = resp['refresh_token']
-        set_state(user=resp['user'], access_token=access_token,
-                  refresh_token=refresh_token)
+    tokens = state('tokens')
+    # A manager that took over tokens refreshed by another worker has no
+    # user data; keep the session's.
+    if tokens and tokens.refresh() and tokens.user is not None:
+        set_state(user=tokens.user)
 
     return redirect(url_for('home'))
 
@@ -211,18 +446,43 @@ def field(field_id):
     :param field_id:
     :return:
     """
-    field = [f for f in state('fields') if f['id'] == field_id][0]
-
-    boundary = climate.get_boundary(field['boundaryId'],
-                                    state('access_token'),
+    user_id = state('user_id')
+    if not user_id:
+        return redirect(url_for('home'))
+    catalog = field_catalog(user_id)
+    field = catalog.get(field_id)
+    if field is None:
+        # Possibly synced by another worker process since the catalog was
+        # loaded: look the one field up rather than reloading them all.
+        stored = field_store.field(user_id, field_id)
+        if stored is None:
+            abort(404)
+        catalog.update([stored])
+        field = catalog.get(field_id)
+
+    # A cold cache (e.g. a new worker process) is warmed for all the user's
+    # fields while this one is fetched directly.
+    if field.boundary_id not in boundary_cache:
+        prefetch_boundaries(state('tokens'), catalog)
+    boundary = climate.get_boundary(field.boundary_id,
+                                    state('tokens'),
                                     CLIMATE_API_KEY)
+    shape = geometry_cache.get(field.boundary_id, boundary)
+    if shape is None or shape.bbox is None:
+        geometry = '<p>Area: unknown</p>'
+    else:
+        geometry = """<p>Area: {area:.2f} ha, centroid: {centroid},
+           bounding box: {bbox}</p>""".format(
+            area=shape.area / 10000, centroid=shape.centroid, bbox=shape.bbox)
 
     return """
            <h1>Partner API Demo Site</h1>
            <h2>Field Name: {name}</h2>
+           {geometry}
            <p>Boundary info:<pre>{boundary}</pre></p>
            <p><a href="{home}">Return home</a></p>
-           """.format(name=field['name'],
+           """.format(name=field.name,
+                      geometry=geometry,
                       boundary=json.dumps(boundary, indent=4, sort_keys=True),
                       home=url_for('home'))
 
@@ -241,18 +501,32 @@ def upload_form():
 
         f = request.files['file']
         content_type = request.form['file_content_type']
-        upload_id = climate.upload(
-            f, content_type, state('access_token'), CLIMATE_API_KEY)
-
+        result = climate.upload(f, content_type, state('tokens'),
+                                CLIMATE_API_KEY, progress=upload_progress)
+
+        if not result.success:
+            return """
+                <h1>Partner API Demo Site</h1>
+                <h2>Upload data</h2>
+                <p>Upload failed: {upload_id}, {sent} of {length} bytes
+                sent. Upload the same file again to resume.</p>
+                <p><a href="{home}">Return home</a></p>
+                """.format(upload_id=result.upload_id,
+                           sent=result.sent,
+                           length=result.length,
+                           home=url_for('home'))
+
+        status_poller.track(result.upload_id, state('tokens'),
+                            owner=state('user_id'))
         return """
             <h1>Partner API Demo Site</h1>
             <h2>Upload data</h2>
             <p>File uploaded: {upload_id}
             <a href='{status_url}'>Get Status</a></p>
             <p><a href="{home}">Return home</a></p>
-            """.format(upload_id=upload_id,
+            """.format(upload_id=result.upload_id,
                        status_url=url_for(
-                           'update_status', upload_id=upload_id),
+                           'update_status', upload_id=result.upload_id),
                        home=url_for('home'))
 
     return """
@@ -273,15 +547,24 @@ def update_status(upload_id):
     Shows the status of an upload. Uploads are processed asynchronously so to
     know if an upload was successful you need to check its status until it is
     either in the INBOX or SUCCESS state (it worked) or the INVALID state
-    (it failed). This method demonstrates the API call to get the status for
-    a single upload id. There is also a call to get stattus for a list
-    of upload ids.
+    (it failed). Uploads made through this app are polled in the background
+    by status_poller, which asks for the status of all pending uploads in
+    one call, so this page normally only reads its cache. An upload with no
+    known status yet is fetched once with the API call for a single upload
+    id, and then tracked too. Cached statuses are only shown to the user
+    they were fetched for.
     :param upload_id: uuid of upload returned by API.
     :return:
     """
-    status = climate.get_upload_status(upload_id,
-                                       state('access_token'),
-                                       CLIMATE_API_KEY)
+    user_id = state('user_id')
+    status = status_poller.status(upload_id, owner=user_id)
+    if status is None:
+        tokens = state('tokens')
+        status = climate.get_upload_status(upload_id, tokens,
+                                           CLIMATE_API_KEY)
+        if status is not None:
+            status_poller.track(upload_id, tokens, status, owner=user_id)
+    status = status or {}
 
     return """
            <h1>Partner API Demo Site</h1>
@@ -294,6 +577,16 @@ def update_status(upload_id):
                       home=url_for('home'))
 
 
+@app.route('/metrics')
+def metrics_route():
+    """
+    Exposes per-endpoint counts, status codes, bytes and latency of the
+    Climate API calls made by this app, in Prometheus text format.
+    """
+    return Response(metrics.registry.prometheus(),
+                    mimetype='text/plain; version=0.0.4')
+
+
 # Various utilities just to make the demo app work. No Climate API stuff here.
 
 
@@ -310,18 +603,32 @@ def render_ul(xs):
 
 
 def render_field_link(field):
-    field_id = field['id']
     return '<a href="{link}">{name} ({id})</a>'.format(
-        link=url_for('field', field_id=field_id),
-        name=field['name'],
-        id=field_id)
+        link=url_for('field', field_id=field.id),
+        name=field.name,
+        id=field.id)
 
 
-def render_scouting_observation_link(scouting_observation):
+def render_scouting_observation_link(scouting_observation, field=None):
     oid = scouting_observation['id']
-    return '<a href="{link}">{oid}</a>'.format(
+    return '<a href="{link}">{oid}</a>{field}'.format(
         link=url_for('scouting_observation', scouting_observation_id=oid),
-        oid=oid)
+        oid=oid,
+        field=' in {}'.format(field.name) if field else '')
+
+
+def observation_field(user_id, scouting_observation):
+    """
+    :return: FieldRecord of the field the observation's location is in, or
+        None if unknown.
+    """
+    index = _spatial_indexes.get(user_id)
+    location = scouting_observation.get('location') or {}
+    geometry = location.get('geometry', location)
+    if index is None or geometry.get('type') != 'Point':
+        return None
+    keys = index.locate(*geometry['coordinates'][:2])
+    return field_catalog(user_id).get(keys[0]) if keys else None
 
 
 def render_attachment_link(scouting_observation_id, attachment):
@@ -373,7 +680,7 @@ def scouting_observation(scouting_observation_id):
 
     :return: returns the html response
     """
-    observation = climate.get_scouting_observation(state('access_token'),
+    observation = climate.get_scouting_observation(state('tokens'),
                                                    CLIMATE_API_KEY,
                                                    scouting_observation_id)
     return """
@@ -399,13 +706,15 @@ def scouting_observations():
 
     :return: returns the html response which shows list of observations
     """
-    observations = climate.get_scouting_observations(state('access_token'),
+    observations = climate.get_scouting_observations(state('tokens'),
                                                      CLIMATE_API_KEY,
                                                      100)
     body = "<p>No Scouting Observations found!</p>"
     if observations:
+        user_id = state('user_id')
         scouting_observations = render_ul(
-            render_scouting_observation_link(o) for o in observations)
+            render_scouting_observation_link(
+                o, observation_field(user_id, o)) for o in observations)
         body = "<p>Your Climate Scouting Observations:\
         {scouting_observations}</p>".format(
             scouting_observations=scouting_observations)
@@ -425,7 +734,7 @@ def scouting_observation_attachments(scouting_observation_id):
     :param scouting_observation_id: a scouting observation identifier
     :return: returns html which shows list of attachments.
     """
-    ats = climate.get_scouting_observation_attachments(state('access_token'),
+    ats = climate.get_scouting_observation_attachments(state('tokens'),
                                                        CLIMATE_API_KEY,
                                                        scouting_observation_id)
 
@@ -464,19 +773,21 @@ def scouting_observation_attachments_contents(scouting_observation_id,
     """
     content_type = request.args.get('contentType')
     length = int(request.args.get('length'))
-    # stream the content back to client
-    headers = {
-        'Content-type': 'image/jpeg'
-    }
-    content = climate.get_scouting_observation_attachments_contents(
-        state('access_token'),
-        CLIMATE_API_KEY,
-        scouting_observation_id,
-        attachment_id,
-        content_type,
-        length
-    )
-    return Response(response=content, headers=headers)
+    key = 'attachment {} {} {} {} {}'.format(state('user_id'),
+                                             scouting_observation_id,
+                                             attachment_id, content_type,
+                                             length)
+    tokens = state('tokens')
+    return spooled_response(
+        key, length,
+        lambda: climate.get_scouting_observation_attachments_contents(
+            tokens,
+            CLIMATE_API_KEY,
+            scouting_observation_id,
+            attachment_id,
+            content_type,
+            length),
+        'image/jpeg')
 
 
 def get_callee(activity):
@@ -488,7 +799,7 @@ def handle_activity(activity):
 
     next_token = request.args.get('next_token')
     has_more_records, activities = get_callee(activity)(
-        state('access_token'),
+        state('tokens'),
         CLIMATE_API_KEY,
         next_token)
 
@@ -551,15 +862,59 @@ def get_activity_contents(layer_id, activity_id):
     :return: returns contents of given activity.
     """
     length = int(request.args.get('length'))
-    content = climate.get_activity_contents(
-        state('access_token'),
-        CLIMATE_API_KEY,
-        layer_id,
-        activity_id,
-        length)
-    response = Response(stream_with_context(content),
-                        mimetype='application/zip')
-    response.headers['Content-Disposition'] = 'attachment; filename=data.zip'
+    key = 'activity {} {} {} {}'.format(state('user_id'), layer_id,
+                                        activity_id, length)
+    tokens = state('tokens')
+    return spooled_response(
+        key, length,
+        lambda: climate.get_activity_contents(tokens,
+                                              CLIMATE_API_KEY,
+                                              layer_id,
+                                              activity_id,
+                                              length),
+        'application/zip', filename='data.zip')
+
+
+def spooled_response(key, length, download, mimetype, filename=None):
+    """
+    Serves contents through download_spool: with send_file of the spooled
+    file once they are spooled (so Content-Length is set, and X-Sendfile
+    when enabled), else streamed while the spool downloads them (or
+    straight from download when they are too large to keep).
+    :param key: Spool key, see DownloadSpool.open.
+    :param length: Size of the contents in bytes.
+    :param download: Function returning the contents' bytes chunks.
+    :param filename: Send the contents as an attachment with this name.
+    :return: Response, or 502 when the download fails before any byte was
+        sent.
+    """
+    path = download_spool.path(key, length)
+    if path is not None:
+        try:
+            response = send_file(path, mimetype=mimetype)
+        except FileNotFoundError:
+            # Evicted since it was found; download it again. Once the
+            # response is built the file is either open or, with
+            # X-Sendfile, just marked most recently used.
+            pass
+        else:
+            if filename:
+                response.headers['Content-Disposition'] = \
+                    'attachment; filename={}'.format(filename)
+            return response
+
+    chunks = download_spool.stream(key, length, download)
+    try:
+        first = next(chunks, b'')
+    except DownloadError as e:
+        app.logger.error('Download of %s failed: %s', key, e)
+        abort(502)
+    response = Response(itertools.chain([first], chunks),
+                        mimetype=mimetype)
+    response.headers['Content-Length'] = str(length)
+    if filename:
+        response.headers['Content-Disposition'] = \
+            'attachment; filename={}'.format(filename)
     return response
 
 
@@ -567,7 +922,6 @@ def get_activity_contents(layer_id, activity_id):
 
 
 if __name__ == '__main__':
-    clear_state()
     app.run(
         host="localhost",
         port=8080
@@ -0,0 +1,177 @@
+"""
+API call metrics
+
+Counts calls, status codes and bytes per endpoint, and keeps a latency
+histogram over fixed buckets, from which p50/p95/p99 are estimated. Bucket
+arrays are allocated once per endpoint and each endpoint has its own lock
+held only for a few integer updates, so recording is cheap enough to leave
+on in production.
+
+Besides single API calls, whole byte streams are recorded under their own
+endpoint names (contents_stream for fetch_contents, upload_stream for
+upload), with status 0 when a stream did not complete.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import threading
+from bisect import bisect_left
+
+# Upper bounds, in seconds, of the latency histogram buckets. A last
+# implicit bucket holds everything slower.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class EndpointMetrics:
+    """
+    Counters and latency histogram of one endpoint.
+    """
+    __slots__ = ('lock', 'count', 'statuses', 'sent', 'received',
+                 'latency_sum', 'buckets')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.statuses = {}
+        self.sent = 0
+        self.received = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def quantile(self, q):
+        """
+        Estimates the q quantile of latency by linear interpolation within
+        the histogram bucket it falls in.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, n in enumerate(self.buckets):
+            if i == len(LATENCY_BUCKETS):
+                return lower
+            upper = LATENCY_BUCKETS[i]
+            if n and seen + n >= rank:
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = upper
+        return lower
+
+
+class Metrics:
+    """
+    Per-endpoint metrics registry.
+    """
+
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, status, sent, received, elapsed):
+        """
+        Records one call or stream.
+        :param endpoint: Short endpoint name, e.g. 'fields'.
+        :param status: HTTP status code, 0 for connection errors and
+            incomplete streams.
+        :param sent: Bytes sent, or None.
+        :param received: Bytes received, or None.
+        :param elapsed: Duration in seconds.
+        """
+        m = self._endpoints.get(endpoint)
+        if m is None:
+            with self._lock:
+                m = self._endpoints.setdefault(endpoint, EndpointMetrics())
+        bucket = bisect_left(LATENCY_BUCKETS, elapsed)
+        with m.lock:
+            m.count += 1
+            m.statuses[status] = m.statuses.get(status, 0) + 1
+            m.sent += sent or 0
+            m.received += received or 0
+            m.latency_sum += elapsed
+            m.buckets[bucket] += 1
+
+    def _sorted_endpoints(self):
+        with self._lock:
+            return sorted(self._endpoints.items())
+
+    def snapshot(self):
+        """
+        :return: dict of endpoint to a dict of its counters, byte totals
+            and latency quantiles.
+        """
+        result = {}
+        for endpoint, m in self._sorted_endpoints():
+            with m.lock:
+                result[endpoint] = {
+                    'count': m.count,
+                    'statuses': dict(m.statuses),
+                    'sent': m.sent,
+                    'received': m.received,
+                    'latency': {q: m.quantile(q) for q in QUANTILES}
+                }
+        return result
+
+    def prometheus(self):
+        """
+        Renders all metrics in the Prometheus text exposition format.
+        """
+        endpoints = []
+        for endpoint, m in self._sorted_endpoints():
+            with m.lock:
+                endpoints.append((
+                    'endpoint="{}"'.format(endpoint),
+                    sorted(m.statuses.items()), m.sent, m.received,
+                    m.count, m.latency_sum, list(m.buckets),
+                    [(q, m.quantile(q)) for q in QUANTILES]))
+
+        lines = ['# TYPE climate_api_requests_total counter']
+        for label, statuses, _, _, _, _, _, _ in endpoints:
+            for status, n in statuses:
+                lines.append('climate_api_requests_total{{{},status="{}"}} {}'
+                             .format(label, status, n))
+
+        lines.append('# TYPE climate_api_sent_bytes_total counter')
+        for label, _, sent, _, _, _, _, _ in endpoints:
+            lines.append('climate_api_sent_bytes_total{{{}}} {}'
+                         .format(label, sent))
+
+        lines.append('# TYPE climate_api_received_bytes_total counter')
+        for label, _, _, received, _, _, _, _ in endpoints:
+            lines.append('climate_api_received_bytes_total{{{}}} {}'
+                         .format(label, received))
+
+        lines.append(
+            '# TYPE climate_api_request_duration_seconds histogram')
+        for label, _, _, _, count, latency_sum, buckets, _ in endpoints:
+            cumulative = 0
+            for upper, n in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+                cumulative += n
+                lines.append(
+                    'climate_api_request_duration_seconds_bucket'
+                    '{{{},le="{}"}} {}'.format(label, upper, cumulative))
+            lines.append('climate_api_request_duration_seconds_sum{{{}}} {}'
+                         .format(label, latency_sum))
+            lines.append('climate_api_request_duration_seconds_count{{{}}} {}'
+                         .format(label, count))
+
+        lines.append(
+            '# TYPE climate_api_request_duration_quantile_seconds gauge')
+        for label, _, _, _, _, _, _, quantiles in endpoints:
+            for q, value in quantiles:
+                lines.append(
+                    'climate_api_request_duration_quantile_seconds'
+                    '{{{},quantile="{}"}} {}'.format(label, q, value))
+        return '\n'.join(lines) + '\n'
+
+
+# Registry used by climate.py and climate_async.py.
+registry = Metrics()
+
+
+def record(endpoint, status, sent, received, elapsed):
+    """Records into the default registry. See Metrics.record."""
+    registry.record(endpoint, status, sent, received, elapsed)
@@ -0,0 +1,384 @@
+"""
+Local FieldView stand-in server
+
+Implements enough of the Climate API to exercise climate.py without hitting
+the real service: the token endpoint, fields with 206/x-next-token
+pagination, boundaries, activity and scouting observation layers with Range
+support on contents and ETag validation on listings, and chunked uploads.
+JSON responses are gzipped when the client accepts it, and gzipped request
+bodies are decoded.
+Every response can be delayed by a fixed latency and throttled to a
+bandwidth, so the client hot paths can be measured under realistic network
+conditions. Data is generated deterministically from ids.
+
+Run it standalone with:
+
+    python3 mock_server.py --port 8090 --latency 0.05
+
+then point climate.api_uri and climate.token_uri at it (see use_server).
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit
+
+import climate
+import compression
+
+LAYERS = ('asPlanted', 'asHarvested', 'asApplied', 'scoutingObservations')
+
+
+class MockConfig:
+    """
+    Behaviour of the stand-in server.
+    """
+
+    def __init__(self, fields=1000, activities=200, observations=200,
+                 page_size=100, content_length=8 * 1024 * 1024,
+                 latency=0.0, bandwidth=None):
+        """
+        :param fields: Number of fields per user.
+        :param activities: Number of activities in each activity layer.
+        :param observations: Number of scouting observations.
+        :param page_size: Default page size when x-limit is not sent.
+        :param content_length: Length of every activity and attachment
+            contents.
+        :param latency: Seconds added to every response.
+        :param bandwidth: Bytes per second for request and response bodies,
+            or None for unthrottled.
+        """
+        self.fields = fields
+        self.activities = activities
+        self.observations = observations
+        self.page_size = page_size
+        self.content_length = content_length
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+
+def field(i):
+    return {
+        'id': 'field-{}'.format(i),
+        'name': 'Field {}'.format(i),
+        'boundaryId': 'boundary-{}'.format(i)
+    }
+
+
+def boundary(boundary_id):
+    """
+    A small square polygon whose position depends on the id.
+    """
+    n = int(boundary_id.rsplit('-', 1)[-1]) if boundary_id[-1].isdigit() \
+        else 0
+    x, y = -93.0 + (n % 100) * 0.01, 41.0 + (n // 100) * 0.01
+    ring = [[x, y], [x + 0.005, y], [x + 0.005, y + 0.005], [x, y + 0.005],
+            [x, y]]
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+        'properties': {'id': boundary_id}
+    }
+
+
+def activity(layer, i, length):
+    return {
+        'id': '{}-{}'.format(layer, i),
+        'length': length,
+        'contentType': 'application/zip',
+        'status': 'ACTIVE'
+    }
+
+
+def observation(i):
+    """
+    A scouting observation located inside the boundary of field i.
+    """
+    ring = boundary('boundary-{}'.format(i))['geometry']['coordinates'][0]
+    return dict(activity('scoutingObservations', i, 0), location={
+        'type': 'Point',
+        'coordinates': [ring[0][0] + 0.002, ring[0][1] + 0.002]
+    })
+
+
+PATTERN = bytes((i * 7) & 0xff for i in range(256))
+
+
+def content_bytes(start, end):
+    """
+    Deterministic contents bytes for the range [start, end).
+    """
+    offset = start % len(PATTERN)
+    repeat = (end - start) // len(PATTERN) + 2
+    return (PATTERN * repeat)[offset:offset + end - start]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    routes = [
+        ('POST', r'/api/oauth/token$', 'token'),
+        ('GET', r'/v4/fields$', 'fields'),
+        ('GET', r'/v4/boundaries/([^/]+)$', 'boundary'),
+        ('POST', r'/v4/uploads$', 'create_upload'),
+        ('PUT', r'/v4/uploads/([^/]+)$', 'put_upload'),
+        ('GET', r'/v4/uploads/([^/]+)/status$', 'upload_status'),
+        ('POST', r'/v4/uploads/status$', 'upload_statuses'),
+        ('GET', r'/v4/layers/scoutingObservations/([^/]+)/attachments$',
+         'attachments'),
+        ('GET', r'/v4/layers/scoutingObservations/([^/]+)/attachments/'
+                r'([^/]+)/contents$', 'contents'),
+        ('GET', r'/v4/layers/scoutingObservations/([^/]+)$', 'observation'),
+        ('GET', r'/v4/layers/([^/]+)/([^/]+)/contents$', 'contents'),
+        ('GET', r'/v4/layers/([^/]+)$', 'layer'),
+    ]
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def dispatch(self, method):
+        path = urlsplit(self.path).path
+        body = self.read_body()
+        if self.config.latency:
+            time.sleep(self.config.latency)
+        for route_method, pattern, name in self.routes:
+            match = re.match(pattern, path)
+            if route_method == method and match:
+                return getattr(self, name)(body, *match.groups())
+        self.respond(404, {'message': 'Not found'})
+
+    def read_body(self):
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.throttle(len(body))
+        if self.headers.get('content-encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return body
+
+    def throttle(self, size):
+        if self.config.bandwidth:
+            time.sleep(size / self.config.bandwidth)
+
+    def respond(self, status, body=None, headers=None,
+                content_type='application/json'):
+        if body is None:
+            data = b''
+        elif isinstance(body, bytes):
+            data = body
+        else:
+            data = json.dumps(body).encode('utf-8')
+        headers = dict(headers or {})
+        if content_type == 'application/json' and \
+                len(data) >= compression.MIN_SIZE and \
+                'gzip' in (self.headers.get('accept-encoding') or ''):
+            data = gzip.compress(data)
+            headers['content-encoding'] = 'gzip'
+        self.throttle(len(data))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if data:
+            self.send_header('content-type', content_type)
+        self.send_header('content-length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def respond_validated(self, status, body, headers=None):
+        """
+        Responds with an ETag of the body, or 304 when the request's
+        If-None-Match matches it.
+        """
+        data = json.dumps(body).encode('utf-8')
+        etag = '"{}"'.format(hashlib.md5(data).hexdigest())
+        headers = dict(headers or {}, etag=etag)
+        if self.headers.get('if-none-match') == etag:
+            return self.respond(304, headers=headers)
+        self.respond(status, data, headers=headers)
+
+    def paginate(self, total, make):
+        """
+        Serves records [0, total) in pages. The next token is the offset of
+        the next page; the last page is a 200 carrying the final offset.
+        """
+        start = int(self.headers.get('x-next-token') or 0)
+        limit = int(self.headers.get('x-limit') or self.config.page_size)
+        end = min(total, start + limit)
+        results = [make(i) for i in range(start, end)]
+        status = 206 if end < total else 200
+        self.respond_validated(status, {'results': results},
+                               headers={'x-next-token': str(end)})
+
+    def token(self, body):
+        self.respond(200, {
+            'access_token': uuid.uuid4().hex,
+            'refresh_token': uuid.uuid4().hex,
+            'expires_in': 14400,
+            'user': {'id': 'user-1', 'firstname': 'Mock',
+                     'lastname': 'User'}
+        })
+
+    def fields(self, body):
+        self.paginate(self.config.fields, field)
+
+    def boundary(self, body, boundary_id):
+        self.respond(200, boundary(boundary_id))
+
+    def layer(self, body, layer):
+        if layer not in LAYERS:
+            return self.respond(404, {'message': 'Unknown layer'})
+        if layer == 'scoutingObservations':
+            return self.paginate(self.config.observations, observation)
+        self.paginate(self.config.activities, lambda i: activity(
+            layer, i, self.config.content_length))
+
+    def observation(self, body, observation_id):
+        self.respond_validated(200, activity('scoutingObservations', 0, 0))
+
+    def attachments(self, body, observation_id):
+        self.respond(200, {'results': [{
+            'id': 'attachment-0',
+            'status': 'ACTIVE',
+            'contentType': 'image/jpeg',
+            'length': self.config.content_length
+        }]})
+
+    def contents(self, body, *ids):
+        length = self.config.content_length
+        match = re.match(r'bytes=(\d+)-(\d*)',
+                         self.headers.get('range') or '')
+        if not match:
+            return self.respond(200, content_bytes(0, length),
+                                content_type='application/octet-stream')
+        start = int(match.group(1))
+        end = int(match.group(2)) + 1 if match.group(2) else length
+        if start >= length:
+            return self.respond(416, {'message': 'Range Not Satisfiable'})
+        end = min(end, length)
+        self.respond(206, content_bytes(start, end),
+                     headers={'content-range': 'bytes {}-{}/{}'.format(
+                         start, end - 1, length)},
+                     content_type='application/octet-stream')
+
+    def create_upload(self, body):
+        upload_id = str(uuid.uuid4())
+        request = json.loads(body.decode('utf-8'))
+        with self.server.lock:
+            self.server.uploads[upload_id] = {
+                'length': request['length'],
+                'received': 0
+            }
+        self.respond(201, upload_id)
+
+    def put_upload(self, body, upload_id):
+        with self.server.lock:
+            upload = self.server.uploads.get(upload_id)
+            if upload is None:
+                return self.respond(404, {'message': 'Unknown upload'})
+            upload['received'] += len(body)
+        self.respond(204)
+
+    def upload_status(self, body, upload_id):
+        status = self.server.upload_status(upload_id)
+        if status is None:
+            return self.respond(404, {'message': 'Unknown upload'})
+        self.respond(200, status)
+
+    def upload_statuses(self, body):
+        upload_ids = json.loads(body.decode('utf-8'))
+        statuses = (self.server.upload_status(i) for i in upload_ids)
+        self.respond(200, {'results': [s for s in statuses if s]})
+
+
+class MockClimateServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded stand-in server. Use start() to serve from a background thread.
+    """
+    daemon_threads = True
+
+    def __init__(self, config=None, host='localhost', port=0):
+        """
+        :param config: MockConfig, defaults used when None.
+        :param port: Port to listen on, any free port when 0.
+        """
+        super().__init__((host, port), Handler)
+        self.config = config or MockConfig()
+        self.uploads = {}
+        self.lock = threading.Lock()
+        self._thread = None
+
+    def upload_status(self, upload_id):
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+        if upload is None:
+            return None
+        done = upload['received'] >= upload['length']
+        return {'uploadId': upload_id,
+                'status': 'SUCCESS' if done else 'UPLOADING'}
+
+    @property
+    def uri(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def use_server(server):
+    """
+    Points the climate module at server.
+    """
+    climate.api_uri = server.uri
+    climate.token_uri = '{}/api/oauth/token'.format(server.uri)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--fields', type=int, default=1000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--content-length', type=int,
+                        default=8 * 1024 * 1024)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every response')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='bytes per second for bodies')
+    args = parser.parse_args()
+    server = MockClimateServer(MockConfig(fields=args.fields,
+                                          page_size=args.page_size,
+                                          content_length=args.content_length,
+                                          latency=args.latency,
+                                          bandwidth=args.bandwidth),
+                               port=args.port)
+    print('Serving on {}'.format(server.uri))
+    server.serve_forever()
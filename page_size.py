@@ -0,0 +1,82 @@
+"""
+Adaptive page sizing
+
+A full listing costs one round trip per page, so larger pages finish it
+sooner, up to the point where a page gets slow or large enough to time out.
+AdaptivePageSize finds that point: the x-limit is doubled after every page
+that came back within the latency and size targets, and halved after a page
+that was slow, too large, timed out or failed with a 5xx.
+
+Pass an AdaptivePageSize as the limit of ClimateClient.iter_activities,
+get_activities or iter_scouting_observations in place of a number. One
+instance can be reused across listings of the same layer, so later
+listings start at the size the previous one settled on.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import threading
+
+MAX_PAGE_SIZE = 100
+TARGET_LATENCY = 2.0
+TARGET_BYTES = 4 * 1024 * 1024
+# Seconds a page may take to start arriving (and between its bytes) before
+# the request times out and the limit shrinks.
+PAGE_TIMEOUT = 30.0
+
+
+class AdaptivePageSize:
+    """
+    Page size that grows while pages stay within targets and shrinks when
+    they don't. Safe to share between threads.
+    """
+
+    def __init__(self, initial=10, minimum=1, maximum=MAX_PAGE_SIZE,
+                 target_latency=TARGET_LATENCY, target_bytes=TARGET_BYTES,
+                 timeout=PAGE_TIMEOUT):
+        """
+        :param initial: x-limit of the first page.
+        :param minimum: Smallest x-limit to shrink to.
+        :param maximum: Largest x-limit to grow to, the API maximum by
+            default.
+        :param target_latency: Seconds a page may take before the limit
+            shrinks.
+        :param target_bytes: Size in bytes a page body may have before the
+            limit shrinks.
+        :param timeout: Read timeout in seconds of every page request.
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.target_bytes = target_bytes
+        self.timeout = timeout
+        self.limit = max(minimum, min(initial, maximum))
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed, size=None):
+        """
+        Adjusts the limit after a successful page.
+        :param elapsed: Seconds the page took.
+        :param size: Size in bytes of the page body, or None if unknown.
+        """
+        over = elapsed > self.target_latency or \
+            (size is not None and size > self.target_bytes)
+        with self._lock:
+            if over:
+                self.limit = max(self.minimum, self.limit // 2)
+            elif elapsed < self.target_latency / 2 and \
+                    (size is None or size < self.target_bytes / 2):
+                self.limit = min(self.maximum, self.limit * 2)
+
+    def failed(self):
+        """
+        Halves the limit after a timeout or 5xx.
+        :return: True if the limit was reduced, so the page is worth
+            retrying with the smaller limit.
+        """
+        with self._lock:
+            if self.limit <= self.minimum:
+                return False
+            self.limit = max(self.minimum, self.limit // 2)
+            return True
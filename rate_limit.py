@@ -0,0 +1,220 @@
+"""
+Client-side rate limiting
+
+Climate enforces quotas per API key, and every call this app makes goes out
+under the same key. A RateLimiter keeps the app under those quotas instead
+of finding them through 429s: each endpoint family (token, fields, layers,
+uploads) has a token bucket refilled at a steady rate, and a call waits for
+a token of its family before it is sent.
+
+Buckets are shared by all threads of a process. Given a directory they are
+kept in small files locked with flock, so all worker processes on a host
+draw from the same buckets. Event loop code (climate_async) reserves a token
+with reserve() and waits for it with asyncio.sleep instead of blocking.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import hashlib
+import math
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows.
+    fcntl = None
+
+# Endpoint names used by climate.py, by family.
+FAMILIES = {
+    'token': 'token',
+    'fields': 'fields',
+    'boundaries': 'fields',
+    'activities': 'layers',
+    'contents': 'layers',
+    'scouting_observations': 'layers',
+    'scouting_observation': 'layers',
+    'attachments': 'layers',
+    'uploads': 'uploads',
+    'upload_chunk': 'uploads',
+    'upload_status': 'uploads',
+    'upload_statuses': 'uploads',
+}
+
+# Longest wait a bucket file may ask for. A longer one comes from a corrupt
+# (or tampered with) file, and the bucket is reset instead.
+MAX_WAIT = 60
+
+
+def _take(tokens, last, now, rate, burst):
+    """
+    Refills a bucket holding tokens at time last up to now and takes one
+    token from it.
+    :return: (tokens left, seconds to wait before the token is available)
+    """
+    tokens = min(burst, tokens + (now - last) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    # Take the token now and let the bucket go negative; the wait pays it
+    # back, so waiting callers are served in turn.
+    return tokens - 1, (1 - tokens) / rate
+
+
+class TokenBucket:
+    """
+    Token bucket shared by the threads of one process.
+    """
+
+    def __init__(self, rate, burst):
+        """
+        :param rate: Tokens added per second.
+        :param burst: Max number of tokens held.
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes one token, waiting for it if the bucket is empty.
+        :return: Seconds waited.
+        """
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def reserve(self):
+        """
+        Takes one token without waiting for it.
+        :return: Seconds to wait before using it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens, wait = _take(self._tokens, self._last, now,
+                                       self.rate, self.burst)
+            self._last = now
+        return wait
+
+
+class FileTokenBucket:
+    """
+    Token bucket kept in a file, shared by every process that uses the same
+    path. The file holds "tokens timestamp" and is only read and written
+    under an exclusive flock. It is created with mode 0600 and never opened
+    through a symlink; contents that do not parse, or that ask for a wait
+    longer than MAX_WAIT, reset the bucket to full.
+    """
+
+    def __init__(self, path, rate, burst):
+        """
+        :param path: File holding the bucket state.
+        :param rate: Tokens added per second.
+        :param burst: Max number of tokens held.
+        """
+        if fcntl is None:
+            raise RuntimeError('FileTokenBucket needs fcntl')
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+
+    def acquire(self):
+        """
+        Takes one token, waiting for it if the bucket is empty.
+        :return: Seconds waited.
+        """
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def reserve(self):
+        """
+        Takes one token without waiting for it. Only blocks for as long as
+        another process holds the file lock to do the same.
+        :return: Seconds to wait before using it.
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        with os.fdopen(fd, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                tokens, last = self._parse(f.read(), now)
+                tokens, wait = _take(tokens, last, now, self.rate,
+                                     self.burst)
+                if wait > MAX_WAIT:
+                    tokens, wait = _take(self.burst, now, now, self.rate,
+                                         self.burst)
+                f.seek(0)
+                f.truncate()
+                f.write('{} {}'.format(tokens, now))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return wait
+
+    def _parse(self, contents, now):
+        """
+        :return: (tokens, timestamp) read from the file, or a full bucket
+            if it is new or does not hold two finite numbers.
+        """
+        try:
+            tokens, last = (float(value) for value in contents.split())
+        except ValueError:
+            return self.burst, now
+        if not (math.isfinite(tokens) and math.isfinite(last)):
+            return self.burst, now
+        return tokens, last
+
+
+class RateLimiter:
+    """
+    Token buckets per endpoint family for one API key.
+    """
+
+    def __init__(self, limits, directory=None, key=''):
+        """
+        :param limits: dict of family (see FAMILIES) to (rate per second,
+            burst). Families without a limit are not limited.
+        :param directory: Optional directory to keep the buckets in, to
+            share them between processes. Created if missing, and
+            restricted to the owner.
+        :param key: API key the limits apply to. Only a hash of it is used,
+            to name the bucket files.
+        """
+        self._buckets = {}
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            # Also applies to an existing directory; fails if someone else
+            # owns it.
+            os.chmod(directory, 0o700)
+            prefix = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        for family, (rate, burst) in limits.items():
+            if directory:
+                path = os.path.join(directory, '{}-{}.bucket'.format(
+                    prefix, family))
+                self._buckets[family] = FileTokenBucket(path, rate, burst)
+            else:
+                self._buckets[family] = TokenBucket(rate, burst)
+
+    def acquire(self, endpoint):
+        """
+        Waits until a call to endpoint is allowed.
+        :param endpoint: Endpoint name, e.g. 'fields'.
+        :return: Seconds waited.
+        """
+        bucket = self._buckets.get(FAMILIES.get(endpoint, endpoint))
+        return bucket.acquire() if bucket else 0.0
+
+    def reserve(self, endpoint):
+        """
+        Takes the token for a call to endpoint without waiting for it.
+        :param endpoint: Endpoint name, e.g. 'fields'.
+        :return: Seconds to wait before making the call.
+        """
+        bucket = self._buckets.get(FAMILIES.get(endpoint, endpoint))
+        return bucket.reserve() if bucket else 0.0
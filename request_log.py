@@ -0,0 +1,125 @@
+"""
+Request logging
+
+Logs one compact line per API call (endpoint, method, path, status, bytes
+sent and received, duration) at INFO. Nothing is formatted unless the level
+is enabled, and successful calls can be sampled per endpoint so chatty ones
+such as range downloads and upload chunks don't flood the log. Errors are
+always logged.
+
+A full curl rendering of the request, with credentials and tokens redacted,
+is logged at DEBUG. Set the logger level to DEBUG to get it.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import logging
+import random
+from urllib.parse import urlsplit
+
+from curlify import to_curl
+from logger import Logger
+
+REDACTED = '<redacted>'
+REDACTED_HEADERS = ('authorization', 'x-api-key')
+# Bodies of these endpoints hold login codes and refresh tokens.
+REDACTED_BODY_ENDPOINTS = ('token',)
+MAX_CURL_BODY = 1024
+
+# endpoint -> fraction of successful calls to log, 1.0 when not set.
+sample_rates = {}
+
+
+def set_sample_rate(endpoint, rate):
+    """
+    Logs only the given fraction (0.0 to 1.0) of successful calls to
+    endpoint.
+    """
+    sample_rates[endpoint] = rate
+
+
+def log_request(endpoint, method, url, status, sent, received, elapsed):
+    """
+    Logs a compact record of one API call, if INFO is enabled and the call
+    is sampled.
+    :param endpoint: Short endpoint name used for sampling, e.g. 'fields'.
+    :param method: HTTP method.
+    :param url: Request url; only the path is logged.
+    :param status: Response status code.
+    :param sent: Request body size in bytes, or None.
+    :param received: Response body size in bytes, or None.
+    :param elapsed: Duration in seconds.
+    """
+    logger = Logger()
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    rate = sample_rates.get(endpoint, 1.0)
+    if status < 400 and rate < 1.0 and random.random() >= rate:
+        return
+    record = {
+        'endpoint': endpoint,
+        'method': method,
+        'path': urlsplit(url).path,
+        'status': status,
+        'sent': sent,
+        'received': received,
+        'duration_ms': round(elapsed * 1000, 1)
+    }
+    logger.info('%s %s %s %s sent=%s received=%s %sms', endpoint, method,
+                record['path'], status, sent, received,
+                record['duration_ms'], extra={'request': record})
+
+
+def log_response(res, endpoint):
+    """
+    Logs a requests response with log_request, and its curl rendering at
+    DEBUG.
+    :param res: requests.Response
+    :param endpoint: Short endpoint name used for sampling.
+    """
+    logger = Logger()
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(redacted_curl(res.request, endpoint))
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    sent, received = response_sizes(res)
+    log_request(endpoint, res.request.method, res.request.url,
+                res.status_code, sent, received, res.elapsed.total_seconds())
+
+
+def response_sizes(res):
+    """
+    :param res: requests.Response
+    :return: (bytes sent, bytes received), each None when unknown. The
+        received size is taken from Content-Length so a streamed body is
+        not read.
+    """
+    received = res.headers.get('content-length')
+    return (body_length(res.request.body),
+            int(received) if received is not None else None)
+
+
+def body_length(body):
+    if body is None:
+        return None
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    return None
+
+
+def redacted_curl(request, endpoint):
+    """
+    Renders a requests.PreparedRequest as a curl command with credential
+    headers redacted, token request bodies removed and large bodies
+    replaced by their size.
+    """
+    request = request.copy()
+    for name in REDACTED_HEADERS:
+        if name in request.headers:
+            request.headers[name] = REDACTED
+    if endpoint in REDACTED_BODY_ENDPOINTS and request.body:
+        request.body = REDACTED
+    elif (body_length(request.body) or 0) > MAX_CURL_BODY:
+        request.body = '<{} bytes>'.format(len(request.body))
+    return to_curl(request)
@@ -0,0 +1,188 @@
+"""
+Retries and circuit breakers
+
+Every ClimateClient call goes through a RetryPolicy and the CircuitBreaker
+of its endpoint:
+
+- Idempotent calls (GET, PUT, ...) that fail with a connection error, a
+  timeout or a 429, 502, 503 or 504 are retried with jittered exponential
+  backoff. A Retry-After header on the response is honoured instead. Other
+  calls are only retried on 429, where the request was rejected without
+  being processed.
+- When an endpoint keeps failing (connection errors, timeouts and 5xx),
+  its breaker opens and further calls fail fast with CircuitOpenError
+  instead of tying up workers on a sick upstream. After a cool-down one
+  trial call is let through; if it succeeds the breaker closes again.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+RETRY_STATUSES = (429, 502, 503, 504)
+RETRIES = 3
+BASE_DELAY = 0.5
+MAX_DELAY = 30.0
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Raised instead of making a call while the endpoint's breaker is open.
+    A requests.ConnectionError, so callers handling connection failures
+    handle it too.
+    """
+
+
+class RetryPolicy:
+    """
+    Decides whether a failed call is retried and how long to wait first.
+    """
+
+    def __init__(self, retries=RETRIES, base_delay=BASE_DELAY,
+                 max_delay=MAX_DELAY, statuses=RETRY_STATUSES):
+        """
+        :param retries: Max number of retries per call.
+        :param base_delay: Upper bound in seconds of the first backoff; it
+            doubles on every retry.
+        :param max_delay: Longest wait in seconds, also applied to
+            Retry-After.
+        :param statuses: Response statuses that are retried.
+        """
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.statuses = statuses
+
+    def should_retry(self, method, attempt, status=None):
+        """
+        :param method: HTTP method of the call.
+        :param attempt: Number of retries already made.
+        :param status: Response status, or None after a connection error or
+            timeout.
+        """
+        if attempt >= self.retries:
+            return False
+        if status is not None and status not in self.statuses:
+            return False
+        return method.upper() in IDEMPOTENT_METHODS or status == 429
+
+    def delay(self, attempt, res=None):
+        """
+        :param attempt: Number of retries already made.
+        :param res: The failed response, if any.
+        :return: Seconds to wait before the next attempt: the response's
+            Retry-After if it has one, else a random delay up to
+            base_delay * 2 ** attempt (full jitter).
+        """
+        retry_after = retry_after_seconds(res)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * 2 ** attempt))
+
+
+def retry_after_seconds(res):
+    """
+    :param res: requests.Response or None.
+    :return: Seconds asked for by its Retry-After header (delta-seconds or
+        HTTP date), or None.
+    """
+    value = res.headers.get('retry-after') if res is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() -
+                   time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Breaker of one endpoint. Opens after failure_threshold consecutive
+    failures, and half-opens after reset_timeout to let one trial call
+    through.
+    """
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD,
+                 reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        :return: True if a call may be made now.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and \
+                    time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Let this caller through as the trial call.
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or \
+                    self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+
+class CircuitBreakers:
+    """
+    CircuitBreaker per endpoint name, created on first use.
+    """
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD,
+                 reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint):
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    endpoint, CircuitBreaker(self.failure_threshold,
+                                             self.reset_timeout))
+        return breaker
+
+    def states(self):
+        """
+        :return: dict of endpoint to breaker state.
+        """
+        with self._lock:
+            return {endpoint: breaker.state
+                    for endpoint, breaker in sorted(self._breakers.items())}
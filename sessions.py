@@ -0,0 +1,214 @@
+"""
+Session stores
+
+Per-session state of the web app (logged in user, user id, cached fields),
+stored as JSON-serializable values under (session_id, key). Two backends
+share the same interface:
+
+- MemorySessionStore keeps everything in the process. Lookups are plain dict
+  reads; writes take one of a fixed set of striped locks, so concurrent
+  sessions rarely contend.
+- SQLiteSessionStore keeps sessions in a local SQLite file in WAL mode, so
+  several worker processes on one host see the same sessions. Every thread
+  has its own connection, and lookups go through the primary key.
+
+A session expires once it has not been used for ttl seconds. Reads refresh
+its last use at most every TOUCH_INTERVAL (or ttl / 2 if shorter), so a read
+stays a plain lookup, and expired sessions are swept from set() at most
+every SWEEP_INTERVAL.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+LOCK_STRIPES = 64
+SESSION_TTL = 7 * 24 * 60 * 60
+TOUCH_INTERVAL = 5 * 60
+SWEEP_INTERVAL = 10 * 60
+
+
+class MemorySessionStore:
+    """
+    In-process session store.
+    """
+
+    def __init__(self, stripes=LOCK_STRIPES, ttl=SESSION_TTL):
+        """
+        :param stripes: Number of locks writes are spread over.
+        :param ttl: Seconds after its last use a session expires.
+        """
+        self.ttl = ttl
+        self._touch_interval = min(TOUCH_INTERVAL, ttl / 2)
+        self._sessions = {}
+        # session_id -> time.monotonic() of the last use.
+        self._used = {}
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._swept = time.monotonic()
+
+    def _lock(self, session_id):
+        return self._locks[hash(session_id) % len(self._locks)]
+
+    def get(self, session_id, key):
+        """
+        :return: The value stored under key for the session, or None.
+        """
+        used = self._used.get(session_id)
+        now = time.monotonic()
+        if used is None or now - used > self.ttl:
+            return None
+        if now - used > self._touch_interval:
+            self._used[session_id] = now
+        return self._sessions.get(session_id, {}).get(key)
+
+    def set(self, session_id, **values):
+        """
+        Stores values for the session; a None value removes the key.
+        """
+        now = time.monotonic()
+        with self._lock(session_id):
+            session = {}
+            used = self._used.get(session_id)
+            if used is not None and now - used <= self.ttl:
+                session = dict(self._sessions.get(session_id, {}))
+            for key, value in values.items():
+                if value is None:
+                    session.pop(key, None)
+                else:
+                    session[key] = value
+            self._sessions[session_id] = session
+            self._used[session_id] = now
+        if now - self._swept > min(self.ttl, SWEEP_INTERVAL):
+            self._swept = now
+            self.sweep()
+
+    def delete(self, session_id):
+        with self._lock(session_id):
+            self._sessions.pop(session_id, None)
+            self._used.pop(session_id, None)
+
+    def sweep(self):
+        """
+        Deletes the expired sessions.
+        :return: Number of sessions deleted.
+        """
+        expired = time.monotonic() - self.ttl
+        deleted = 0
+        for session_id, used in list(self._used.items()):
+            if used < expired:
+                with self._lock(session_id):
+                    if self._used.get(session_id, expired) < expired:
+                        self._sessions.pop(session_id, None)
+                        self._used.pop(session_id, None)
+                        deleted += 1
+        return deleted
+
+
+class SQLiteSessionStore:
+    """
+    Session store in a SQLite file shared by worker processes.
+    """
+
+    def __init__(self, path, timeout=5.0, ttl=SESSION_TTL):
+        """
+        :param path: SQLite file.
+        :param timeout: Seconds to wait for another writer before failing.
+        :param ttl: Seconds after its last use a session expires.
+        """
+        self.path = path
+        self.timeout = timeout
+        self.ttl = ttl
+        self._touch_interval = min(TOUCH_INTERVAL, ttl / 2)
+        self._swept = time.time()
+        self._local = threading.local()
+        db = self._db()
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                   'session_id TEXT NOT NULL, '
+                   'key TEXT NOT NULL, '
+                   'value TEXT NOT NULL, '
+                   'updated REAL NOT NULL, '
+                   'PRIMARY KEY (session_id, key))')
+        db.execute('CREATE INDEX IF NOT EXISTS sessions_updated '
+                   'ON sessions (updated)')
+        db.commit()
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout)
+            self._local.db = db
+        return db
+
+    def get(self, session_id, key):
+        """
+        :return: The value stored under key for the session, or None.
+        """
+        db = self._db()
+        row = db.execute(
+            'SELECT value, updated FROM sessions '
+            'WHERE session_id = ? AND key = ?',
+            (session_id, key)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > self.ttl:
+            return None
+        if now - row[1] > self._touch_interval:
+            with db:
+                self._touch(db, session_id, now)
+        return json.loads(row[0])
+
+    def set(self, session_id, **values):
+        """
+        Stores values for the session; a None value removes the key.
+        """
+        db = self._db()
+        now = time.time()
+        with db:
+            db.execute('DELETE FROM sessions '
+                       'WHERE session_id = ? AND updated < ?',
+                       (session_id, now - self.ttl))
+            self._touch(db, session_id, now)
+            for key, value in values.items():
+                if value is None:
+                    db.execute('DELETE FROM sessions '
+                               'WHERE session_id = ? AND key = ?',
+                               (session_id, key))
+                else:
+                    db.execute('INSERT OR REPLACE INTO sessions '
+                               'VALUES (?, ?, ?, ?)',
+                               (session_id, key, json.dumps(value), now))
+
+        if now - self._swept > min(self.ttl, SWEEP_INTERVAL):
+            self._swept = now
+            self.sweep()
+
+    def delete(self, session_id):
+        db = self._db()
+        with db:
+            db.execute('DELETE FROM sessions WHERE session_id = ?',
+                       (session_id,))
+
+    def sweep(self):
+        """
+        Deletes the expired sessions of all worker processes.
+        :return: Number of session values deleted.
+        """
+        db = self._db()
+        with db:
+            return db.execute('DELETE FROM sessions WHERE updated < ?',
+                              (time.time() - self.ttl,)).rowcount
+
+    @staticmethod
+    def _touch(db, session_id, now):
+        """
+        Marks every value of the session as used now, so the session
+        expires as a whole.
+        """
+        db.execute('UPDATE sessions SET updated = ? WHERE session_id = ?',
+                   (now, session_id))
@@ -0,0 +1,304 @@
+"""
+Spatial index of field boundaries
+
+Answers "which field is this point in" and "which fields overlap this box"
+locally, from the GeoJSON returned by get_boundary, instead of testing every
+boundary by brute force.
+
+Boundaries are registered in a uniform grid. For every grid cell a boundary
+overlaps, the index keeps the boundary edges that touch the cell and whether
+a reference point of the cell lies inside the boundary: the cell's center,
+or another point of the cell when the center lies on the boundary. A point
+is then classified with only the edges of its own cell: it is inside
+exactly when the segment from the point to the reference point crosses the
+boundary an even number of times and the reference point is inside, or an
+odd number of times and it is outside. Cells with no edges are entirely
+inside (and kept) or entirely outside (and dropped), so most points in the
+interior of a field need no geometry at all.
+
+Coordinates are used as given (longitude, latitude for Climate boundaries).
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import math
+import threading
+
+CELL_SIZE = 0.005
+# Fractions of a cell tried, after its center, for the reference point of a
+# cell whose center lies on the boundary. Irrational-looking, so they do not
+# land on rounded coordinates.
+REFERENCE_OFFSETS = (0.5, 0.3819660, 0.6180340, 0.2360680, 0.7639320,
+                     0.1458980, 0.8541020)
+
+
+def polygons(geojson):
+    """
+    :param geojson: Feature, FeatureCollection, Polygon or MultiPolygon.
+    :return: list of polygons, each a list of rings of (x, y) tuples.
+    """
+    kind = geojson.get('type')
+    if kind == 'Feature':
+        return polygons(geojson.get('geometry') or {})
+    if kind == 'FeatureCollection':
+        return [p for f in geojson.get('features', ()) for p in polygons(f)]
+    if kind == 'GeometryCollection':
+        return [p for g in geojson.get('geometries', ()) for p in polygons(g)]
+    if kind == 'Polygon':
+        return [_rings(geojson['coordinates'])]
+    if kind == 'MultiPolygon':
+        return [_rings(p) for p in geojson['coordinates']]
+    return []
+
+
+def _rings(coordinates):
+    return [[(float(p[0]), float(p[1])) for p in ring] for ring in coordinates]
+
+
+def _edges(rings):
+    for ring in rings:
+        for i in range(len(ring) - 1):
+            if ring[i] != ring[i + 1]:
+                yield ring[i], ring[i + 1]
+        if ring and ring[0] != ring[-1]:
+            yield ring[-1], ring[0]
+
+
+def _inside(x, y, edges):
+    """
+    Even-odd ray casting over all edges, so holes and multipolygons work.
+    """
+    inside = False
+    for (x1, y1), (x2, y2) in edges:
+        if (y1 > y) != (y2 > y) and \
+                x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+
+def _orientation(ax, ay, bx, by, cx, cy):
+    return (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+
+
+def _on_edge(x, y, edges, tolerance):
+    """
+    :return: Whether (x, y) lies within tolerance of one of edges.
+    """
+    for (x1, y1), (x2, y2) in edges:
+        dx, dy = x2 - x1, y2 - y1
+        t = ((x - x1) * dx + (y - y1) * dy) / (dx * dx + dy * dy)
+        t = min(1.0, max(0.0, t))
+        if math.hypot(x - x1 - t * dx, y - y1 - t * dy) <= tolerance:
+            return True
+    return False
+
+
+def _crossings(px, py, cx, cy, edges):
+    """
+    Number of edges crossed by the segment from (px, py) to (cx, cy).
+    Edge endpoints count on one side only, as in ray casting, so a segment
+    through a vertex is counted consistently.
+    """
+    n = 0
+    for (x1, y1), (x2, y2) in edges:
+        if (_orientation(px, py, cx, cy, x1, y1) > 0) != \
+                (_orientation(px, py, cx, cy, x2, y2) > 0) and \
+                (_orientation(x1, y1, x2, y2, px, py) > 0) != \
+                (_orientation(x1, y1, x2, y2, cx, cy) > 0):
+            n += 1
+    return n
+
+
+class SpatialIndex:
+    """
+    Grid index of boundaries keyed by field id. Safe to share between
+    threads; queries see a consistent index while it is being updated.
+    """
+
+    def __init__(self, cell_size=CELL_SIZE):
+        """
+        :param cell_size: Width and height of a grid cell, in coordinate
+            units. Around the size of a typical field works best.
+        """
+        self.cell_size = cell_size
+        # (ix, iy) -> list of (key, reference point, reference point
+        # inside, edges touching the cell)
+        self._cells = {}
+        # key -> (version, bbox, list of cells)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def version(self, key):
+        """
+        :return: The version (e.g. boundaryId) key was indexed with, or None.
+        """
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    def put(self, key, geojson, version=None):
+        """
+        Indexes the boundary of key, replacing any previous one. Does
+        nothing when key is already indexed with the same version.
+        :param key: Field id.
+        :param geojson: Boundary as returned by get_boundary.
+        :param version: Version of the boundary, e.g. its boundaryId.
+        """
+        if version is not None and self.version(key) == version:
+            return
+        rings = [ring for polygon in polygons(geojson) for ring in polygon]
+        edges = list(_edges(rings))
+        cells = {}
+        bbox = None
+        if edges:
+            xs = [p[0] for ring in rings for p in ring]
+            ys = [p[1] for ring in rings for p in ring]
+            bbox = (min(xs), min(ys), max(xs), max(ys))
+            cells = self._cover(edges, bbox)
+        with self._lock:
+            self._remove(key)
+            for cell, (reference, inside, cell_edges) in cells.items():
+                self._cells.setdefault(cell, []).append(
+                    (key, reference, inside, cell_edges))
+            self._entries[key] = (version, bbox, list(cells))
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def sync(self, fields, boundaries):
+        """
+        Brings the index in line with a user's fields: fields whose
+        boundaryId changed are re-indexed, and fields that are gone are
+        removed.
+        :param fields: Iterable of field_catalog.FieldRecord.
+        :param boundaries: dict of boundaryId to geojson, e.g. from
+            climate.get_boundaries. Fields whose boundary is missing keep
+            their current entry.
+        """
+        keys = set()
+        for field in fields:
+            keys.add(field.id)
+            boundary = boundaries.get(field.boundary_id)
+            if boundary is not None:
+                self.put(field.id, boundary, version=field.boundary_id)
+        with self._lock:
+            for key in [k for k in self._entries if k not in keys]:
+                self._remove(key)
+
+    def locate(self, x, y):
+        """
+        :return: list of the keys whose boundary contains the point.
+        """
+        return self._locate(x, y, self._cells)
+
+    def assign(self, points):
+        """
+        Batched point-in-polygon query.
+        :param points: Iterable of (x, y).
+        :return: list with, for each point, the key of a boundary containing
+            it, or None.
+        """
+        cells = self._cells
+        result = []
+        for x, y in points:
+            keys = self._locate(x, y, cells, first=True)
+            result.append(keys[0] if keys else None)
+        return result
+
+    def intersecting(self, min_x, min_y, max_x, max_y):
+        """
+        :return: set of the keys whose boundary bounding box intersects the
+            given box.
+        """
+        def overlaps(bbox):
+            return bbox is not None and bbox[0] <= max_x and \
+                bbox[2] >= min_x and bbox[1] <= max_y and bbox[3] >= min_y
+
+        size = self.cell_size
+        x0, x1 = math.floor(min_x / size), math.floor(max_x / size)
+        y0, y1 = math.floor(min_y / size), math.floor(max_y / size)
+        entries = self._entries
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(entries):
+            # A box larger than the index: checking every entry is cheaper.
+            return {key for key, entry in list(entries.items())
+                    if overlaps(entry[1])}
+        candidates = set()
+        for ix in range(x0, x1 + 1):
+            for iy in range(y0, y1 + 1):
+                candidates.update(e[0] for e in self._cells.get((ix, iy), ()))
+        return {key for key in candidates
+                if key in entries and overlaps(entries[key][1])}
+
+    def _locate(self, x, y, cells, first=False):
+        size = self.cell_size
+        ix, iy = math.floor(x / size), math.floor(y / size)
+        found = []
+        for key, (cx, cy), inside, edges in cells.get((ix, iy), ()):
+            if edges:
+                if _crossings(x, y, cx, cy, edges) % 2:
+                    inside = not inside
+            if inside:
+                found.append(key)
+                if first:
+                    break
+        return found
+
+    def _cover(self, edges, bbox):
+        """
+        :return: dict of cell to (reference point, reference point inside,
+            edges touching the cell) for the cells of bbox that hold part
+            of the boundary.
+        """
+        size = self.cell_size
+        x0, y0 = math.floor(bbox[0] / size), math.floor(bbox[1] / size)
+        x1, y1 = math.floor(bbox[2] / size), math.floor(bbox[3] / size)
+        touching = {}
+        for edge in edges:
+            (ax, ay), (bx, by) = edge
+            for ix in range(math.floor(min(ax, bx) / size),
+                            math.floor(max(ax, bx) / size) + 1):
+                for iy in range(math.floor(min(ay, by) / size),
+                                math.floor(max(ay, by) / size) + 1):
+                    touching.setdefault((ix, iy), []).append(edge)
+        cells = {}
+        for ix in range(x0, x1 + 1):
+            for iy in range(y0, y1 + 1):
+                cell_edges = touching.get((ix, iy), ())
+                reference = self._reference(ix, iy, cell_edges)
+                inside = _inside(reference[0], reference[1], edges)
+                if inside or cell_edges:
+                    cells[(ix, iy)] = (reference, inside, tuple(cell_edges))
+        return cells
+
+    def _reference(self, ix, iy, edges):
+        """
+        :return: A point of cell (ix, iy) off the boundary: its center
+            unless that lies on one of edges (the edges touching the cell).
+        """
+        size = self.cell_size
+        tolerance = size * 1e-6
+        for fx in REFERENCE_OFFSETS:
+            for fy in REFERENCE_OFFSETS:
+                x, y = (ix + fx) * size, (iy + fy) * size
+                if not _on_edge(x, y, edges, tolerance):
+                    return x, y
+        # Not reachable with the few edges of real boundaries.
+        return (ix + 0.5) * size, (iy + 0.5) * size
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for cell in entry[2]:
+            remaining = [e for e in self._cells[cell] if e[0] != key]
+            if remaining:
+                self._cells[cell] = remaining
+            else:
+                del self._cells[cell]
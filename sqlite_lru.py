@@ -0,0 +1,145 @@
+"""
+SQLite LRU tier
+
+The on-disk tier of the boundary and response caches: a table in a local
+SQLite file with a key, the entry's columns and its access time, trimmed to
+the least recently used entries. Access times of hits are written in
+batches, and the table is trimmed back to capacity only once it has grown
+TRIM_SLACK past it, so neither costs a commit per hit or a table scan per
+put.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+# Hits whose access times are written in one transaction.
+TOUCH_BATCH = 64
+# Fraction of capacity the table may exceed before it is trimmed.
+TRIM_SLACK = 0.1
+
+
+class SQLiteLRU:
+    """
+    Size-bounded LRU table in a SQLite file. Safe to share between threads;
+    the callers' memory tiers should not hold their lock while calling it.
+    """
+
+    def __init__(self, path, table, key, columns, capacity=None,
+                 private=False):
+        """
+        :param path: SQLite file.
+        :param table: Name of the table.
+        :param key: Name of the TEXT primary key column.
+        :param columns: Sequence of (name, SQL type) of the entry's columns.
+        :param capacity: Max number of entries, or None for no limit.
+        :param private: Create the file with mode 0600, for users' data.
+            Keep it in a directory only the app's user can access.
+        """
+        self.table = table
+        self.key = key
+        self.capacity = capacity
+        names = [name for name, _ in columns]
+        self._select = 'SELECT {} FROM {} WHERE {} = ?'.format(
+            ', '.join(names), table, key)
+        self._update = 'UPDATE {} SET {}, accessed = ? WHERE {} = ?'.format(
+            table, ', '.join('{} = ?'.format(name) for name in names), key)
+        self._insert = 'INSERT INTO {} ({}, accessed, {}) VALUES ({})'.format(
+            table, ', '.join(names), key, ', '.join('?' * (len(names) + 2)))
+        self._exists = 'SELECT 1 FROM {} WHERE {} = ?'.format(table, key)
+        self._touch = 'UPDATE {} SET accessed = ? WHERE {} = ?'.format(
+            table, key)
+        self._delete_oldest = ('DELETE FROM {0} WHERE {1} IN (SELECT {1} '
+                               'FROM {0} ORDER BY accessed ASC LIMIT ?)'
+                               ).format(table, key)
+        # Guards _db, _touched and _count.
+        self._lock = threading.Lock()
+        # key -> access time not yet written to disk.
+        self._touched = {}
+        if private:
+            # SQLite creates the file (and its journal) with the umask's
+            # mode; create it private first.
+            os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+            os.chmod(path, 0o600)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # Entries can be fetched again, so a commit need not wait for the
+        # disk.
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        definitions = ', '.join('{} {} NOT NULL'.format(name, kind)
+                                for name, kind in columns)
+        self._db.execute('CREATE TABLE IF NOT EXISTS {} ({} TEXT PRIMARY KEY, '
+                         '{}, accessed REAL NOT NULL)'.format(table, key,
+                                                              definitions))
+        self._db.execute('CREATE INDEX IF NOT EXISTS {0}_accessed '
+                         'ON {0} (accessed)'.format(table))
+        self._db.commit()
+        self._count = self._db.execute(
+            'SELECT COUNT(*) FROM {}'.format(table)).fetchone()[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._db is not None and self._db.execute(
+                self._exists, (key,)).fetchone() is not None
+
+    def get(self, key):
+        """
+        :return: Tuple of the entry's columns, or None.
+        """
+        with self._lock:
+            if self._db is None:
+                return None
+            row = self._db.execute(self._select, (key,)).fetchone()
+            if row is None:
+                return None
+            self._touched[key] = time.time()
+            if len(self._touched) >= TOUCH_BATCH:
+                self._write_touched()
+                self._db.commit()
+        return row
+
+    def put(self, key, values):
+        """
+        Stores or replaces an entry.
+        :param values: Tuple of the entry's columns.
+        """
+        values = tuple(values) + (time.time(), key)
+        with self._lock:
+            if self._db is None:
+                return
+            self._touched.pop(key, None)
+            self._write_touched()
+            if not self._db.execute(self._update, values).rowcount:
+                self._db.execute(self._insert, values)
+                self._count += 1
+            if self.capacity is not None and \
+                    self._count > self.capacity * (1 + TRIM_SLACK):
+                self._trim()
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._write_touched()
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def _write_touched(self):
+        if self._touched:
+            self._db.executemany(self._touch, (
+                (accessed, key) for key, accessed in self._touched.items()))
+            self._touched.clear()
+
+    def _trim(self):
+        """
+        Deletes the least recently used entries beyond capacity.
+        """
+        self._db.execute(self._delete_oldest,
+                         (max(0, self._count - self.capacity),))
+        self._count = self._db.execute(
+            'SELECT COUNT(*) FROM {}'.format(self.table)).fetchone()[0]
@@ -0,0 +1,40 @@
+import logging
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+for name in ('CLIMATE_API_ID', 'CLIMATE_API_SECRET', 'CLIMATE_API_KEY',
+             'CLIMATE_API_SCOPES'):
+    os.environ.setdefault(name, 'test')
+
+import climate  # noqa: E402
+from logger import Logger  # noqa: E402
+from mock_server import MockClimateServer, MockConfig  # noqa: E402
+
+Logger(logging.getLogger('tests'))
+
+
+@pytest.fixture
+def mock_config():
+    """
+    Configuration of the server fixture. Override it in a module, or with
+    @pytest.mark.parametrize('mock_config', [MockConfig(...)]) on a test.
+    """
+    return MockConfig()
+
+
+@pytest.fixture
+def server(mock_config, monkeypatch):
+    """
+    A running MockClimateServer that climate and climate_async talk to.
+    """
+    server = MockClimateServer(mock_config).start()
+    monkeypatch.setattr(climate, 'api_uri', server.uri)
+    monkeypatch.setattr(climate, 'token_uri',
+                        '{}/api/oauth/token'.format(server.uri))
+    yield server
+    server.stop()
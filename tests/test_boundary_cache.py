@@ -0,0 +1,72 @@
+import sqlite3
+import threading
+
+from boundary_cache import BoundaryCache
+from mock_server import boundary
+
+
+def disk_rows(path):
+    with sqlite3.connect(path) as db:
+        return dict(db.execute('SELECT id, accessed FROM boundaries'))
+
+
+def test_memory_and_disk_tiers(tmp_path):
+    path = str(tmp_path / 'boundaries.sqlite')
+    cache = BoundaryCache(capacity=2, path=path)
+    for i in range(3):
+        cache.put('boundary-{}'.format(i), boundary('boundary-{}'.format(i)))
+
+    assert cache.get('boundary-2') == boundary('boundary-2')
+    assert cache.get('boundary-0') == boundary('boundary-0')
+    assert cache.get('boundary-9') is None
+    assert 'boundary-1' in cache
+    assert cache.stats() == {'memory_hits': 1, 'disk_hits': 1, 'misses': 1,
+                             'memory_entries': 2}
+    cache.close()
+
+    reopened = BoundaryCache(capacity=2, path=path)
+    assert reopened.get('boundary-1') == boundary('boundary-1')
+    assert reopened.stats()['disk_hits'] == 1
+
+
+def test_disk_hits_are_written_in_batches(tmp_path):
+    path = str(tmp_path / 'boundaries.sqlite')
+    cache = BoundaryCache(capacity=1, path=path)
+    cache.put('boundary-1', boundary('boundary-1'))
+    cache.put('boundary-2', boundary('boundary-2'))
+    before = disk_rows(path)
+
+    assert cache.get('boundary-1') is not None
+    assert disk_rows(path) == before
+    cache.close()
+    assert disk_rows(path)['boundary-1'] > before['boundary-1']
+
+
+def test_disk_tier_is_trimmed_past_its_slack(tmp_path):
+    path = str(tmp_path / 'boundaries.sqlite')
+    cache = BoundaryCache(capacity=1, path=path, disk_capacity=10)
+    for i in range(10):
+        cache.put('boundary-{}'.format(i), boundary('boundary-{}'.format(i)))
+    # Used again, so it outlives the boundaries put after it.
+    cache.get('boundary-0')
+    for i in range(10, 16):
+        cache.put('boundary-{}'.format(i), boundary('boundary-{}'.format(i)))
+        assert len(disk_rows(path)) <= 11
+    cache.close()
+
+    rows = disk_rows(path)
+    assert 'boundary-0' in rows
+    assert 'boundary-15' in rows
+    assert 'boundary-1' not in rows
+
+
+def test_memory_hits_do_not_wait_for_the_disk(tmp_path):
+    cache = BoundaryCache(capacity=2, path=str(tmp_path / 'b.sqlite'))
+    cache.put('boundary-1', boundary('boundary-1'))
+    results = []
+    with cache._disk._lock:
+        reader = threading.Thread(
+            target=lambda: results.append(cache.get('boundary-1')))
+        reader.start()
+        reader.join(5)
+        assert results == [boundary('boundary-1')]
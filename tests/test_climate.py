@@ -0,0 +1,212 @@
+import itertools
+import threading
+import time
+
+import pytest
+import requests
+
+import climate
+import metrics
+from boundary_cache import BoundaryCache
+from climate import PageIterator
+from metrics import Metrics
+from mock_server import (MockConfig, boundary, content_bytes, field,
+                         observation)
+
+CONTENT_LENGTH = 100 * 1000
+CHUNK_SIZE = 7 * 1000
+
+
+@pytest.fixture
+def mock_config():
+    return MockConfig(fields=25, observations=25, page_size=10,
+                      content_length=CONTENT_LENGTH)
+
+
+@pytest.fixture
+def client(server):
+    with climate.ClimateClient('token', 'key') as client:
+        yield client
+
+
+@pytest.fixture
+def contents_uri(server):
+    return '{}/v4/layers/asPlanted/asPlanted-1/contents'.format(server.uri)
+
+
+@pytest.fixture
+def ranges(client, monkeypatch):
+    """
+    Records the ranges requested by fetch_contents and the most requests
+    seen in flight at once. Earlier ranges are made slower, so they complete
+    out of order.
+    """
+    fetch_range = client._fetch_range
+    lock = threading.Lock()
+    seen = {'starts': [], 'in_flight': 0, 'max_in_flight': 0}
+
+    def slow_fetch_range(uri, headers, start, end):
+        with lock:
+            seen['starts'].append(start)
+            seen['in_flight'] += 1
+            seen['max_in_flight'] = max(seen['max_in_flight'],
+                                        seen['in_flight'])
+        time.sleep(0.02 if start // CHUNK_SIZE % 2 == 0 else 0.005)
+        try:
+            return fetch_range(uri, headers, start, end)
+        finally:
+            with lock:
+                seen['in_flight'] -= 1
+
+    monkeypatch.setattr(client, '_fetch_range', slow_fetch_range)
+    return seen
+
+
+@pytest.fixture
+def defaults(monkeypatch):
+    monkeypatch.setattr(climate, '_client_options', {})
+    monkeypatch.setattr(climate, '_default_session', None)
+
+
+def pool_maxsize(session):
+    return session.get_adapter('https://platform.climate.com')._pool_maxsize
+
+
+def test_default_session_pool_size_is_configurable(defaults):
+    assert pool_maxsize(climate.default_session()) == \
+        climate.DEFAULT_POOL_SIZE
+
+    climate.configure(pool_size=48)
+    session = climate.default_session()
+    assert pool_maxsize(session) == 48
+    assert climate.client('token', 'key').session is session
+
+    climate.configure(boundary_cache=None, pool_size=48)
+    assert climate.default_session() is session
+
+
+def test_closing_a_client_keeps_the_shared_session(defaults):
+    session = climate.default_session()
+    adapter = session.get_adapter('https://platform.climate.com')
+    adapter.poolmanager.connection_from_url('https://platform.climate.com')
+
+    with climate.client('token', 'key'):
+        pass
+
+    assert len(adapter.poolmanager.pools) == 1
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_fields_are_read_page_by_page(client, stream):
+    fields = client.iter_fields(stream=stream)
+
+    pages = [list(page) for page in fields.pages()]
+
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert [f for page in pages for f in page] == \
+        [field(i) for i in range(25)]
+    assert fields.done
+    assert fields.status_code == 200
+    assert fields.next_token == '25'
+
+
+def test_listing_resumes_from_the_next_token(client):
+    fields = client.iter_fields()
+    # Stop in the middle of the second page.
+    first = list(itertools.islice(fields, 15))
+    assert not fields.done
+    assert fields.next_token == '10'
+
+    rest = list(client.iter_fields(fields.next_token))
+
+    # The rest of the second page is repeated, nothing is lost.
+    assert first[:10] + rest == [field(i) for i in range(25)]
+
+
+def test_observations_are_paginated(client):
+    observations = client.iter_scouting_observations(limit=10)
+
+    assert list(observations) == [observation(i) for i in range(25)]
+    assert observations.next_token == '25'
+
+
+def test_failed_page_stops_the_iteration():
+    def fetch_page(next_token, stream):
+        res = requests.Response()
+        if next_token is None:
+            res.status_code = 206
+            res.headers['x-next-token'] = 'page-2'
+            res._content = b'{"results": [1, 2]}'
+        else:
+            res.status_code = 500
+            res._content = b'oops'
+        return res
+
+    pages = PageIterator(fetch_page)
+
+    assert list(pages) == [1, 2]
+    assert not pages.done
+    assert pages.status_code == 500
+    # A later retry carries on from the page that failed.
+    assert pages.next_token == 'page-2'
+
+
+@pytest.mark.parametrize('concurrency', [1, 4])
+def test_contents_are_fetched_in_order(client, contents_uri, ranges,
+                                       concurrency):
+    chunks = list(client.fetch_contents(contents_uri, {}, CONTENT_LENGTH,
+                                        concurrency, CHUNK_SIZE))
+
+    assert b''.join(chunks) == content_bytes(0, CONTENT_LENGTH)
+    assert [len(chunk) for chunk in chunks] == \
+        [CHUNK_SIZE] * 14 + [CONTENT_LENGTH % CHUNK_SIZE]
+    assert sorted(ranges['starts']) == \
+        list(range(0, CONTENT_LENGTH, CHUNK_SIZE))
+    assert ranges['max_in_flight'] == concurrency
+
+
+def test_failed_range_ends_the_contents(client, contents_uri, ranges,
+                                        monkeypatch):
+    registry = Metrics()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    # Ranges past the end of the contents get a 416.
+    length = CONTENT_LENGTH + 3 * CHUNK_SIZE
+
+    data = b''.join(client.fetch_contents(contents_uri, {}, length, 4,
+                                          CHUNK_SIZE))
+
+    assert data == content_bytes(0, CONTENT_LENGTH)
+    stream = registry.snapshot()['contents_stream']
+    assert stream['statuses'] == {0: 1}
+    assert stream['received'] == CONTENT_LENGTH
+
+
+def test_closing_the_contents_stops_fetching(client, contents_uri, ranges):
+    chunks = client.fetch_contents(contents_uri, {}, CONTENT_LENGTH, 2,
+                                   CHUNK_SIZE)
+
+    assert next(chunks) == content_bytes(0, CHUNK_SIZE)
+    chunks.close()
+    time.sleep(0.1)
+
+    assert len(ranges['starts']) <= 4
+
+
+def test_prefetched_boundaries_are_cached(server, monkeypatch):
+    registry = Metrics()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    cache = BoundaryCache()
+    cache.put('boundary-0', boundary('boundary-0'))
+    fields = [field(i) for i in range(20)] + [field(3), {'id': 'no-boundary'}]
+
+    with climate.ClimateClient('token', 'key',
+                               boundary_cache=cache) as client:
+        boundaries = client.prefetch_boundaries(fields, concurrency=4)
+        assert client.get_boundary('boundary-7') == boundary('boundary-7')
+
+    assert boundaries == {'boundary-{}'.format(i):
+                          boundary('boundary-{}'.format(i))
+                          for i in range(20)}
+    assert all('boundary-{}'.format(i) in cache for i in range(20))
+    # Only the 19 boundaries missing from the cache were requested, once.
+    assert registry.snapshot()['boundaries']['count'] == 19
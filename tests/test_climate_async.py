@@ -0,0 +1,180 @@
+import asyncio
+import io
+
+import aiohttp
+import pytest
+from multidict import CIMultiDict
+
+import climate
+from climate import CHUNK_SIZE
+from climate_async import AsyncClimateClient, Response
+from file import md5_and_length
+from mock_server import MockConfig, boundary, content_bytes, field
+from resilience import CircuitBreakers, CircuitOpenError, RetryPolicy
+from uploads import UploadProgress
+
+FIELDS = 250
+PAGE_SIZE = 100
+CONTENT_LENGTH = 3 * 1024 * 1024 + 17
+
+
+@pytest.fixture
+def mock_config():
+    return MockConfig(fields=FIELDS, page_size=PAGE_SIZE,
+                      content_length=CONTENT_LENGTH, latency=0.001)
+
+
+def run(coroutine_function, **options):
+    async def main():
+        async with AsyncClimateClient('token', 'key', **options) as client:
+            return await coroutine_function(client)
+    return asyncio.run(main())
+
+
+def failing_send(monkeypatch, failures):
+    """
+    Makes AsyncClimateClient._send fail with each of failures (an exception
+    to raise or a status to answer) before it sends for real.
+    :return: list of the endpoints called.
+    """
+    calls = []
+    failures = list(failures)
+    send = AsyncClimateClient._send
+
+    async def flaky_send(self, endpoint, *args, **kwargs):
+        calls.append(endpoint)
+        if failures:
+            failure = failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return Response(failure, CIMultiDict(), b'')
+        return await send(self, endpoint, *args, **kwargs)
+
+    monkeypatch.setattr(AsyncClimateClient, '_send', flaky_send)
+    return calls
+
+
+def test_pagination(server):
+    async def pages(client):
+        iterator = client.iter_fields()
+        pages = [page async for page in iterator.pages()]
+        return pages, iterator
+
+    pages, iterator = run(pages)
+    assert [len(page) for page in pages] == [100, 100, 50]
+    assert [f for page in pages for f in page] == \
+        [field(i) for i in range(FIELDS)]
+    assert iterator.done
+    assert iterator.status_code == 200
+    assert iterator.next_token == str(FIELDS)
+
+
+def test_pagination_resumes_from_next_token(server):
+    fields = run(lambda client: client.get_fields(next_token='200'))
+    assert fields == [field(i) for i in range(200, FIELDS)]
+
+
+@pytest.mark.parametrize('concurrency', [1, 4])
+def test_fetch_contents_in_order(server, concurrency):
+    async def download(client):
+        return [chunk async for chunk in client.get_activity_contents(
+            'asPlanted', 'asPlanted-0', CONTENT_LENGTH,
+            concurrency=concurrency, chunk_size=256 * 1024)]
+
+    chunks = run(download)
+    assert len(chunks) == 13
+    assert b''.join(chunks) == content_bytes(0, CONTENT_LENGTH)
+
+
+def test_ranges_are_not_compressed(server, monkeypatch):
+    sent = []
+    request = AsyncClimateClient.request
+
+    async def recording_request(self, endpoint, method, uri, headers=None,
+                                **kwargs):
+        sent.append(headers)
+        return await request(self, endpoint, method, uri, headers=headers,
+                             **kwargs)
+
+    monkeypatch.setattr(AsyncClimateClient, 'request', recording_request)
+
+    async def download(client):
+        return [chunk async for chunk in client.get_activity_contents(
+            'asPlanted', 'asPlanted-0', CONTENT_LENGTH)]
+
+    assert b''.join(run(download)) == content_bytes(0, CONTENT_LENGTH)
+    assert sent and all(h['Accept-Encoding'] == 'identity' for h in sent)
+
+
+def test_upload(server):
+    data = bytes(range(256)) * (CHUNK_SIZE // 256 + 4096)
+    result = run(lambda client: client.upload(io.BytesIO(data),
+                                              'application/zip'))
+    assert result.success
+    assert result.length == len(data)
+    assert result.sent == len(data)
+    assert result.failed_ranges == []
+    assert server.upload_status(result.upload_id)['status'] == 'SUCCESS'
+
+
+def test_upload_progress_is_kept_by_user_id(server, tmp_path):
+    data = bytes(range(256)) * (CHUNK_SIZE // 256 + 4096)
+    md5, length = md5_and_length(io.BytesIO(data))
+    progress = UploadProgress(str(tmp_path))
+
+    async def upload(client):
+        # Started before the token was refreshed.
+        upload_id = await client._create_upload(md5, length,
+                                                'application/zip')
+        progress.start('user-1', md5, length, 'application/zip',
+                       CHUNK_SIZE, upload_id)
+        result = await client.upload(io.BytesIO(data), 'application/zip',
+                                     progress=progress)
+        return upload_id, result
+
+    upload_id, result = run(upload, user_id='user-1')
+    assert result.success
+    assert result.upload_id == upload_id
+
+
+def test_get_boundaries(server):
+    ids = ['boundary-1', 'boundary-2', 'boundary-1', 'boundary-102']
+    boundaries = run(lambda client: client.get_boundaries(ids,
+                                                          concurrency=2))
+    assert list(boundaries) == ['boundary-1', 'boundary-2', 'boundary-102']
+    assert all(b == boundary(i) for i, b in boundaries.items())
+
+
+def test_failures_are_retried(server, monkeypatch):
+    calls = failing_send(monkeypatch, [
+        aiohttp.ServerDisconnectedError(), 503, asyncio.TimeoutError()])
+    breakers = CircuitBreakers()
+    fields = run(lambda client: client.get_fields(next_token='200'),
+                 retry_policy=RetryPolicy(base_delay=0), breakers=breakers)
+
+    assert fields == [field(i) for i in range(200, FIELDS)]
+    assert calls == ['fields'] * 4
+    assert breakers.states() == {'fields': 'closed'}
+
+
+def test_failing_endpoint_opens_the_breaker(server, monkeypatch):
+    calls = failing_send(monkeypatch, [503] * 4)
+    breakers = CircuitBreakers(failure_threshold=2)
+
+    async def twice(client):
+        res = await client.request('fields', 'GET', server.uri)
+        with pytest.raises(CircuitOpenError):
+            await client.request('fields', 'GET', server.uri)
+        return res
+
+    res = run(twice, retry_policy=RetryPolicy(retries=1, base_delay=0),
+              breakers=breakers)
+    assert res.status_code == 503
+    assert calls == ['fields'] * 2
+    assert breakers.states() == {'fields': 'open'}
+
+
+def test_resilience_is_shared_with_the_sync_client():
+    client = AsyncClimateClient('token', 'key')
+    assert client.retry_policy is climate.default_retry_policy
+    assert client.breakers is climate.default_breakers
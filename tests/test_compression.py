@@ -0,0 +1,101 @@
+import gzip
+import io
+import json
+
+import pytest
+
+import climate
+import compression
+import metrics
+from compression import (ENCODERS, accept_encoding, compress, compressible,
+                         negotiate)
+from metrics import Metrics
+from mock_server import field
+
+DATA = json.dumps([field(i) for i in range(500)]).encode('utf-8')
+
+
+def decompress(data, coding):
+    if coding == 'br':
+        return compression.brotli.decompress(data)
+    if coding == 'zstd':
+        return compression.zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+@pytest.mark.parametrize('coding', sorted(ENCODERS))
+def test_compress_round_trip(coding):
+    data = compress(DATA, coding)
+
+    assert len(data) < len(DATA) / 5
+    assert decompress(data, coding) == DATA
+
+
+def test_accept_encoding_offers_decodable_codings_best_first():
+    assert accept_encoding(['gzip', 'deflate', 'br', 'zstd']) == \
+        'zstd, br, gzip, deflate'
+    assert accept_encoding(['deflate', 'gzip']) == 'gzip, deflate'
+    assert accept_encoding([]) == 'identity'
+
+
+@pytest.mark.parametrize('header, coding', [
+    (None, None),
+    ('', None),
+    ('identity', None),
+    ('gzip', 'gzip'),
+    ('gzip, deflate', 'gzip'),
+    ('GZIP;q=0.5', 'gzip'),
+    ('gzip;q=0', None),
+    ('gzip;q=bad', None),
+    ('deflate', None),
+])
+def test_negotiate(header, coding):
+    assert negotiate(header) == coding
+
+
+def test_negotiate_prefers_the_best_available_coding(monkeypatch):
+    monkeypatch.setattr(compression, 'ENCODERS', dict.fromkeys(
+        ('zstd', 'br', 'gzip'), compress))
+
+    assert negotiate('gzip, br, zstd') == 'zstd'
+    assert negotiate('*') == 'zstd'
+    # q-values win over preference.
+    assert negotiate('gzip;q=1.0, br;q=0.8, zstd;q=0.5') == 'gzip'
+    assert negotiate('*;q=0.5, br') == 'br'
+    assert negotiate('*, zstd;q=0') == 'br'
+
+
+@pytest.mark.parametrize('content_type, text_only, expected', [
+    ('application/json', False, True),
+    ('application/json; charset=utf-8', True, True),
+    ('application/vnd.api+json', True, True),
+    ('text/html', True, True),
+    ('application/octet-stream', False, True),
+    ('application/octet-stream', True, False),
+    ('application/zip', False, False),
+    ('image/png', False, False),
+    ('video/mp4', False, False),
+    ('', False, False),
+    (None, False, False),
+])
+def test_compressible(content_type, text_only, expected):
+    assert compressible(content_type, text_only) == expected
+
+
+@pytest.mark.parametrize('content_type, compressed', [
+    ('application/json', True),
+    ('application/zip', False),
+])
+def test_upload_chunks_are_gzipped(server, monkeypatch, content_type,
+                                   compressed):
+    registry = Metrics()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    with climate.ClimateClient('token', 'key') as client:
+        result = client.upload(io.BytesIO(DATA), content_type,
+                               compress=True)
+    # The server decodes the chunks, so it counts the original bytes.
+    assert server.upload_status(result.upload_id)['status'] == 'SUCCESS'
+
+    assert result.success
+    sent = registry.snapshot()['upload_chunk']['sent']
+    assert (sent < len(DATA) / 5) == compressed
@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+
+import pytest
+
+from download_spool import DownloadError, DownloadSpool
+
+DATA = os.urandom(300 * 1024)
+
+
+def chunked(data, size=64 * 1024):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def wait_spooled(spool, key, length):
+    deadline = time.monotonic() + 5
+    while True:
+        f = spool.open(key, length)
+        if f is not None:
+            return f
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return DownloadSpool(str(tmp_path), max_bytes=1024 * 1024)
+
+
+def test_miss_streams_before_download_ends(spool):
+    release = threading.Event()
+    calls = []
+
+    def download():
+        calls.append(1)
+        chunks = chunked(DATA)
+        yield chunks[0]
+        assert release.wait(5)
+        yield from chunks[1:]
+
+    first = spool.stream('a', len(DATA), download)
+    second = spool.stream('a', len(DATA), download)
+    assert next(first) == DATA[:64 * 1024]
+    release.set()
+    assert DATA[:64 * 1024] + b''.join(first) == DATA
+    assert b''.join(second) == DATA
+    assert calls == [1]
+
+    with wait_spooled(spool, 'a', len(DATA)) as f:
+        assert f.read() == DATA
+    stats = spool.stats()
+    assert (stats['misses'], stats['shared'], stats['hits']) == (1, 1, 1)
+    assert (stats['files'], stats['bytes']) == (1, len(DATA))
+
+
+def test_download_continues_when_reader_stops(spool):
+    chunks = spool.stream('a', len(DATA), lambda: chunked(DATA))
+    next(chunks)
+    chunks.close()
+    wait_spooled(spool, 'a', len(DATA)).close()
+
+
+def test_too_large_is_streamed_without_spooling(spool):
+    data = DATA * 4
+    assert b''.join(spool.stream('big', len(data),
+                                 lambda: chunked(data))) == data
+    assert spool.open('big', len(data)) is None
+    assert spool.stats()['files'] == 0
+
+
+@pytest.mark.parametrize('length', [len(DATA), 4 * len(DATA)])
+def test_failed_download_raises(spool, length):
+    def download():
+        yield DATA[:1024]
+        raise ConnectionError('upstream went away')
+
+    with pytest.raises(DownloadError):
+        b''.join(spool.stream('a', length, download))
+    assert spool.open('a', length) is None
+    assert os.listdir(spool.directory) == []
+
+
+def test_short_download_is_not_kept(spool):
+    with pytest.raises(DownloadError):
+        b''.join(spool.stream('a', len(DATA), lambda: [DATA[:1000]]))
+    assert spool.open('a', len(DATA)) is None
+
+
+def test_least_recently_used_files_are_evicted(spool):
+    for key in 'abc':
+        b''.join(spool.stream(key, len(DATA), lambda: chunked(DATA)))
+        wait_spooled(spool, key, len(DATA)).close()
+        time.sleep(0.01)
+    spool.open('a', len(DATA)).close()
+    time.sleep(0.01)
+    b''.join(spool.stream('d', len(DATA), lambda: chunked(DATA)))
+    wait_spooled(spool, 'd', len(DATA)).close()
+
+    assert spool.open('b', len(DATA)) is None
+    for key in 'acd':
+        assert spool.open(key, len(DATA)) is not None
@@ -0,0 +1,62 @@
+import random
+
+from field_catalog import FieldCatalog
+from mock_server import field
+
+
+def names(records):
+    return [record.name for record in records]
+
+
+def test_lookups():
+    catalog = FieldCatalog([field(i) for i in range(5)], name_index=True)
+
+    assert len(catalog) == 5
+    assert field(3)['id'] in catalog
+    assert catalog.get(field(3)['id']).name == field(3)['name']
+    record = catalog.by_boundary(field(2)['boundaryId'])
+    assert record.id == field(2)['id']
+    assert sorted(catalog.boundary_ids()) == \
+        sorted(field(i)['boundaryId'] for i in range(5))
+    assert [r.id for r in catalog] == [field(i)['id'] for i in range(5)]
+
+
+def test_name_prefix_search_in_name_order():
+    catalog = FieldCatalog([
+        {'id': '1', 'name': 'North 2'}, {'id': '2', 'name': 'south'},
+        {'id': '3', 'name': 'north 1'}, {'id': '4'},
+        {'id': '5', 'name': 'Northwest'}], name_index=True)
+
+    assert names(catalog.with_prefix('NORTH')) == \
+        ['north 1', 'North 2', 'Northwest']
+    assert names(catalog.with_prefix('x')) == []
+
+
+def test_updates_replace_and_remove_fields():
+    catalog = FieldCatalog([{'id': '1', 'name': 'Alpha'},
+                            {'id': '2', 'name': 'Beta'}], name_index=True)
+    catalog.update([{'id': '1', 'name': 'Gamma'}])
+    catalog.update([{'id': '3', 'name': 'Apple'},
+                    {'id': '3', 'name': 'Avocado'},
+                    {'id': '4', 'name': 'Almond'}])
+
+    assert names(catalog.with_prefix('a')) == ['Almond', 'Avocado']
+    assert names(catalog.with_prefix('g')) == ['Gamma']
+
+    assert catalog.retain({'1', '4'}) == 2
+    assert names(catalog.with_prefix('')) == ['Almond', 'Gamma']
+    catalog.remove('4')
+    assert names(catalog.with_prefix('')) == ['Gamma']
+    assert catalog._names == [('gamma', '1')]
+
+
+def test_bulk_load_matches_sorted_names():
+    rng = random.Random(1)
+    fields = [{'id': str(i), 'name': 'Field {}'.format(rng.random())}
+              for i in range(20000)]
+    catalog = FieldCatalog(fields[:10000], name_index=True)
+    for start in range(10000, 20000, 100):
+        catalog.update(fields[start:start + 100])
+
+    assert names(catalog.with_prefix('field')) == \
+        sorted((f['name'] for f in fields), key=str.lower)
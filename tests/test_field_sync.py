@@ -0,0 +1,90 @@
+import pytest
+import requests
+
+import climate
+from field_catalog import FieldCatalog
+from field_sync import FieldStore, FieldSync
+from mock_server import MockConfig, field
+
+
+def test_field_looks_up_one_field():
+    store = FieldStore()
+    store.upsert('user-1', [{'id': 'field-1', 'name': 'North'},
+                            {'id': 'field-2', 'name': 'South'}])
+
+    assert store.field('user-1', 'field-2') == {'id': 'field-2',
+                                                'name': 'South'}
+    assert store.field('user-1', 'field-3') is None
+    assert store.field('user-2', 'field-1') is None
+
+
+@pytest.fixture
+def mock_config():
+    return MockConfig(fields=25, page_size=10)
+
+
+@pytest.fixture
+def client(server):
+    with climate.ClimateClient('token', 'key') as client:
+        yield client
+
+
+def field_ids(n):
+    return [field(i)['id'] for i in range(n)]
+
+
+def test_sync_is_incremental_between_full_syncs(server, client):
+    store = FieldStore()
+    sync = FieldSync(store)
+    catalog = FieldCatalog()
+
+    assert sync.sync('user-1', client, catalog) == \
+        {'updated': 25, 'deleted': 0, 'full': True}
+    assert store.fields('user-1') == [field(i) for i in range(25)]
+    assert store.cursor('user-1')[0] == '25'
+
+    server.config.fields = 30
+    assert sync.sync('user-1', client, catalog) == \
+        {'updated': 5, 'deleted': 0, 'full': False}
+    assert [f['id'] for f in store.fields('user-1')] == field_ids(30)
+    assert sorted(r.id for r in catalog) == sorted(field_ids(30))
+    assert store.cursor('user-1')[0] == '30'
+
+
+def test_full_sync_removes_deleted_fields(server, client):
+    store = FieldStore()
+    catalog = FieldCatalog()
+    FieldSync(store).sync('user-1', client, catalog)
+    store.upsert('user-2', [field(0)])
+
+    server.config.fields = 20
+    sync = FieldSync(store, full_sync_interval=0)
+    assert sync.sync('user-1', client, catalog) == \
+        {'updated': 20, 'deleted': 5, 'full': True}
+    assert [f['id'] for f in store.fields('user-1')] == field_ids(20)
+    assert sorted(r.id for r in catalog) == sorted(field_ids(20))
+    assert store.fields('user-2') == [field(0)]
+
+
+def test_failed_listing_keeps_the_cursor(server, client, monkeypatch):
+    store = FieldStore()
+    sync = FieldSync(store)
+    sync.sync('user-1', client)
+    server.config.fields = 50
+    request = client.request
+
+    def failing_request(endpoint, method, uri, **kwargs):
+        if kwargs['headers'].get('x-next-token') == '35':
+            res = requests.Response()
+            res.status_code = 404
+            res._content = b'gone'
+            return res
+        return request(endpoint, method, uri, **kwargs)
+
+    monkeypatch.setattr(client, 'request', failing_request)
+    result = sync.sync('user-1', client)
+
+    # The pages fetched are kept, but the listing restarts from 25.
+    assert result == {'updated': 10, 'deleted': 0, 'full': False}
+    assert len(store.fields('user-1')) == 35
+    assert store.cursor('user-1')[0] == '25'
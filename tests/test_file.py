@@ -0,0 +1,102 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+import climate
+import file
+from file import (SIDECAR_SUFFIX, cached_md5_and_length, md5_and_length,
+                  path_md5_and_length)
+
+BUFFER_SIZE = 64
+
+
+class ReadOnly:
+    """File object without readinto."""
+
+    def __init__(self, data):
+        self._f = io.BytesIO(data)
+        self.seek = self._f.seek
+        self.read = self._f.read
+
+
+def data(size):
+    return bytes(i * 31 & 0xff for i in range(size))
+
+
+def expected(size):
+    return hashlib.md5(data(size)).hexdigest(), size
+
+
+@pytest.mark.parametrize('size', [0, 1, BUFFER_SIZE - 1, BUFFER_SIZE,
+                                  3 * BUFFER_SIZE + 5])
+@pytest.mark.parametrize('wrap', [io.BytesIO, ReadOnly])
+def test_md5_and_length(size, wrap):
+    f = wrap(data(size))
+    f.seek(0, os.SEEK_END)
+
+    assert md5_and_length(f, BUFFER_SIZE) == expected(size)
+
+
+@pytest.mark.parametrize('size', [0, 1, 5 * 1024 * 1024 + 3])
+def test_path_md5_and_length(tmp_path, size):
+    path = tmp_path / 'upload.zip'
+    path.write_bytes(data(size))
+
+    assert path_md5_and_length(str(path)) == expected(size)
+
+
+@pytest.fixture
+def upload_path(tmp_path):
+    path = tmp_path / 'upload.zip'
+    path.write_bytes(data(1000))
+    return str(path)
+
+
+def test_digest_is_cached_in_a_sidecar(upload_path, monkeypatch):
+    assert cached_md5_and_length(upload_path) == expected(1000)
+    assert os.path.exists(upload_path + SIDECAR_SUFFIX)
+
+    def unexpected(path):
+        raise AssertionError('digest computed again')
+
+    monkeypatch.setattr(file, 'path_md5_and_length', unexpected)
+    assert cached_md5_and_length(upload_path) == expected(1000)
+
+
+def test_sidecar_of_a_modified_file_is_ignored(upload_path):
+    cached_md5_and_length(upload_path)
+    stat = os.stat(upload_path)
+
+    # Same size, new contents and modification time.
+    with open(upload_path, 'r+b') as f:
+        f.write(b'changed')
+    os.utime(upload_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    changed = hashlib.md5(b'changed' + data(1000)[7:]).hexdigest()
+    assert cached_md5_and_length(upload_path) == (changed, 1000)
+
+    with open(upload_path, 'ab') as f:
+        f.write(b'more')
+    assert cached_md5_and_length(upload_path)[1] == 1004
+
+
+def test_corrupt_sidecar_is_rewritten(upload_path):
+    with open(upload_path + SIDECAR_SUFFIX, 'w') as f:
+        f.write('garbage')
+
+    assert cached_md5_and_length(upload_path) == expected(1000)
+    with open(upload_path + SIDECAR_SUFFIX) as f:
+        assert f.read().split()[:2] == [expected(1000)[0], '1000']
+
+
+def test_upload_file_uses_the_sidecar(server, upload_path, monkeypatch):
+    cached_md5_and_length(upload_path)
+    monkeypatch.setattr(file, 'path_md5_and_length', None)
+    monkeypatch.setattr(file, 'md5_and_length', None)
+    with climate.ClimateClient('token', 'key') as client:
+        result = client.upload_file(upload_path, 'application/zip')
+
+    assert result.success
+    assert (result.md5, result.length) == expected(1000)
+    assert server.upload_status(result.upload_id)['status'] == 'SUCCESS'
@@ -0,0 +1,56 @@
+import math
+
+import pytest
+
+import geometry
+from geometry import EMPTY, GeometryCache, boundary_metrics, compute
+
+
+def square(x, y, size, clockwise=False):
+    ring = [[x, y], [x + size, y], [x + size, y + size], [x, y + size],
+            [x, y]]
+    return ring[::-1] if clockwise else ring
+
+
+BOUNDARIES = [
+    {'type': 'Feature', 'geometry': {
+        'type': 'Polygon',
+        'coordinates': [square(-93.0, 45.0, 0.01, clockwise=True),
+                        square(-92.9975, 45.0025, 0.005)]}},
+    {'type': 'MultiPolygon', 'coordinates': [
+        [square(-90.0, 30.0, 0.02)], [square(-89.9, 30.0, 0.01)]]},
+    {'type': 'Polygon', 'coordinates': []},
+    {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [0, 0]]]},
+]
+
+
+def test_square_with_hole():
+    metrics = boundary_metrics(BOUNDARIES[0])
+    side = 0.01 * geometry.METRES_PER_DEGREE
+    expected = side * side * math.cos(math.radians(45.005)) * 0.75
+    assert metrics.area == pytest.approx(expected, rel=1e-9)
+    assert metrics.centroid == pytest.approx((-92.995, 45.005))
+    assert metrics.bbox == pytest.approx((-93.0, 45.0, -92.99, 45.01))
+
+
+def test_empty_boundary():
+    assert boundary_metrics(BOUNDARIES[2]) == EMPTY
+
+
+@pytest.mark.skipif(geometry.np is None, reason='needs numpy')
+def test_vectorised_matches_pure_python():
+    for vectorised, expected in zip(compute(BOUNDARIES),
+                                    map(boundary_metrics, BOUNDARIES)):
+        if expected == EMPTY:
+            assert vectorised == EMPTY
+            continue
+        assert vectorised.area == pytest.approx(expected.area, abs=1e-6)
+        assert vectorised.centroid == pytest.approx(expected.centroid)
+        assert vectorised.bbox == pytest.approx(expected.bbox)
+
+
+def test_cache_skips_missing_boundaries():
+    cache = GeometryCache()
+    assert cache.get('boundary-1', None) is None
+    metrics = cache.get('boundary-1', BOUNDARIES[0])
+    assert cache.get('boundary-1', None) == metrics
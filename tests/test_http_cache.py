@@ -0,0 +1,77 @@
+import datetime
+import os
+import re
+import sqlite3
+import stat
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import climate
+from http_cache import ValidatorCache
+
+CONTENTS = bytes(range(256)) * 8
+ETAG = '"contents-v1"'
+
+
+class RangeSession:
+    """
+    Serves CONTENTS by range with one ETag for the whole entity, answering
+    304 to any request whose If-None-Match matches it, as a server would.
+    """
+
+    def __init__(self):
+        self.conditional = 0
+
+    def request(self, method, uri, headers=None, **kwargs):
+        headers = CaseInsensitiveDict(headers or {})
+        res = requests.Response()
+        res.url = uri
+        res.request = requests.Request(method, uri).prepare()
+        res.elapsed = datetime.timedelta(0)
+        res.headers = CaseInsensitiveDict({'etag': ETAG})
+        if headers.get('if-none-match') == ETAG:
+            self.conditional += 1
+            res.status_code = 304
+            res._content = b''
+            return res
+        start, end = map(int, re.match(r'bytes=(\d+)-(\d+)',
+                                       headers['range']).groups())
+        res.status_code = 206
+        res._content = CONTENTS[start:end + 1]
+        res.headers['content-length'] = str(len(res._content))
+        return res
+
+
+def test_range_requests_bypass_validator_cache():
+    session = RangeSession()
+    client = climate.ClimateClient('token', 'key', session=session,
+                                   validator_cache=ValidatorCache())
+    for _ in range(2):
+        data = b''.join(client.fetch_contents(
+            'http://test/contents', client.headers(), len(CONTENTS),
+            concurrency=1, chunk_size=512))
+        assert data == CONTENTS
+    assert session.conditional == 0
+    assert client.validator_cache.stats()['memory_entries'] == 0
+
+
+def test_disk_tier_is_private_and_bounded(tmp_path):
+    path = str(tmp_path / 'responses.sqlite')
+    umask = os.umask(0o022)
+    try:
+        cache = ValidatorCache(capacity=1, path=path, disk_capacity=10)
+    finally:
+        os.umask(umask)
+    for i in range(50):
+        cache.put('key-{}'.format(i), 200, {'etag': '"{}"'.format(i)},
+                  b'body')
+    cache.close()
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    with sqlite3.connect(path) as db:
+        count = db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+    assert count <= 11
+    reopened = ValidatorCache(capacity=1, path=path)
+    assert reopened.get('key-49').body == b'body'
+    assert reopened.get('key-0') is None
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from json_stream import iter_results
+from mock_server import activity, field
+
+PAGE = {
+    'results': [field(1), activity('asPlanted', 2, 1024),
+                {'area': 12.5, 'ratio': -1.25e-3, 'count': 7,
+                 'big': 6.02E+23, 'ok': True, 'none': None,
+                 'name': 'Feld ä☃'},
+                -42, 3.0, 1e-07, 'tail'],
+    'x-next-token': '12.5'
+}
+BODY = json.dumps(PAGE, ensure_ascii=False).encode('utf-8')
+
+
+def test_number_split_after_decimal_point():
+    chunks = [b'{"results": [{"a": 1}, 12.', b'5, 3], "n": 1}']
+    assert list(iter_results(chunks)) == [{'a': 1}, 12.5, 3]
+
+
+@pytest.mark.parametrize('at', range(1, len(BODY)))
+def test_page_split_at_every_offset(at):
+    assert list(iter_results([BODY[:at], BODY[at:]])) == PAGE['results']
+
+
+def test_page_one_byte_at_a_time():
+    chunks = [BODY[i:i + 1] for i in range(len(BODY))]
+    assert list(iter_results(chunks)) == PAGE['results']
+
+
+def test_other_members_and_empty_results():
+    assert list(iter_results([b'{"n": 1.5, "results": []}'])) == []
+    assert list(iter_results([b'{}'])) == []
+    with pytest.raises(ValueError):
+        list(iter_results([b'{"results": [1, 2']))
@@ -0,0 +1,254 @@
+import gzip
+import importlib
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+import pytest
+
+import climate
+from field_catalog import FieldCatalog
+from mock_server import MockConfig, content_bytes, field, observation
+from tokens import TokenManager
+
+CONTENT_LENGTH = 300 * 1024
+USER = {'id': 'user-1', 'firstname': 'Mock', 'lastname': 'User'}
+SESSION_ID = 'test-session'
+
+
+@pytest.fixture(scope='module')
+def main(tmp_path_factory):
+    # main keeps its stores and caches under the temp directory.
+    tempfile.tempdir = str(tmp_path_factory.mktemp('main'))
+    try:
+        return importlib.import_module('main')
+    finally:
+        tempfile.tempdir = None
+
+
+@pytest.fixture
+def mock_config():
+    return MockConfig(content_length=CONTENT_LENGTH)
+
+
+@pytest.fixture
+def client(main, server):
+    tokens = TokenManager(main.CLIMATE_API_ID, main.CLIMATE_API_SECRET,
+                          user_id=USER['id'], store=main.token_store)
+    tokens.update({'access_token': 'access', 'refresh_token': 'refresh',
+                   'user': USER})
+    main._token_managers[USER['id']] = tokens
+    main.session_store.set(SESSION_ID, user_id=USER['id'], user=USER)
+    with main.app.test_client() as client:
+        with client.session_transaction() as session:
+            session['sid'] = SESSION_ID
+        yield client
+    main.session_store.delete(SESSION_ID)
+    shutil.rmtree(main.download_spool.directory)
+    os.makedirs(main.download_spool.directory, mode=0o700)
+
+
+def wait_spooled(spool):
+    deadline = time.monotonic() + 5
+    while spool.stats()['files'] == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def contents_uri(activity_id='asPlanted-1'):
+    return '/layers/asPlanted/{}/contents?length={}'.format(
+        activity_id, CONTENT_LENGTH)
+
+
+def test_contents_miss_is_streamed(main, client):
+    res = client.get(contents_uri())
+
+    assert res.status_code == 200
+    assert res.data == content_bytes(0, CONTENT_LENGTH)
+    assert res.headers['Content-Length'] == str(CONTENT_LENGTH)
+    assert res.headers['Content-Disposition'] == \
+        'attachment; filename=data.zip'
+
+
+def test_spooled_contents_are_sent_from_the_file(main, client):
+    client.get(contents_uri())
+    wait_spooled(main.download_spool)
+
+    res = client.get(contents_uri())
+
+    assert res.status_code == 200
+    assert res.data == content_bytes(0, CONTENT_LENGTH)
+    assert res.headers['Content-Length'] == str(CONTENT_LENGTH)
+    assert 'X-Sendfile' not in res.headers
+
+
+def test_spooled_contents_use_x_sendfile(main, client, monkeypatch):
+    client.get(contents_uri())
+    wait_spooled(main.download_spool)
+    monkeypatch.setitem(main.app.config, 'USE_X_SENDFILE', True)
+
+    res = client.get(contents_uri())
+
+    assert res.status_code == 200
+    assert res.data == b''
+    path = res.headers['X-Sendfile']
+    assert os.path.dirname(path) == main.download_spool.directory
+    assert os.path.getsize(path) == CONTENT_LENGTH
+    assert res.headers['Content-Length'] == str(CONTENT_LENGTH)
+    assert res.headers['Content-Type'] == 'application/zip'
+    assert res.headers['Content-Disposition'] == \
+        'attachment; filename=data.zip'
+
+
+def test_evicted_contents_are_downloaded_again(main, client, monkeypatch):
+    monkeypatch.setattr(main.download_spool, 'path', lambda key, length:
+                        os.path.join(main.download_spool.directory, 'gone'))
+
+    res = client.get(contents_uri())
+
+    assert res.status_code == 200
+    assert res.data == content_bytes(0, CONTENT_LENGTH)
+    assert res.headers['Content-Length'] == str(CONTENT_LENGTH)
+
+
+def test_response_cache_is_private_and_bounded(main):
+    cache = climate._client_options['validator_cache']
+    assert cache.disk_capacity
+    assert stat.S_IMODE(os.stat(main.responses_directory).st_mode) == 0o700
+    for name in os.listdir(main.responses_directory):
+        path = os.path.join(main.responses_directory, name)
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_boundary_cache_is_private_and_bounded(main):
+    assert main.boundary_cache.disk_capacity
+    directory = main.boundaries_directory
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_field_store_is_private(main):
+    assert stat.S_IMODE(os.stat(main.fields_directory).st_mode) == 0o700
+    path = os.path.join(main.fields_directory, 'fields.sqlite')
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_download_spool_is_private(main):
+    directory = main.download_spool.directory
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+
+def test_pool_is_sized_for_the_app_concurrency(main):
+    assert climate._client_options['pool_size'] == \
+        main.REQUEST_THREADS * climate.DOWNLOAD_CONCURRENCY + \
+        main.PREFETCH_WORKERS * climate.BOUNDARY_CONCURRENCY
+
+
+def test_metrics_route(main, client):
+    client.get(contents_uri())
+
+    res = client.get('/metrics')
+
+    assert res.status_code == 200
+    assert res.mimetype == 'text/plain'
+    assert 'climate_api_requests_total{endpoint="contents",' \
+        in res.get_data(as_text=True)
+
+
+def test_pages_are_compressed(main, client):
+    client.get(contents_uri())
+    plain = client.get('/metrics')
+    assert len(plain.data) >= main.compression.MIN_SIZE
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['Vary'] == 'Accept-Encoding'
+
+    res = client.get('/metrics', headers={'Accept-Encoding': 'gzip'})
+
+    assert res.headers['Content-Encoding'] == 'gzip'
+    assert res.headers['Vary'] == 'Accept-Encoding'
+    assert int(res.headers['Content-Length']) == len(res.data)
+    assert len(res.data) < len(plain.data)
+    assert gzip.decompress(res.data) == plain.data
+
+
+def test_downloads_are_not_compressed(main, client):
+    res = client.get(contents_uri(), headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in res.headers
+    assert res.data == content_bytes(0, CONTENT_LENGTH)
+
+
+def test_refresh_token_route(main, client):
+    tokens = main._token_managers[USER['id']]
+
+    res = client.get('/refresh-token')
+
+    assert res.status_code == 302
+    assert res.headers['Location'].endswith('/home')
+    assert tokens.access_token != 'access'
+    assert tokens.refresh_token != 'refresh'
+    assert main.token_store.load(USER['id'])['refresh_token'] == \
+        tokens.refresh_token
+    assert tokens.get_access_token() == tokens.access_token
+
+
+def test_refresh_token_route_adopts_a_concurrent_refresh(main, client):
+    tokens = main._token_managers[USER['id']]
+    # Another worker process refreshed first and saved its tokens.
+    main.token_store.save(USER['id'], 'access-2', 'refresh-2',
+                          time.time() + 3600)
+
+    res = client.get('/refresh-token')
+
+    assert res.status_code == 302
+    assert (tokens.access_token, tokens.refresh_token) == \
+        ('access-2', 'refresh-2')
+
+
+def test_refresh_through_a_stored_manager_keeps_the_user(main, client):
+    # This worker has not seen the user yet: its manager is loaded from the
+    # store, without user data. Then another worker refreshes.
+    del main._token_managers[USER['id']]
+    assert main.token_manager(USER['id']).user is None
+    main.token_store.save(USER['id'], 'access-2', 'refresh-2',
+                          time.time() + 3600)
+
+    client.get('/refresh-token')
+
+    assert main.token_manager(USER['id']).access_token == 'access-2'
+    assert main.session_store.get(SESSION_ID, 'user') == USER
+    assert b'Log In with FieldView' not in client.get('/home').data
+
+
+def test_boundaries_are_prefetched_in_the_background(main, client,
+                                                     monkeypatch):
+    tokens = main._token_managers[USER['id']]
+    catalog = FieldCatalog([field(i) for i in range(500, 520)])
+    get_boundaries = climate.get_boundaries
+    calls = []
+
+    def slow_get_boundaries(*args, **kwargs):
+        calls.append(args)
+        time.sleep(0.1)
+        return get_boundaries(*args, **kwargs)
+
+    monkeypatch.setattr(climate, 'get_boundaries', slow_get_boundaries)
+    monkeypatch.setitem(main._spatial_indexes, USER['id'], None)
+
+    main.prefetch_boundaries(tokens, catalog)
+    # A prefetch already running for the user is not started again.
+    main.prefetch_boundaries(tokens, catalog)
+    deadline = time.monotonic() + 5
+    while main._spatial_indexes[USER['id']] is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    assert len(calls) == 1
+    assert all(f.boundary_id in main.boundary_cache for f in catalog)
+    index = main._spatial_indexes[USER['id']]
+    location = observation(510)['location']['coordinates']
+    assert index.locate(*location) == ['field-510']
@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+import climate
+import metrics
+from metrics import LATENCY_BUCKETS, Metrics
+from mock_server import MockConfig
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = Metrics()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    return registry
+
+
+def test_counts_statuses_and_bytes():
+    m = Metrics()
+    m.record('fields', 200, 100, 2000, 0.02)
+    m.record('fields', 206, None, 1000, 0.03)
+    m.record('fields', 0, 100, None, 0.5)
+
+    snapshot = m.snapshot()['fields']
+    assert snapshot['count'] == 3
+    assert snapshot['statuses'] == {200: 1, 206: 1, 0: 1}
+    assert snapshot['sent'] == 200
+    assert snapshot['received'] == 3000
+
+
+def test_quantiles_interpolate_within_buckets():
+    m = Metrics()
+    assert m.snapshot() == {}
+    for _ in range(50):
+        m.record('fields', 200, 0, 0, 0.004)
+    for _ in range(50):
+        m.record('fields', 200, 0, 0, 0.08)
+
+    latency = m.snapshot()['fields']['latency']
+    # Half the calls are in the first bucket, so p50 is its upper bound.
+    assert latency[0.5] == pytest.approx(0.005)
+    # p95 lies 90% of the way through the (0.05, 0.1] bucket.
+    assert latency[0.95] == pytest.approx(0.095)
+    assert latency[0.99] == pytest.approx(0.099)
+
+
+def test_slow_calls_land_in_the_overflow_bucket():
+    m = Metrics()
+    m.record('upload_stream', 204, 1, 0, 600.0)
+
+    assert m.snapshot()['upload_stream']['latency'][0.5] == \
+        LATENCY_BUCKETS[-1]
+    assert 'climate_api_request_duration_seconds_bucket' \
+        '{endpoint="upload_stream",le="+Inf"} 1' in m.prometheus()
+
+
+def test_prometheus_exposition():
+    m = Metrics()
+    m.record('fields', 200, 10, 20, 0.02)
+    m.record('boundaries', 404, 5, 0, 0.2)
+    m.record('fields', 200, 10, 30, 0.3)
+
+    lines = m.prometheus().splitlines()
+    assert 'climate_api_requests_total{endpoint="fields",status="200"} 2' \
+        in lines
+    assert 'climate_api_requests_total' \
+        '{endpoint="boundaries",status="404"} 1' in lines
+    assert 'climate_api_sent_bytes_total{endpoint="fields"} 20' in lines
+    assert 'climate_api_received_bytes_total{endpoint="fields"} 50' \
+        in lines
+    assert 'climate_api_request_duration_seconds_count' \
+        '{endpoint="fields"} 2' in lines
+    # Buckets are cumulative.
+    assert 'climate_api_request_duration_seconds_bucket' \
+        '{endpoint="fields",le="0.025"} 1' in lines
+    assert 'climate_api_request_duration_seconds_bucket' \
+        '{endpoint="fields",le="0.5"} 2' in lines
+    # Endpoints are rendered in name order.
+    assert lines.index('climate_api_sent_bytes_total'
+                       '{endpoint="boundaries"} 5') < \
+        lines.index('climate_api_sent_bytes_total{endpoint="fields"} 20')
+
+
+def test_concurrent_records_are_not_lost():
+    m = Metrics()
+
+    def record(i):
+        for _ in range(1000):
+            m.record('endpoint-{}'.format(i % 2), 200, 1, 1, 0.01)
+
+    threads = [threading.Thread(target=record, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    snapshot = m.snapshot()
+    assert snapshot['endpoint-0']['count'] == 4000
+    assert snapshot['endpoint-1']['sent'] == 4000
+
+
+@pytest.mark.parametrize('mock_config', [MockConfig(fields=25, page_size=10)])
+def test_client_calls_are_recorded(registry, server):
+    with climate.ClimateClient('token', 'key') as client:
+        assert len(client.get_fields()) == 25
+
+    fields = registry.snapshot()['fields']
+    assert fields['count'] == 3
+    assert fields['statuses'] == {206: 2, 200: 1}
+    assert fields['received'] > 0
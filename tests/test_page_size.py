@@ -0,0 +1,48 @@
+import pytest
+import requests
+
+import climate
+from mock_server import MockConfig
+from page_size import AdaptivePageSize
+from resilience import CircuitBreakers
+
+ACTIVITIES = 50
+
+
+@pytest.fixture
+def mock_config():
+    return MockConfig(activities=ACTIVITIES)
+
+
+@pytest.fixture
+def pages(monkeypatch):
+    """
+    Records (x-limit, timeout) of every page request, and times out the
+    ones asking for more than 10 records.
+    """
+    sent = []
+    send = requests.Session.send
+
+    def slow_large_pages(self, request, **kwargs):
+        limit = int(request.headers['x-limit'])
+        sent.append((limit, kwargs['timeout']))
+        if limit > 10:
+            raise requests.ReadTimeout('page of {} timed out'.format(limit))
+        return send(self, request, **kwargs)
+
+    monkeypatch.setattr(requests.Session, 'send', slow_large_pages)
+    return sent
+
+
+def test_timed_out_page_shrinks_the_limit(server, pages):
+    limit = AdaptivePageSize(initial=40, target_latency=60, timeout=7)
+    with climate.ClimateClient('token', 'key',
+                               breakers=CircuitBreakers()) as client:
+        activities = list(client.iter_activities('asPlanted', limit=limit))
+
+    assert len(activities) == ACTIVITIES
+    # Not retried at the same size while the limit can still shrink.
+    assert [size for size, _ in pages[:3]] == [40, 20, 10]
+    assert all(timeout == (climate.CONNECT_TIMEOUT, 7)
+               for _, timeout in pages)
+    assert max(size for size, _ in pages[3:]) <= 20
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import stat
+import time
+
+import pytest
+
+from climate_async import AsyncClimateClient
+from mock_server import MockConfig
+from rate_limit import FileTokenBucket, RateLimiter, TokenBucket
+
+
+def test_bucket_allows_burst_then_paces():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.02)
+    # Reserved tokens are paid back in turn.
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.02)
+
+
+def test_file_bucket_is_shared_through_its_file(tmp_path):
+    path = str(tmp_path / 'fields.bucket')
+    first = FileTokenBucket(path, rate=10, burst=2)
+    second = FileTokenBucket(path, rate=10, burst=2)
+    assert first.reserve() == 0
+    assert second.reserve() == 0
+    assert first.reserve() == pytest.approx(0.1, abs=0.02)
+
+
+def test_limiter_uses_the_bucket_of_the_endpoint_family(tmp_path):
+    limiter = RateLimiter({'fields': (10, 1)}, directory=str(tmp_path),
+                          key='api-key')
+    assert limiter.reserve('fields') == 0
+    assert limiter.reserve('boundaries') > 0
+    assert limiter.reserve('contents') == 0
+    started = time.monotonic()
+    limiter.acquire('fields')
+    assert time.monotonic() - started >= 0.1
+
+
+@pytest.mark.parametrize('contents', ['', 'garbage', '1 2 3', 'nan 1',
+                                      '-1e12 0', '0 1e15'])
+def test_corrupt_bucket_file_resets_the_bucket(tmp_path, contents):
+    path = tmp_path / 'fields.bucket'
+    path.write_text(contents)
+    bucket = FileTokenBucket(str(path), rate=10, burst=2)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.02)
+
+
+def test_bucket_file_is_private_and_not_followed(tmp_path):
+    target = tmp_path / 'target'
+    target.write_text('keep')
+    os.symlink(str(target), str(tmp_path / 'linked.bucket'))
+
+    with pytest.raises(OSError):
+        FileTokenBucket(str(tmp_path / 'linked.bucket'), 10, 2).reserve()
+    assert target.read_text() == 'keep'
+
+    path = str(tmp_path / 'fields.bucket')
+    FileTokenBucket(path, 10, 2).reserve()
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_limiter_directory_is_private(tmp_path):
+    directory = str(tmp_path / 'limits')
+    os.makedirs(directory, mode=0o755)
+    RateLimiter({'fields': (10, 1)}, directory=directory)
+
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+
+@pytest.fixture
+def mock_config():
+    return MockConfig(fields=50, page_size=10)
+
+
+def test_async_client_waits_without_blocking_the_loop(server, monkeypatch):
+    monkeypatch.setattr(time, 'sleep', None)
+    limiter = RateLimiter({'fields': (50, 1)})
+
+    async def main():
+        ticks = 0
+        done = False
+
+        async def tick():
+            nonlocal ticks
+            while not done:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticker = asyncio.ensure_future(tick())
+        started = time.monotonic()
+        async with AsyncClimateClient('token', 'key',
+                                      rate_limiter=limiter) as client:
+            fields = await client.get_fields()
+        elapsed = time.monotonic() - started
+        done = True
+        await ticker
+        return fields, elapsed, ticks
+
+    fields, elapsed, ticks = asyncio.run(main())
+    assert len(fields) == 50
+    # Five pages through a bucket of one token refilled 50 times a second.
+    assert elapsed >= 4 / 50
+    assert ticks >= 5
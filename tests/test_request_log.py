@@ -0,0 +1,94 @@
+import logging
+
+import pytest
+import requests
+
+import climate
+import request_log
+from mock_server import MockConfig
+from request_log import (REDACTED, log_request, redacted_curl,
+                         set_sample_rate)
+
+
+@pytest.fixture(autouse=True)
+def rates(monkeypatch):
+    monkeypatch.setattr(request_log, 'sample_rates', {})
+
+
+def records(caplog):
+    return [r.request for r in caplog.records if hasattr(r, 'request')]
+
+
+def test_compact_record(caplog):
+    caplog.set_level(logging.INFO, logger='tests')
+
+    log_request('fields', 'GET', 'https://host/v4/fields?x=1', 206, None,
+                1234, 0.01234)
+
+    assert records(caplog) == [{
+        'endpoint': 'fields', 'method': 'GET', 'path': '/v4/fields',
+        'status': 206, 'sent': None, 'received': 1234, 'duration_ms': 12.3}]
+    assert caplog.messages == \
+        ['fields GET /v4/fields 206 sent=None received=1234 12.3ms']
+
+
+def test_nothing_is_logged_below_info(caplog):
+    caplog.set_level(logging.WARNING, logger='tests')
+
+    log_request('fields', 'GET', 'https://host/v4/fields', 500, None, 0, 0)
+
+    assert caplog.records == []
+
+
+def test_successful_calls_are_sampled(caplog, monkeypatch):
+    caplog.set_level(logging.INFO, logger='tests')
+    set_sample_rate('contents', 0.25)
+    draws = iter([0.1, 0.3, 0.2, 0.9])
+    monkeypatch.setattr(request_log.random, 'random', lambda: next(draws))
+
+    for _ in range(4):
+        log_request('contents', 'GET', 'https://host/c', 206, None, 1, 0)
+    # Errors and unsampled endpoints are always logged.
+    log_request('contents', 'GET', 'https://host/c', 416, None, 1, 0)
+    log_request('fields', 'GET', 'https://host/f', 200, None, 1, 0)
+
+    assert [(r['endpoint'], r['status']) for r in records(caplog)] == \
+        [('contents', 206), ('contents', 206), ('contents', 416),
+         ('fields', 200)]
+
+
+def prepared(body=None, **headers):
+    return requests.Request('POST', 'https://host/v4/uploads',
+                            headers=headers, data=body).prepare()
+
+
+def test_curl_redacts_credentials():
+    curl = redacted_curl(prepared(b'{}', Authorization='Bearer secret',
+                                  **{'X-Api-Key': 'k3y'}), 'uploads')
+
+    assert 'secret' not in curl and 'k3y' not in curl
+    assert curl.count(REDACTED) == 2
+    assert "-d '{}'" in curl
+
+
+def test_curl_drops_token_and_large_bodies():
+    token = prepared('refresh_token=secret')
+    assert 'secret' not in redacted_curl(token, 'token')
+    # The original request is left alone.
+    assert token.body == 'refresh_token=secret'
+
+    chunk = redacted_curl(prepared(b'x' * 5000), 'upload_chunk')
+    assert '<5000 bytes>' in chunk and 'xxx' not in chunk
+
+
+@pytest.mark.parametrize('mock_config', [MockConfig(fields=3)])
+def test_client_calls_are_logged_with_curl_at_debug(caplog, server):
+    caplog.set_level(logging.DEBUG, logger='tests')
+    with climate.ClimateClient('secret', 'key') as client:
+        client.get_fields()
+
+    assert records(caplog)[0]['path'] == '/v4/fields'
+    assert records(caplog)[0]['status'] == 200
+    curl = [m for m in caplog.messages if m.startswith('curl')]
+    assert len(curl) == 1
+    assert 'secret' not in curl[0] and REDACTED in curl[0]
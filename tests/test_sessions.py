@@ -0,0 +1,79 @@
+import threading
+import time
+
+import pytest
+
+from sessions import MemorySessionStore, SQLiteSessionStore
+
+TTL = 0.2
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemorySessionStore(ttl=TTL)
+    return SQLiteSessionStore(str(tmp_path / 'sessions.sqlite'), ttl=TTL)
+
+
+def test_set_get_and_delete(store):
+    store.set('session-1', user_id='user-1', user={'id': 'user-1'})
+    store.set('session-2', user_id='user-2')
+    store.set('session-1', user=None)
+
+    assert store.get('session-1', 'user_id') == 'user-1'
+    assert store.get('session-1', 'user') is None
+    assert store.get('session-2', 'user_id') == 'user-2'
+    store.delete('session-1')
+    assert store.get('session-1', 'user_id') is None
+    assert store.get('session-2', 'user_id') == 'user-2'
+
+
+def test_unused_session_expires(store):
+    store.set('session-1', user_id='user-1')
+    time.sleep(TTL * 1.5)
+
+    assert store.get('session-1', 'user_id') is None
+    # Values of an expired session do not come back with a new write.
+    store.set('session-1', user='new')
+    assert store.get('session-1', 'user_id') is None
+    assert store.get('session-1', 'user') == 'new'
+
+
+def test_reads_keep_a_session_alive(store):
+    store.set('session-1', user_id='user-1')
+    for _ in range(6):
+        time.sleep(TTL / 3)
+        assert store.get('session-1', 'user_id') == 'user-1'
+
+
+def test_expired_sessions_are_swept(store):
+    for i in range(10):
+        store.set('session-{}'.format(i), user_id=i)
+    time.sleep(TTL * 1.5)
+    store.set('session-live', user_id='live')
+
+    assert store.sweep() == 0
+    assert store.get('session-live', 'user_id') == 'live'
+    if isinstance(store, SQLiteSessionStore):
+        count = store._db().execute(
+            'SELECT COUNT(*) FROM sessions').fetchone()[0]
+    else:
+        count = len(store._sessions)
+    assert count == 1
+
+
+def test_concurrent_writers(store):
+    # The writes can outlast TTL on a slow disk.
+    store.ttl = 60
+
+    def write(i):
+        for j in range(50):
+            store.set('session-{}'.format(i), count=j)
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [store.get('session-{}'.format(i), 'count')
+            for i in range(8)] == [49] * 8
@@ -0,0 +1,120 @@
+import math
+import random
+
+import pytest
+
+from field_catalog import FieldRecord
+from mock_server import boundary, observation
+from spatial_index import SpatialIndex, _edges, _inside, _orientation, \
+    polygons
+
+
+def star(cx, cy, radius, points=7):
+    """
+    A concave star-shaped ring spanning several grid cells.
+    """
+    ring = []
+    for i in range(points * 2):
+        r = radius if i % 2 == 0 else radius / 2.5
+        a = math.pi * i / points
+        ring.append([cx + r * math.cos(a), cy + r * math.sin(a)])
+    return ring + [ring[0]]
+
+
+def square(x, y, size):
+    return [[x, y], [x + size, y], [x + size, y + size], [x, y + size],
+            [x, y]]
+
+
+SHAPES = {
+    'star': {'type': 'Polygon', 'coordinates': [star(-93.0, 41.0, 0.03)]},
+    'holed': {'type': 'Feature', 'geometry': {
+        'type': 'Polygon',
+        'coordinates': [square(-92.95, 40.98, 0.04),
+                        square(-92.94, 40.99, 0.02)]}},
+    'multi': {'type': 'MultiPolygon', 'coordinates': [
+        [square(-93.05, 41.03, 0.012)], [square(-93.03, 41.05, 0.007)]]},
+}
+
+
+def brute_force(x, y):
+    return sorted(key for key, shape in SHAPES.items()
+                  if _inside(x, y, list(_edges(
+                      [r for p in polygons(shape) for r in p]))))
+
+
+@pytest.fixture
+def index():
+    index = SpatialIndex()
+    for key, shape in SHAPES.items():
+        index.put(key, shape)
+    return index
+
+
+def test_locate_matches_brute_force(index):
+    rng = random.Random(7)
+    points = [(rng.uniform(-93.06, -92.9), rng.uniform(40.96, 41.06))
+              for _ in range(5000)]
+    located = [sorted(index.locate(x, y)) for x, y in points]
+
+    assert located == [brute_force(x, y) for x, y in points]
+    assert index.assign(points) == [keys[0] if keys else None
+                                    for keys in located]
+    assert any(located) and not all(located)
+
+
+def test_hole_is_outside(index):
+    assert index.locate(-92.93, 41.0) == []
+    assert index.locate(-92.945, 40.985) == ['holed']
+
+
+def test_intersecting_boxes(index):
+    assert index.intersecting(-92.96, 40.97, -92.92, 41.0) == {'holed'}
+    assert index.intersecting(-180, -90, 180, 90) == set(SHAPES)
+    assert index.intersecting(0, 0, 1, 1) == set()
+
+
+def test_sync_follows_the_fields(index):
+    fields = [FieldRecord('field-{}'.format(i), None,
+                          'boundary-{}'.format(i)) for i in range(3)]
+    boundaries = {f.boundary_id: boundary(f.boundary_id) for f in fields}
+    index = SpatialIndex()
+    index.sync(fields, boundaries)
+    assert len(index) == 3
+    assert index.version('field-1') == 'boundary-1'
+    location = observation(1)['location']['coordinates']
+    assert index.locate(*location) == ['field-1']
+
+    # field-1 moves to boundary-5, field-2 is deleted.
+    fields = [fields[0], FieldRecord('field-1', None, 'boundary-5')]
+    index.sync(fields, {'boundary-5': boundary('boundary-5')})
+    assert 'field-2' not in index
+    assert index.version('field-1') == 'boundary-5'
+    assert index.locate(*location) == []
+    assert index.locate(*observation(5)['location']['coordinates']) == \
+        ['field-1']
+
+    index.remove('field-1')
+    assert len(index) == 1
+
+
+def test_cell_center_on_a_vertex():
+    # Coordinates rounded to 0.0025: the center of cell (3, 3) is the
+    # vertex (0.0175, 0.0175), so it cannot be the cell's reference point.
+    ring = [[0.0475, 0.015], [0.0225, 0.0425], [0.0175, 0.0175],
+            [0.025, -0.0025]]
+    shape = {'type': 'Polygon', 'coordinates': [ring]}
+    index = SpatialIndex()
+    index.put('field', shape)
+    edges = list(_edges(polygons(shape)[0]))
+
+    assert not _inside(0.0175, 0.015, edges)
+    assert index.locate(0.0175, 0.015) == []
+    rng = random.Random(3)
+    for _ in range(2000):
+        x, y = round(rng.uniform(0.01, 0.05), 4), \
+            round(rng.uniform(-0.005, 0.045), 4)
+        if any(_orientation(x1, y1, x2, y2, x, y) == 0
+               for (x1, y1), (x2, y2) in edges):
+            continue
+        assert (index.locate(x, y) == ['field']) == _inside(x, y, edges)
@@ -0,0 +1,27 @@
+import os
+import stat
+
+from sqlite_lru import SQLiteLRU
+
+COLUMNS = [('status', 'INTEGER'), ('body', 'BLOB')]
+
+
+def test_put_replaces_and_counts_once(tmp_path):
+    lru = SQLiteLRU(str(tmp_path / 'lru.sqlite'), 'entries', 'key', COLUMNS,
+                    capacity=10)
+    lru.put('a', (200, b'one'))
+    lru.put('a', (206, b'two'))
+
+    assert lru.get('a') == (206, b'two')
+    assert lru.get('b') is None
+    assert 'a' in lru and 'b' not in lru
+    assert lru._count == 1
+    lru.close()
+    assert lru.get('a') is None
+
+
+def test_private_file(tmp_path):
+    path = str(tmp_path / 'lru.sqlite')
+    SQLiteLRU(path, 'entries', 'key', COLUMNS, private=True).close()
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
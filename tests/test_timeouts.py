@@ -0,0 +1,46 @@
+import pytest
+import requests
+
+import climate
+from mock_server import MockConfig
+from resilience import CircuitBreakers, CircuitOpenError, RetryPolicy
+
+
+@pytest.fixture
+def mock_config():
+    return MockConfig(latency=0.5)
+
+
+@pytest.fixture
+def timeouts(monkeypatch):
+    sent = []
+    send = requests.Session.send
+
+    def recording_send(self, request, **kwargs):
+        sent.append(kwargs['timeout'])
+        return send(self, request, **kwargs)
+
+    monkeypatch.setattr(requests.Session, 'send', recording_send)
+    return sent
+
+
+def test_timeout_is_retried_and_opens_the_breaker(server, timeouts):
+    breakers = CircuitBreakers(failure_threshold=2)
+    with climate.ClimateClient(
+            'token', 'key', breakers=breakers, timeout=(1, 0.05),
+            retry_policy=RetryPolicy(retries=1, base_delay=0)) as client:
+        with pytest.raises(requests.Timeout):
+            client.get_fields()
+        with pytest.raises(CircuitOpenError):
+            client.get_fields()
+
+    assert timeouts == [(1, 0.05)] * 2
+    assert breakers.states() == {'fields': 'open'}
+
+
+def test_default_timeout_is_sent(server, timeouts):
+    server.config.latency = 0
+    with climate.ClimateClient('token', 'key',
+                               breakers=CircuitBreakers()) as client:
+        assert len(client.get_fields()) == server.config.fields
+    assert timeouts[0] == (climate.CONNECT_TIMEOUT, climate.READ_TIMEOUT)
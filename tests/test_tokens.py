@@ -0,0 +1,119 @@
+import os
+import stat
+import threading
+import time
+
+from tokens import TokenManager, TokenStore
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_tokens_are_saved_per_user(tmp_path):
+    store = TokenStore(str(tmp_path / 'tokens'))
+    store.save('user-1', 'access-1', 'refresh-1', 100.0)
+    store.save('user-2', 'access-2', 'refresh-2', 200.0)
+
+    assert store.load('user-1') == {'access_token': 'access-1',
+                                    'refresh_token': 'refresh-1',
+                                    'expires_at': 100.0}
+    assert store.load('user-2')['refresh_token'] == 'refresh-2'
+    assert store.load('user-3') is None
+    assert len(os.listdir(store.directory)) == 2
+
+
+def test_tokens_are_private(tmp_path):
+    directory = tmp_path / 'tokens'
+    directory.mkdir(mode=0o755)
+    store = TokenStore(str(directory))
+    store.save('user-1', 'access', 'refresh', 100.0)
+
+    assert mode(store.directory) == 0o700
+    for name in os.listdir(store.directory):
+        assert mode(os.path.join(store.directory, name)) == 0o600
+
+
+def test_concurrent_saves_leave_one_complete_file(tmp_path):
+    store = TokenStore(str(tmp_path / 'tokens'))
+
+    def save(i):
+        for j in range(20):
+            store.save('user-1', 'access', 'refresh-{}'.format(i), j)
+
+    threads = [threading.Thread(target=save, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store.load('user-1')['expires_at'] == 19
+    assert len(os.listdir(store.directory)) == 1
+
+
+class TokenEndpoint:
+    """
+    Stand-in for climate.reauthorize that only accepts the last refresh
+    token it issued.
+    """
+
+    def __init__(self, expires_in=4 * 60 * 60):
+        self.expires_in = expires_in
+        self.issued = 0
+        self.calls = []
+
+    def __call__(self, refresh_token, client_id, client_secret):
+        self.calls.append(refresh_token)
+        if refresh_token != 'refresh-{}'.format(self.issued):
+            return None
+        self.issued += 1
+        return {'access_token': 'access-{}'.format(self.issued),
+                'refresh_token': 'refresh-{}'.format(self.issued),
+                'expires_in': self.expires_in}
+
+
+def managers(tmp_path, endpoint, count=2):
+    store = TokenStore(str(tmp_path / 'tokens'))
+    store.save('user-1', 'access-0', 'refresh-0', 0)
+    return [TokenManager('id', 'secret', user_id='user-1', store=store,
+                         reauthorize=endpoint) for _ in range(count)]
+
+
+def test_refresh_uses_token_saved_by_another_process(tmp_path):
+    endpoint = TokenEndpoint()
+    first, second = managers(tmp_path, endpoint)
+
+    assert first.get_access_token() == 'access-1'
+    assert second.refresh('access-0')
+    assert second.access_token == 'access-1'
+    assert endpoint.calls == ['refresh-0']
+
+
+def test_refresh_continues_from_newer_saved_refresh_token(tmp_path):
+    endpoint = TokenEndpoint(expires_in=0)
+    first, second = managers(tmp_path, endpoint)
+
+    assert first.get_access_token() == 'access-1'
+    assert second.get_access_token() == 'access-2'
+    assert endpoint.calls == ['refresh-0', 'refresh-1']
+    assert first.store.load('user-1')['refresh_token'] == 'refresh-2'
+
+
+def test_no_second_refresh_after_a_torn_read(tmp_path):
+    endpoint = TokenEndpoint()
+    manager = TokenManager('id', 'secret', reauthorize=endpoint)
+    # What a reader sees while update() is between setting access_token and
+    # expires_at: the new token with the old expiry.
+    manager.access_token, manager.refresh_token = 'access-1', 'refresh-0'
+    manager.expires_at = 0
+    results = []
+    with manager._lock:
+        reader = threading.Thread(
+            target=lambda: results.append(manager.get_access_token()))
+        reader.start()
+        reader.join(0.1)
+        manager.expires_at = time.time() + 3600
+    reader.join(5)
+
+    assert results == ['access-1']
+    assert endpoint.calls == []
@@ -0,0 +1,253 @@
+import io
+import os
+import stat
+import threading
+import time
+
+import pytest
+
+import climate
+from climate import CHUNK_SIZE
+from file import md5_and_length
+from uploads import UploadProgress, UploadStatusPoller
+
+CONTENT_TYPE = 'application/zip'
+DATA = bytes(range(256)) * (CHUNK_SIZE // 256 + 4096)
+
+
+@pytest.fixture
+def client():
+    with climate.ClimateClient('token', 'key') as client:
+        yield client
+
+
+@pytest.fixture
+def progress(tmp_path):
+    return UploadProgress(str(tmp_path))
+
+
+def digest():
+    return md5_and_length(io.BytesIO(DATA))
+
+
+def test_upload_resumes_known_upload_id(server, client, progress):
+    md5, length = digest()
+    upload_id = client._create_upload(md5, length, CONTENT_TYPE)
+    progress.start(client._cache_user(), md5, length, CONTENT_TYPE,
+                   CHUNK_SIZE, upload_id)
+
+    result = client.upload(io.BytesIO(DATA), CONTENT_TYPE,
+                           progress=progress)
+
+    assert result.success
+    assert result.upload_id == upload_id
+    assert server.upload_status(upload_id)['status'] == 'SUCCESS'
+    assert progress.load(client._cache_user(), md5, length, CONTENT_TYPE,
+                         CHUNK_SIZE) == (None, set())
+
+
+def test_refused_resume_starts_a_new_upload(server, client, progress):
+    md5, length = digest()
+    progress.start(client._cache_user(), md5, length, CONTENT_TYPE,
+                   CHUNK_SIZE, 'expired-upload')
+
+    result = client.upload(io.BytesIO(DATA), CONTENT_TYPE,
+                           progress=progress)
+
+    assert result.success
+    assert result.upload_id != 'expired-upload'
+    assert server.upload_status(result.upload_id)['status'] == 'SUCCESS'
+    assert progress.load(client._cache_user(), md5, length, CONTENT_TYPE,
+                         CHUNK_SIZE) == (None, set())
+
+
+def test_progress_is_kept_per_user(progress):
+    md5, length = digest()
+    progress.start('user-1', md5, length, CONTENT_TYPE, CHUNK_SIZE,
+                   'upload-1')
+    progress.acknowledge('user-1', md5, length, CONTENT_TYPE, 0)
+
+    assert progress.load('user-1', md5, length, CONTENT_TYPE,
+                         CHUNK_SIZE) == ('upload-1', {0})
+    assert progress.load('user-2', md5, length, CONTENT_TYPE,
+                         CHUNK_SIZE) == (None, set())
+
+
+def test_acknowledging_a_finished_upload_is_ignored(progress):
+    md5, length = digest()
+    progress.start('user-1', md5, length, CONTENT_TYPE, CHUNK_SIZE,
+                   'upload-1')
+    progress.finish('user-1', md5, length, CONTENT_TYPE)
+
+    progress.acknowledge('user-1', md5, length, CONTENT_TYPE, 0)
+
+    assert progress.load('user-1', md5, length, CONTENT_TYPE,
+                         CHUNK_SIZE) == (None, set())
+
+
+def test_progress_is_private(tmp_path):
+    directory = str(tmp_path / 'progress')
+    progress = UploadProgress(directory)
+    md5, length = digest()
+    progress.start('user-1', md5, length, CONTENT_TYPE, CHUNK_SIZE,
+                   'upload-1')
+    progress.acknowledge('user-1', md5, length, CONTENT_TYPE, 0)
+
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+class FakeStatuses:
+    """
+    fetch_statuses stand-in recording its calls. Uploads in done are
+    reported as SUCCESS, the others as UPLOADING.
+    """
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.done = set()
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def __call__(self, token, upload_ids):
+        with self.lock:
+            self.calls.append((token, list(upload_ids), time.monotonic()))
+        if self.fail:
+            raise OSError('unreachable')
+        return [{'uploadId': upload_id,
+                 'status': 'SUCCESS' if upload_id in self.done
+                 else 'UPLOADING'} for upload_id in upload_ids]
+
+    def polls(self, upload_id):
+        with self.lock:
+            return [at for _, ids, at in self.calls if upload_id in ids]
+
+
+@pytest.fixture
+def poller():
+    pollers = []
+
+    def make(fetch_statuses, **kwargs):
+        pollers.append(UploadStatusPoller(fetch_statuses, **kwargs))
+        return pollers[-1]
+
+    yield make
+    for poller in pollers:
+        poller.stop()
+
+
+def test_terminal_statuses_are_not_polled(poller):
+    fetch = FakeStatuses()
+    statuses = poller(fetch, delay=0.01)
+    status = {'uploadId': 'upload-1', 'status': 'INBOX'}
+
+    statuses.track('upload-1', 'token', status)
+    statuses.track('upload-1', 'token')
+    time.sleep(0.05)
+
+    assert statuses.status('upload-1') == status
+    assert fetch.calls == []
+
+
+def test_statuses_are_only_served_to_their_owner(poller):
+    fetch = FakeStatuses()
+    statuses = poller(fetch, delay=0.01)
+    done = {'uploadId': 'upload-1', 'status': 'SUCCESS'}
+    pending = {'uploadId': 'upload-2', 'status': 'UPLOADING'}
+
+    statuses.track('upload-1', 'token', done, owner='user-1')
+    statuses.track('upload-2', 'token', pending, owner='user-1')
+
+    assert statuses.status('upload-1', owner='user-1') == done
+    assert statuses.status('upload-2', owner='user-1') == pending
+    assert statuses.status('upload-1', owner='user-2') is None
+    assert statuses.status('upload-2', owner='user-2') is None
+
+
+def test_due_uploads_are_batched_per_token(poller):
+    fetch = FakeStatuses()
+    statuses = poller(fetch, batch_size=2, delay=0.05)
+    fetch.done.update('upload-{}'.format(i) for i in range(7))
+
+    for i in range(5):
+        statuses.track('upload-{}'.format(i), 'token-1')
+    for i in range(5, 7):
+        statuses.track('upload-{}'.format(i), 'token-2')
+    wait_for(lambda: all(statuses.status('upload-{}'.format(i))
+                         for i in range(7)))
+
+    batches = sorted((token, len(ids)) for token, ids, _ in fetch.calls)
+    assert batches == [('token-1', 1), ('token-1', 2), ('token-1', 2),
+                       ('token-2', 2)]
+    assert statuses.status('upload-6') == {'uploadId': 'upload-6',
+                                           'status': 'SUCCESS'}
+
+
+def test_pending_uploads_back_off_until_done(poller):
+    fetch = FakeStatuses()
+    statuses = poller(fetch, delay=0.02, max_delay=0.08)
+
+    statuses.track('upload-1', 'token')
+    wait_for(lambda: len(fetch.polls('upload-1')) >= 5)
+    assert statuses.status('upload-1')['status'] == 'UPLOADING'
+    fetch.done.add('upload-1')
+    wait_for(lambda: statuses.status('upload-1')['status'] == 'SUCCESS')
+    polls = len(fetch.polls('upload-1'))
+    time.sleep(0.2)
+
+    assert len(fetch.polls('upload-1')) == polls
+    at = fetch.polls('upload-1')
+    gaps = [b - a for a, b in zip(at, at[1:])]
+    # 0.04, 0.08 then capped at 0.08.
+    assert gaps[0] >= 0.035
+    assert all(gap >= 0.075 for gap in gaps[1:])
+
+
+def test_failed_polls_back_off(poller):
+    fetch = FakeStatuses(fail=True)
+    statuses = poller(fetch, delay=0.02, max_delay=1.0)
+
+    statuses.track('upload-1', 'token', {'uploadId': 'upload-1',
+                                         'status': 'UPLOADING'})
+    time.sleep(0.3)
+
+    # Polled at 0.02, 0.06, 0.14 and 0.30 at the latest, not every 0.02.
+    assert 2 <= len(fetch.polls('upload-1')) <= 4
+    assert statuses.status('upload-1')['status'] == 'UPLOADING'
+
+
+def test_finished_statuses_are_bounded(poller):
+    statuses = poller(FakeStatuses(), finished_capacity=2)
+
+    for i in range(3):
+        statuses.track('upload-{}'.format(i), 'token',
+                       {'uploadId': 'upload-{}'.format(i),
+                        'status': 'SUCCESS'})
+
+    assert statuses.status('upload-0') is None
+    assert statuses.status('upload-2')['status'] == 'SUCCESS'
+
+
+def test_poller_follows_uploads_on_the_server(server, client, poller):
+    statuses = poller(lambda token, upload_ids:
+                      climate.get_upload_statuses(upload_ids, token, 'key'),
+                      delay=0.02)
+    md5, length = digest()
+    upload_id = client._create_upload(md5, length, CONTENT_TYPE)
+    statuses.track(upload_id, 'token')
+    wait_for(lambda: statuses.status(upload_id))
+    assert statuses.status(upload_id)['status'] == 'UPLOADING'
+
+    client._put_chunk('{}/v4/uploads/{}'.format(server.uri, upload_id),
+                      DATA, 0, length, retries=0)
+
+    wait_for(lambda: statuses.status(upload_id)['status'] == 'SUCCESS')
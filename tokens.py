@@ -0,0 +1,235 @@
+"""
+Token management
+
+Access tokens expire after 4 hours. A TokenManager tracks when the current
+access_token expires and refreshes it shortly before, so callers never have
+to wait for a 401. When several threads do hit a 401 at once, only the first
+one calls the token endpoint; the others wait for it and use its result.
+
+Each refresh invalidates the previous refresh token, and losing the new one
+means the user has to log in again, so refresh tokens can be persisted to a
+TokenStore which writes atomically, to files only the app's user can read.
+Worker processes sharing a store refresh a user's tokens one at a time, and
+each re-reads the store first, so a worker holding an old refresh token
+picks up the one another worker saved instead of refreshing again.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows.
+    fcntl = None
+
+import climate
+
+TOKEN_LIFETIME = 4 * 60 * 60
+REFRESH_MARGIN = 5 * 60
+
+
+class TokenStore:
+    """
+    Persists tokens in a directory only the app's user can read, one JSON
+    file per user, so saves for different users never touch the same file.
+    Every save writes a temporary file, flushes it to disk and renames it
+    over the user's file, so a crash never leaves a partly written file and
+    concurrent saves from several processes leave one of them complete.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: Directory to keep token files in. Created if
+            missing, and restricted to the owner.
+        """
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # Also applies to an existing directory; fails if someone else
+        # owns it.
+        os.chmod(directory, 0o700)
+        self.directory = directory
+
+    def load(self, user_id):
+        """
+        :return: dict with access_token, refresh_token and expires_at, or
+            None.
+        """
+        try:
+            with open(self._path(user_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, user_id, access_token, refresh_token, expires_at):
+        path = self._path(user_id)
+        tmp = '{}.{}.{}.tmp'.format(path, os.getpid(), uuid.uuid4().hex)
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'access_token': access_token,
+                'refresh_token': refresh_token,
+                'expires_at': expires_at
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @contextlib.contextmanager
+    def locked(self, user_id):
+        """
+        Holds an exclusive flock for user_id, shared by every process using
+        the same directory. Without fcntl it only yields.
+        """
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(self._path(user_id) + '.lock', os.O_RDWR | os.O_CREAT,
+                     0o600)
+        with os.fdopen(fd, 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _path(self, user_id):
+        name = hashlib.sha1(str(user_id).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.json')
+
+
+class TokenManager:
+    """
+    Holds a user's access_token and refresh_token and keeps the access_token
+    valid. Safe to share between threads. Pass it to climate.ClimateClient
+    (or the climate module functions) in place of an access_token string.
+    """
+
+    def __init__(self, client_id, client_secret, user_id=None, store=None,
+                 margin=REFRESH_MARGIN, reauthorize=None):
+        """
+        :param client_id: Provided by Climate.
+        :param client_secret: Provided by Climate.
+        :param user_id: Key of the user's tokens in store.
+        :param store: Optional TokenStore to persist tokens to.
+        :param margin: Seconds before expiry at which the access_token is
+            refreshed.
+        :param reauthorize: Function used to refresh, climate.reauthorize by
+            default.
+        """
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.user_id = user_id
+        self.store = store
+        self.margin = margin
+        self.access_token = None
+        self.refresh_token = None
+        self.expires_at = None
+        self.user = None
+        self._reauthorize = reauthorize or climate.reauthorize
+        self._lock = threading.Lock()
+        if store and user_id:
+            saved = store.load(user_id)
+            if saved:
+                self.access_token = saved['access_token']
+                self.refresh_token = saved['refresh_token']
+                self.expires_at = saved['expires_at']
+
+    def update(self, resp):
+        """
+        Takes the tokens from an authorize or reauthorize response and
+        persists them.
+        :param resp: Object containing user data, access_token,
+            refresh_token and optionally expires_in.
+        """
+        self.access_token = resp['access_token']
+        self.refresh_token = resp['refresh_token']
+        self.expires_at = time.time() + resp.get('expires_in',
+                                                 TOKEN_LIFETIME)
+        self.user = resp.get('user', self.user)
+        if self.store and self.user_id:
+            self.store.save(self.user_id, self.access_token,
+                            self.refresh_token, self.expires_at)
+
+    def get_access_token(self):
+        """
+        :return: An access_token that is not about to expire, refreshing it
+            first if needed.
+        """
+        token, expires_at = self.access_token, self.expires_at
+        if token and expires_at and time.time() < expires_at - self.margin:
+            return token
+        # Read without the lock, token and expires_at can come from two
+        # different updates; _refresh checks again under the lock.
+        self._refresh(token, expiring=True)
+        return self.access_token
+
+    def refresh(self, stale_token=None):
+        """
+        Refreshes the access_token. Calls are serialized, across processes
+        too when there is a store; when stale_token is given and another
+        thread has already replaced it, no new refresh is made and the other
+        thread's token is used. Tokens saved to the store by another
+        process since they were loaded are taken over first, and used
+        without a refresh if the access_token is still valid.
+        :param stale_token: The access_token the caller found expired or
+            rejected.
+        :return: True if a valid access_token is available.
+        """
+        return self._refresh(stale_token)
+
+    def _refresh(self, stale_token, expiring=False):
+        """
+        See refresh.
+        :param expiring: Only refresh if the access_token is about to
+            expire, as checked under the lock.
+        """
+        with self._lock:
+            if stale_token is not None and self.access_token != stale_token:
+                return self.access_token is not None
+            if expiring and self._fresh():
+                return True
+            with self._store_lock():
+                if self._load_newer() and self._fresh():
+                    return True
+                if not self.refresh_token:
+                    return False
+                resp = self._reauthorize(self.refresh_token, self.client_id,
+                                         self.client_secret)
+                if not resp:
+                    return False
+                self.update(resp)
+                return True
+
+    def _fresh(self):
+        """
+        :return: True if the access_token is not about to expire.
+        """
+        return bool(self.access_token and self.expires_at and
+                    time.time() < self.expires_at - self.margin)
+
+    def _store_lock(self):
+        if self.store and self.user_id:
+            return self.store.locked(self.user_id)
+        return contextlib.suppress()
+
+    def _load_newer(self):
+        """
+        Takes over the tokens in store if they differ from ours.
+        :return: True if they did.
+        """
+        if not (self.store and self.user_id):
+            return False
+        saved = self.store.load(self.user_id)
+        if not saved or saved['refresh_token'] == self.refresh_token:
+            return False
+        self.access_token = saved['access_token']
+        self.refresh_token = saved['refresh_token']
+        self.expires_at = saved['expires_at']
+        return True
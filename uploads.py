@@ -0,0 +1,283 @@
+"""
+Upload bookkeeping
+
+Keeps track of which chunks of an upload Climate has acknowledged so that an
+interrupted upload can resume from where it stopped instead of starting
+over, and defines the result returned by climate.upload.
+
+Uploads are processed asynchronously after they are sent. UploadStatusPoller
+follows pending uploads from a background thread until they reach a terminal
+state, asking for the status of many uploads per call.
+
+License:
+Copyright © 2018 The Climate Corporation
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple, OrderedDict
+
+from logger import Logger
+
+
+# upload_id: id returned by Climate, or None if the upload was never created.
+# success: True when every chunk was acknowledged.
+# length: total length of the file in bytes.
+# md5: md5 of the file contents.
+# sent: number of bytes acknowledged, including resumed ones.
+# failed_ranges: list of (start, end) byte ranges, end exclusive, that could
+#     not be sent.
+UploadResult = namedtuple(
+    'UploadResult',
+    ['upload_id', 'success', 'length', 'md5', 'sent', 'failed_ranges'])
+
+TERMINAL_STATUSES = ('INBOX', 'SUCCESS', 'INVALID')
+STATUS_BATCH_SIZE = 100
+POLL_DELAY = 2.0
+MAX_POLL_DELAY = 5 * 60.0
+FINISHED_CAPACITY = 10000
+
+
+def rejected(status):
+    """
+    :param status: Status of an upload chunk response.
+    :return: True if the chunk was refused for good (a 4xx other than 408
+        and 429), so sending it again would not help.
+    """
+    return 400 <= status < 500 and status not in (408, 429)
+
+
+class UploadProgress:
+    """
+    Persists the acknowledged chunk offsets of in-flight uploads, one JSON
+    file per upload in a directory. Entries are keyed by user, md5, length
+    and content type, so restarting the upload of the same file by the same
+    user finds the upload_id it was given and the offsets already sent.
+    Writes are atomic (write to a temp file, then rename) and safe to make
+    from several threads.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: Directory to keep progress files in. Created if
+            missing, and restricted to the owner.
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # Also applies to an existing directory; fails if someone else
+        # owns it.
+        os.chmod(directory, 0o700)
+
+    def _path(self, user, md5, length, content_type):
+        user = hashlib.sha1(str(user).encode('utf-8')).hexdigest()[:16]
+        name = '{}-{}-{}-{}.json'.format(user, md5, length,
+                                         content_type.replace('/', '_'))
+        return os.path.join(self.directory, name)
+
+    def load(self, user, md5, length, content_type, chunk_size):
+        """
+        Returns (upload_id, acknowledged offsets) for a previous attempt at
+        uploading the same file with the same chunk size, or (None, set()).
+        :param user: Who uploads the file, e.g. a user id.
+        """
+        path = self._path(user, md5, length, content_type)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None, set()
+        if entry.get('chunk_size') != chunk_size:
+            return None, set()
+        return entry['upload_id'], set(entry['acknowledged'])
+
+    def start(self, user, md5, length, content_type, chunk_size, upload_id):
+        """
+        Records a newly created upload with no acknowledged chunks.
+        """
+        self._write(self._path(user, md5, length, content_type), {
+            'upload_id': upload_id,
+            'chunk_size': chunk_size,
+            'acknowledged': []
+        })
+
+    def acknowledge(self, user, md5, length, content_type, position):
+        """
+        Records the chunk starting at position as acknowledged. Does nothing
+        if the upload was already finished, e.g. by a concurrent upload of
+        the same file.
+        """
+        path = self._path(user, md5, length, content_type)
+        with self._lock:
+            try:
+                with open(path) as f:
+                    entry = json.load(f)
+            except FileNotFoundError:
+                return
+            entry['acknowledged'].append(position)
+            self._write_locked(path, entry)
+
+    def finish(self, user, md5, length, content_type):
+        """
+        Forgets a completed upload, or one the server no longer accepts.
+        """
+        try:
+            os.remove(self._path(user, md5, length, content_type))
+        except FileNotFoundError:
+            pass
+
+    def _write(self, path, entry):
+        with self._lock:
+            self._write_locked(path, entry)
+
+    def _write_locked(self, path, entry):
+        tmp = '{}.{}.{}.tmp'.format(path, os.getpid(), uuid.uuid4().hex)
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+
+
+class UploadStatusPoller:
+    """
+    Polls the status of pending uploads from a background thread. Uploads
+    due for a poll are grouped by token and sent to fetch_statuses in
+    batches. Each upload has its own delay, doubled after every poll that
+    finds it still processing (or fails), and is no longer polled once it
+    reaches a terminal status. Statuses are served from the poller's cache,
+    only to the owner the upload was tracked for.
+    """
+
+    def __init__(self, fetch_statuses, batch_size=STATUS_BATCH_SIZE,
+                 delay=POLL_DELAY, max_delay=MAX_POLL_DELAY,
+                 finished_capacity=FINISHED_CAPACITY):
+        """
+        :param fetch_statuses: Function taking a token and a list of upload
+            ids and returning a list of status objects (with uploadId and
+            status), or None on failure.
+        :param batch_size: Max number of upload ids per fetch_statuses call.
+        :param delay: Seconds before the first poll of an upload.
+        :param max_delay: Longest delay between two polls of an upload.
+        :param finished_capacity: Number of terminal statuses kept.
+        """
+        self.fetch_statuses = fetch_statuses
+        self.batch_size = batch_size
+        self.delay = delay
+        self.max_delay = max_delay
+        self.finished_capacity = finished_capacity
+        # (owner, upload_id) -> [token, status, delay, next poll time]
+        self._pending = {}
+        # (owner, upload_id) -> status
+        self._finished = OrderedDict()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def track(self, upload_id, token, status=None, owner=None):
+        """
+        Starts polling an upload.
+        :param upload_id: id of the upload.
+        :param token: Token to poll with, passed on to fetch_statuses.
+        :param status: Status object already known, if any.
+        :param owner: Who may read the status, e.g. a user id.
+        """
+        key = (owner, upload_id)
+        if status and status.get('status') in TERMINAL_STATUSES:
+            self._finish(key, status)
+            return
+        with self._condition:
+            if key in self._pending:
+                self._pending[key][1] = status or self._pending[key][1]
+                return
+            if key in self._finished:
+                return
+            self._pending[key] = [token, status, self.delay,
+                                  time.monotonic() + self.delay]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def status(self, upload_id, owner=None):
+        """
+        :param owner: Who asks, as passed to track.
+        :return: The last known status object of the upload, or None if it
+            is unknown or was tracked for another owner.
+        """
+        key = (owner, upload_id)
+        with self._condition:
+            if key in self._finished:
+                return self._finished[key]
+            entry = self._pending.get(key)
+            return entry[1] if entry else None
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def _finish(self, key, status):
+        with self._condition:
+            self._pending.pop(key, None)
+            self._finished[key] = status
+            self._finished.move_to_end(key)
+            while len(self._finished) > self.finished_capacity:
+                self._finished.popitem(last=False)
+
+    def _due(self):
+        """
+        Waits until some uploads are due for a poll. Uploads that will be
+        due within half the initial delay are polled along with them, so
+        they share batches.
+        :return: dict of token to the (owner, upload_id) keys of due
+            uploads, empty once stopped.
+        """
+        with self._condition:
+            while not self._stopped:
+                now = time.monotonic()
+                wake = min((e[3] for e in self._pending.values()),
+                           default=None)
+                if wake is not None and wake <= now:
+                    due = {}
+                    for key, entry in self._pending.items():
+                        if entry[3] <= now + self.delay / 2:
+                            due.setdefault(entry[0], []).append(key)
+                    return due
+                self._condition.wait(None if wake is None else wake - now)
+            return {}
+
+    def _run(self):
+        while True:
+            due = self._due()
+            if not due:
+                return
+            for token, keys in due.items():
+                for i in range(0, len(keys), self.batch_size):
+                    self._poll(token, keys[i:i + self.batch_size])
+
+    def _poll(self, token, keys):
+        try:
+            statuses = self.fetch_statuses(token, [k[1] for k in keys])
+        except Exception as e:
+            Logger().error('Upload status poll failed: {}'.format(e))
+            statuses = None
+        by_id = {s['uploadId']: s for s in statuses or ()}
+        now = time.monotonic()
+        for key in keys:
+            status = by_id.get(key[1])
+            if status and status.get('status') in TERMINAL_STATUSES:
+                self._finish(key, status)
+                continue
+            with self._condition:
+                entry = self._pending.get(key)
+                if entry is None:
+                    continue
+                if status:
+                    entry[1] = status
+                entry[2] = min(entry[2] * 2, self.max_delay)
+                entry[3] = now + entry[2]